@@ -0,0 +1,324 @@
+"""
+Time the main stages of the workflow on synthetic inputs, reporting wall time,
+throughput and peak resident memory of each.
+
+Stages are measured with `trade_flow.instrument.stage`, as the workflow's
+stages are, so these figures are comparable with the workflow's metrics files.
+The measurements of any stages within the library code a stage calls are
+included in the output, under the same names as in those files.
+
+Each stage runs in a fresh process, so peak memory is that of the stage alone
+(and separately, of the largest of any worker processes it started). Stages
+read the outputs of earlier stages from disk.
+
+Usage:
+    python benchmarks/run.py --scale 1 --n-cpu 4 --output benchmark.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable
+
+import geopandas as gpd
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # noqa: E402
+
+from trade_flow.disruption import filter_edges_by_raster, tiled_edge_exposure  # noqa: E402
+from trade_flow import instrument  # noqa: E402
+from trade_flow.graph import intern_vertices  # noqa: E402
+from trade_flow.instrument import stage  # noqa: E402
+from trade_flow.network_creation import (  # noqa: E402
+    create_multi_modal_network, preprocess_maritime_network, preprocess_rail_network, preprocess_road_network
+)
+from trade_flow.route_store import RouteStore  # noqa: E402
+from trade_flow.routing import accumulate_edge_flows, lookup_route_costs, route_from_all_nodes  # noqa: E402
+
+
+# model parameters, as config.yaml
+COST_PARAMETERS = {
+    "road_cost_USD_t_km": 0.05,
+    "road_cost_USD_t_h": 0.48,
+    "road_default_speed_limit_km_h": 80,
+    "rail_cost_USD_t_km": 0.05,
+    "rail_cost_USD_t_h": 0.38,
+    "rail_average_freight_speed_km_h": 40,
+    "intermodal_cost_USD_t": {"road_rail": 5, "maritime_road": 4, "maritime_rail": 5},
+}
+EDGE_FAILURE_THRESHOLD = 0.5
+
+# name of the timed body of the stage running in this process, if any
+timed_stage: str | None = None
+
+
+@contextmanager
+def stage_timer(name: str):
+    """
+    Time the body of a stage, excluding reading its inputs, as instrument
+    stage `name`. Stages which do not use this are timed in full.
+
+    Args:
+        name: Name the workflow records this work under, if it does.
+    """
+    global timed_stage
+    timed_stage = name
+    with stage(name):
+        yield
+
+
+def build_network(paths: dict[str, str], n_cpu: int) -> tuple[int, str]:
+    """
+    Combine road, rail and maritime networks into a multi-modal network, with
+    `create_multi_modal_network`, as workflow/network_creation/multi_modal.py
+    does (without plotting).
+    """
+    study_country = synthetic.STUDY_COUNTRY
+    with stage("multi_modal.preprocess_road"):
+        road_nodes, road_edges = preprocess_road_network(
+            paths["road_nodes"],
+            paths["road_edges"],
+            {study_country,},
+            COST_PARAMETERS["road_cost_USD_t_km"],
+            COST_PARAMETERS["road_cost_USD_t_h"],
+            True,
+            COST_PARAMETERS["road_default_speed_limit_km_h"]
+        )
+    with stage("multi_modal.preprocess_rail"):
+        rail_nodes, rail_edges = preprocess_rail_network(
+            paths["rail_nodes"],
+            paths["rail_edges"],
+            {study_country,},
+            COST_PARAMETERS["rail_cost_USD_t_km"],
+            COST_PARAMETERS["rail_cost_USD_t_h"],
+            True,
+            COST_PARAMETERS["rail_average_freight_speed_km_h"]
+        )
+    maritime_nodes, maritime_edges = preprocess_maritime_network(paths["maritime_nodes"], paths["maritime_edges"])
+    maritime_edges = synthetic.maritime_edge_geometry(maritime_nodes, maritime_edges)
+
+    _, edges, _ = create_multi_modal_network(
+        road_nodes,
+        road_edges,
+        rail_nodes,
+        rail_edges,
+        maritime_nodes,
+        maritime_edges,
+        gpd.read_parquet(paths["country_nodes"]),
+        study_country,
+        COST_PARAMETERS["intermodal_cost_USD_t"],
+    )
+    with stage("multi_modal.write"):
+        vertices, edges = intern_vertices(edges)
+        vertices.to_parquet(paths["vertices"])
+        gpd.GeoDataFrame(edges, crs=4326).to_parquet(paths["edges"])
+    return len(edges), "edges"
+
+
+def route(paths: dict[str, str], n_cpu: int, root: str = "origin", backend: str = "igraph") -> tuple[int, str]:
+    """
+    Route every flow of the OD across the multi-modal network, rooting
+    shortest path trees at `root` with `backend`, see `route_from_all_nodes`.
+    """
+    edges = gpd.read_parquet(paths["edges"])
+    vertices = pd.read_parquet(paths["vertices"])
+    od = pd.read_parquet(paths["od"])
+
+    with stage_timer("route_from_all_nodes"):
+        routes = route_from_all_nodes(od, edges, n_cpu, root=root, vertices=vertices, backend=backend)
+
+    routes.to_parquet(paths["routes"])
+    return len(od), "flows"
+
+
+def edge_flows(paths: dict[str, str], n_cpu: int) -> tuple[int, str]:
+    """
+    Sum route flows over edges.
+    """
+    routes = RouteStore.read_parquet(paths["routes"])
+    n_edges = len(pd.read_parquet(paths["edges"], columns=["cost_USD_t"]))
+
+    with stage_timer("allocate.accumulate_edge_flows"):
+        accumulate_edge_flows(routes.offsets, routes.edge_indices, routes.value_kusd, routes.volume_tons, n_edges)
+
+    return int(routes.route_lengths.sum()), "route edges"
+
+
+def route_costs(paths: dict[str, str], n_cpu: int) -> tuple[int, str]:
+    """
+    Read routes and sum the cost of each.
+    """
+    with stage_timer("lookup_route_costs"):
+        costs = lookup_route_costs(paths["routes"], paths["edges"])
+    return len(costs), "routes"
+
+
+def read_land_edges(path: str) -> gpd.GeoDataFrame:
+    edges = gpd.read_parquet(path)
+    return edges.loc[edges["mode"].isin({"road", "rail"}), :]
+
+
+def hazard_filter(paths: dict[str, str], n_cpu: int) -> tuple[int, str]:
+    """
+    Remove road and rail edges exposed to hazard, in a single process.
+    """
+    edges = read_land_edges(paths["edges"])
+
+    with stage_timer("filter_edges_by_raster"):
+        filter_edges_by_raster(edges, paths["raster"], EDGE_FAILURE_THRESHOLD)
+
+    return len(edges), "edges"
+
+
+def tiled_hazard_exposure(paths: dict[str, str], n_cpu: int) -> tuple[int, str]:
+    """
+    Find exposure of road and rail edges to hazard, by raster tile in parallel.
+    """
+    edges = read_land_edges(paths["edges"])
+
+    with stage_timer("tiled_edge_exposure"):
+        tiled_edge_exposure(edges, paths["raster"], n_cpu, tile_size=256)
+
+    return len(edges), "edges"
+
+
+STAGES: dict[str, Callable[[dict[str, str], int], tuple[int, str]]] = {
+    "build_network": build_network,
+    # each routing stage writes routes for the later stages, with the config.yaml defaults
+    # (origin root, igraph) last, so those stages read the routes the workflow would produce
+    "route_from_all_nodes_destination": partial(route, root="destination"),
+    "route_from_all_nodes_scipy": partial(route, backend="scipy"),
+    "route_from_all_nodes": route,
+    "accumulate_edge_flows": edge_flows,
+    "lookup_route_costs": route_costs,
+    "filter_edges_by_raster": hazard_filter,
+    "tiled_edge_exposure": tiled_hazard_exposure,
+}
+
+
+def run_stage(name: str, paths: dict[str, str], n_cpu: int, results: multiprocessing.Queue) -> None:
+    """
+    Run a stage and put its measurements on `results`. Run in a fresh process.
+    """
+    # prefixed, so as not to add to the workflow stage of the same name
+    with stage(f"benchmark.{name}"):
+        n_items, unit = STAGES[name](paths, n_cpu)
+
+    metrics = instrument.metrics_summary()
+    timed = metrics["stages"][timed_stage or f"benchmark.{name}"]
+    worker_peaks = [stage_workers["peak_worker_rss_mb"] for stage_workers in metrics["workers"].values()]
+    results.put(
+        {
+            "stage": name,
+            "timed_stage": timed_stage or f"benchmark.{name}",
+            "wall_time_s": timed["wall_time_s"],
+            "cpu_time_s": timed["cpu_time_s"],
+            "items": n_items,
+            "unit": unit,
+            "throughput_per_s": n_items / timed["wall_time_s"] if timed["wall_time_s"] > 0 else float("nan"),
+            "peak_rss_mb": timed["peak_rss_mb"],
+            "peak_worker_rss_mb": max(worker_peaks) if worker_peaks else None,
+            "metrics": metrics,
+        }
+    )
+    return
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1, help="Multiple of default input size")
+    parser.add_argument("--n-cpu", type=int, default=os.cpu_count(), help="Number of CPUs for parallel stages")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for synthetic inputs")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run")
+    parser.add_argument("--data-dir", help="Directory for inputs and outputs, temporary if not given")
+    parser.add_argument("--output", help="Path to write results to as JSON")
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.data_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        data_dir = temp_dir.name
+    else:
+        data_dir = args.data_dir
+
+    scale = synthetic.Scale.scaled(args.scale)
+    print(f"Writing synthetic inputs at {scale}...")
+    paths = synthetic.write_inputs(data_dir, scale, args.seed)
+    paths.update(
+        {
+            "edges": os.path.join(data_dir, "edges.gpq"),
+            "vertices": os.path.join(data_dir, "vertices.parquet"),
+            "routes": os.path.join(data_dir, "routes.pq"),
+        }
+    )
+
+    # stages depend on outputs of earlier stages, always run in order
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    measurements = []
+    for name in [stage for stage in STAGES if stage in args.stages]:
+        print(f"Running {name}...")
+        process = context.Process(target=run_stage, args=(name, paths, args.n_cpu, results))
+        process.start()
+        while True:
+            try:
+                measurement = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"{name} failed with exit code {process.exitcode}")
+        process.join()
+        measurements.append(measurement)
+
+    table = pd.DataFrame(measurements).drop(columns=["metrics"]).set_index("stage")
+    with pd.option_context("display.float_format", "{:,.2f}".format, "display.max_columns", None, "display.width", 200):
+        print(table)
+
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "revision": git_revision(),
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "n_cpu": args.n_cpu,
+                    "seed": args.seed,
+                    "scale": args.scale,
+                    "sizes": vars(scale),
+                    "stages": measurements,
+                },
+                fp,
+                indent=2
+            )
+
+    if temp_dir is not None:
+        temp_dir.cleanup()
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Generate synthetic road, rail and maritime networks, trade OD and a hazard
+raster, in the schema of the workflow's input files, for benchmarking.
+
+The study country is a square grid of road nodes. Its last column of nodes
+lies across a land border, in a neighbouring country. A coarser rail grid
+overlays the road grid, and ports at two corners connect by sea to a foreign
+port in each partner country.
+"""
+
+import os
+from dataclasses import dataclass
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+STUDY_COUNTRY = "AAA"
+NEIGHBOUR_COUNTRY = "BBB"
+
+# south west corner of study country, in degrees
+ORIGIN_X = 100.0
+ORIGIN_Y = 13.0
+# distance between road nodes, in degrees (~1km)
+ROAD_SPACING = 0.01
+
+
+@dataclass
+class Scale:
+    """
+    Size of synthetic inputs.
+    """
+    # number of road nodes along each side of study country grid
+    road_grid: int = 100
+    # number of road grid cells between rail nodes
+    rail_step: int = 5
+    # number of partner countries (other than the land neighbour)
+    n_partners: int = 20
+    # number of flows in OD
+    n_flows: int = 20_000
+    # number of pixels along each side of hazard raster
+    raster_size: int = 2_000
+
+    @classmethod
+    def scaled(cls, scale: float) -> "Scale":
+        """
+        Args:
+            scale: Multiple of default number of road nodes, flows and pixels.
+
+        Returns:
+            Scale with networks and raster growing in area, and flows in
+                number, with `scale`.
+        """
+        default = cls()
+        return cls(
+            road_grid=max(4, round(default.road_grid * np.sqrt(scale))),
+            rail_step=default.rail_step,
+            n_partners=default.n_partners,
+            n_flows=max(1, round(default.n_flows * scale)),
+            raster_size=max(16, round(default.raster_size * np.sqrt(scale))),
+        )
+
+
+def partner_countries(n_partners: int) -> list[str]:
+    """
+    Args:
+        n_partners: Number of partner countries reached by sea.
+
+    Returns:
+        ISO A3 style codes of neighbour and partner countries.
+    """
+    return [NEIGHBOUR_COUNTRY] + [f"P{i:02d}" for i in range(n_partners)]
+
+
+def grid_edges(n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    Args:
+        n_rows: Number of rows of nodes.
+        n_cols: Number of columns of nodes.
+
+    Returns:
+        Array of (from, to) node positions, linking each node to its
+            neighbours to the east and north. Nodes are numbered row by row.
+    """
+    positions = np.arange(n_rows * n_cols).reshape(n_rows, n_cols)
+    east = np.column_stack([positions[:, :-1].ravel(), positions[:, 1:].ravel()])
+    north = np.column_stack([positions[:-1, :].ravel(), positions[1:, :].ravel()])
+    return np.concatenate([east, north])
+
+
+def road_network(scale: Scale, rng: np.random.Generator) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Args:
+        scale: Size of network.
+        rng: Random number generator.
+
+    Returns:
+        Road nodes and (undirected) edges, as read by
+            `trade_flow.network_creation.preprocess_road_network`.
+    """
+    n = scale.road_grid
+    rows, cols = np.divmod(np.arange(n * n), n)
+    xy = np.column_stack([ORIGIN_X + cols * ROAD_SPACING, ORIGIN_Y + rows * ROAD_SPACING])
+    iso_a3 = np.where(cols == n - 1, NEIGHBOUR_COUNTRY, STUDY_COUNTRY)
+    nodes = gpd.GeoDataFrame(
+        {"id": np.arange(n * n), "iso_a3": iso_a3},
+        geometry=shapely.points(xy),
+        crs=4326
+    )
+
+    from_id, to_id = grid_edges(n, n).T
+    edges = gpd.GeoDataFrame(
+        {
+            "id": np.arange(len(from_id)),
+            "from_id": from_id,
+            "to_id": to_id,
+            "from_iso_a3": iso_a3[from_id],
+            "to_iso_a3": iso_a3[to_id],
+            # a mix of clean, unit suffixed and missing speed limits
+            "tag_maxspeed": rng.choice(np.array(["50", "80", "90", "60 mph", None], dtype=object), len(from_id)),
+        },
+        geometry=shapely.linestrings(np.stack([xy[from_id], xy[to_id]], axis=1)),
+        crs=4326
+    )
+    return nodes, edges
+
+
+def rail_network(scale: Scale, rng: np.random.Generator) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """
+    Args:
+        scale: Size of network.
+        rng: Random number generator.
+
+    Returns:
+        Rail nodes and (undirected) edges, within the study country, as read
+            by `trade_flow.network_creation.preprocess_rail_network`.
+    """
+    n = max(2, (scale.road_grid - 1) // scale.rail_step)
+    rows, cols = np.divmod(np.arange(n * n), n)
+    # offset from road nodes, so intermodal links have some length
+    spacing = ROAD_SPACING * scale.rail_step
+    xy = np.column_stack([ORIGIN_X + cols * spacing + 0.002, ORIGIN_Y + rows * spacing + 0.002])
+    nodes = gpd.GeoDataFrame(
+        {
+            "id": np.arange(n * n),
+            "iso_a3": STUDY_COUNTRY,
+            "station": rng.random(n * n) < 0.3,
+        },
+        geometry=shapely.points(xy),
+        crs=4326
+    )
+
+    from_id, to_id = grid_edges(n, n).T
+    edges = gpd.GeoDataFrame(
+        {
+            "id": np.arange(len(from_id)),
+            "from_id": from_id,
+            "to_id": to_id,
+            "from_iso_a3": STUDY_COUNTRY,
+            "to_iso_a3": STUDY_COUNTRY,
+        },
+        geometry=shapely.linestrings(np.stack([xy[from_id], xy[to_id]], axis=1)),
+        crs=4326
+    )
+    return nodes, edges
+
+
+def maritime_network(scale: Scale, rng: np.random.Generator) -> tuple[gpd.GeoDataFrame, pd.DataFrame]:
+    """
+    Args:
+        scale: Size of network.
+        rng: Random number generator.
+
+    Returns:
+        Maritime nodes and edges (without geometry), as read by
+            `trade_flow.network_creation.preprocess_maritime_network`.
+    """
+    top = ORIGIN_Y + (scale.road_grid - 1) * ROAD_SPACING
+    domestic_xy = np.array([[ORIGIN_X - 0.005, ORIGIN_Y - 0.005], [ORIGIN_X - 0.005, top + 0.005]])
+    foreign_xy = np.column_stack(
+        [rng.uniform(40, 160, scale.n_partners), rng.uniform(-30, 50, scale.n_partners)]
+    )
+    port_xy = np.concatenate([domestic_xy, foreign_xy])
+    port_iso_a3 = np.array([STUDY_COUNTRY] * len(domestic_xy) + partner_countries(scale.n_partners)[1:])
+    port_ids = np.array([f"port{i}" for i in range(len(port_xy))])
+    nodes = gpd.GeoDataFrame(
+        {
+            "id": port_ids,
+            "name": [f"Port_{i}_{iso}" for i, iso in enumerate(port_iso_a3)],
+            "iso3": port_iso_a3,
+            "infra": "port",
+            "Continent_Code": "AS",
+        },
+        geometry=shapely.points(port_xy),
+        crs=4326
+    )
+
+    # every domestic port trades with every foreign port, in both directions
+    domestic, foreign = np.meshgrid(np.arange(len(domestic_xy)), np.arange(len(domestic_xy), len(port_xy)))
+    from_port = np.concatenate([domestic.ravel(), foreign.ravel()])
+    to_port = np.concatenate([foreign.ravel(), domestic.ravel()])
+    voyages = pd.DataFrame(
+        {
+            "from_id": np.char.add(port_ids[from_port], "_out"),
+            "to_id": np.char.add(port_ids[to_port], "_in"),
+            "from_port": port_ids[from_port],
+            "to_port": port_ids[to_port],
+            "from_iso3": port_iso_a3[from_port],
+            "to_iso3": port_iso_a3[to_port],
+            "distance_km": np.linalg.norm(port_xy[from_port] - port_xy[to_port], axis=1) * 111,
+        }
+    )
+    # moving between land and sea sides of a port
+    all_ports = np.arange(len(port_xy))
+    port_calls = pd.DataFrame(
+        {
+            "from_id": np.concatenate([np.char.add(port_ids, "_land"), np.char.add(port_ids, "_in")]),
+            "to_id": np.concatenate([np.char.add(port_ids, "_out"), np.char.add(port_ids, "_land")]),
+            "from_port": np.tile(port_ids, 2),
+            "to_port": np.tile(port_ids, 2),
+            "from_iso3": np.tile(port_iso_a3[all_ports], 2),
+            "to_iso3": np.tile(port_iso_a3[all_ports], 2),
+            "distance_km": 1.0,
+        }
+    )
+    edges = pd.concat([voyages, port_calls], ignore_index=True)
+    edges["cost_USD_t_km"] = 0.01
+    return nodes, edges
+
+
+def maritime_edge_geometry(nodes: gpd.GeoDataFrame, edges: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    Give maritime edges straight line geometry between their ports, in place
+    of the route geometry estimated by `trade_flow.maritime`.
+
+    Args:
+        nodes: Preprocessed maritime nodes, port ids suffixed with '_land'.
+        edges: Preprocessed maritime edges.
+
+    Returns:
+        Maritime edges with geometry.
+    """
+    port_xy = pd.DataFrame(
+        shapely.get_coordinates(nodes.geometry.to_numpy()),
+        index=nodes.id.str.removesuffix("_land"),
+    )
+    from_xy = port_xy.loc[edges.from_port].to_numpy()
+    to_xy = port_xy.loc[edges.to_port].to_numpy()
+    return gpd.GeoDataFrame(
+        edges,
+        geometry=shapely.linestrings(np.stack([from_xy, to_xy], axis=1)),
+        crs=4326
+    )
+
+
+def country_nodes(scale: Scale) -> gpd.GeoDataFrame:
+    """
+    Args:
+        scale: Size of network.
+
+    Returns:
+        Destination country nodes, with 'id', 'iso_a3' and 'geometry' columns.
+    """
+    iso_a3 = partner_countries(scale.n_partners)
+    # neighbour to the east of the study country, others anywhere
+    x = ORIGIN_X + scale.road_grid * ROAD_SPACING + 0.5 + np.arange(len(iso_a3))
+    return gpd.GeoDataFrame(
+        {"id": [f"GID_0_{iso}" for iso in iso_a3], "iso_a3": iso_a3},
+        geometry=shapely.points(x, np.full(len(iso_a3), ORIGIN_Y)),
+        crs=4326
+    )
+
+
+def trade_od(scale: Scale, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Args:
+        scale: Size of OD.
+        rng: Random number generator.
+
+    Returns:
+        Flows from road nodes of the study country to partner countries, with
+            'id', 'partner_GID_0', 'value_kusd' and 'volume_tons' columns.
+    """
+    n = scale.road_grid
+    rows, cols = np.divmod(np.arange(n * n), n)
+    origins = np.flatnonzero(cols < n - 1)
+    partners = np.array(partner_countries(scale.n_partners))
+
+    n_pairs = len(origins) * len(partners)
+    pairs = rng.choice(n_pairs, size=min(scale.n_flows, n_pairs), replace=False)
+    origin_positions, partner_positions = np.divmod(np.sort(pairs), len(partners))
+    volume_tons = rng.lognormal(mean=5, sigma=2, size=len(pairs))
+    return pd.DataFrame(
+        {
+            "id": origins[origin_positions],
+            "partner_GID_0": partners[partner_positions],
+            "value_kusd": volume_tons * rng.uniform(0.1, 10, len(pairs)),
+            "volume_tons": volume_tons,
+        }
+    )
+
+
+def write_hazard_raster(path: str, scale: Scale, rng: np.random.Generator) -> None:
+    """
+    Write a GeoTIFF covering the study country, of zero depth except for a
+    handful of circular flooded areas, to `path`.
+
+    Args:
+        path: Path to write raster to.
+        scale: Size of raster.
+        rng: Random number generator.
+    """
+    import rasterio
+    from rasterio.transform import from_bounds
+
+    size = scale.raster_size
+    extent = scale.road_grid * ROAD_SPACING
+    col, row = np.meshgrid(np.arange(size, dtype=np.float32), np.arange(size, dtype=np.float32))
+    depth = np.zeros((size, size), dtype=np.float32)
+    for _ in range(8):
+        centre_col, centre_row = rng.uniform(0, size, 2)
+        radius = rng.uniform(0.02, 0.1) * size
+        distance = np.hypot(col - centre_col, row - centre_row)
+        depth = np.maximum(depth, np.clip(2 * (1 - distance / radius), 0, None))
+
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=size,
+        width=size,
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_bounds(
+            ORIGIN_X - 0.5 * ROAD_SPACING,
+            ORIGIN_Y - 0.5 * ROAD_SPACING,
+            ORIGIN_X - 0.5 * ROAD_SPACING + extent,
+            ORIGIN_Y - 0.5 * ROAD_SPACING + extent,
+            size,
+            size
+        ),
+        nodata=-9999,
+        tiled=True,
+        compress="lzw",
+    ) as dataset:
+        dataset.write(depth, 1)
+    return
+
+
+def write_inputs(directory: str, scale: Scale, seed: int = 0) -> dict[str, str]:
+    """
+    Generate and write all synthetic inputs.
+
+    Args:
+        directory: Directory to write inputs to.
+        scale: Size of inputs.
+        seed: Random seed, the same seed and scale give the same inputs.
+
+    Returns:
+        Mapping from input name to path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {
+        name: os.path.join(directory, filename) for name, filename in [
+            ("road_nodes", "road_nodes.gpq"),
+            ("road_edges", "road_edges.gpq"),
+            ("rail_nodes", "rail_nodes.gpq"),
+            ("rail_edges", "rail_edges.gpq"),
+            ("maritime_nodes", "maritime_nodes.gpq"),
+            ("maritime_edges", "maritime_edges.pq"),
+            ("country_nodes", "country_nodes.gpq"),
+            ("od", "od.pq"),
+            ("raster", "hazard.tif"),
+        ]
+    }
+
+    for name, network in [("road", road_network), ("rail", rail_network), ("maritime", maritime_network)]:
+        nodes, edges = network(scale, rng)
+        nodes.to_parquet(paths[f"{name}_nodes"])
+        edges.to_parquet(paths[f"{name}_edges"])
+    country_nodes(scale).to_parquet(paths["country_nodes"])
+    trade_od(scale, rng).to_parquet(paths["od"])
+    write_hazard_raster(paths["raster"], scale, rng)
+
+    return paths
@@ -0,0 +1,295 @@
+"""
+Rank edges of a network by the cost to trade of losing each one in turn.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import partial
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from trade_flow.graph import CSRGraph, attach_arrays, edge_vertex_ids, publish_arrays
+from trade_flow.instrument import TaskTiming, record_task, stage, task_clock, task_timing
+from trade_flow.route_store import RouteStore
+from trade_flow.routing import make_batches
+
+
+@dataclass
+class EdgeRouteIndex:
+    """
+    Inverted index from edges to the routes traversing them, with those
+    routes' flows and costs.
+
+    The routes traversing `edges[i]` are `route_ids[offsets[i]: offsets[i + 1]]`,
+    which index into the per-route arrays.
+    """
+    # sorted unique edge ids
+    edges: np.ndarray
+    offsets: np.ndarray
+    route_ids: np.ndarray
+    # per-route arrays
+    origin_vid: np.ndarray
+    destination_vid: np.ndarray
+    value_kusd: np.ndarray
+    volume_tons: np.ndarray
+    cost_USD_t: np.ndarray
+
+    @classmethod
+    def from_routes(
+        cls,
+        routes: RouteStore,
+        origin_vid: np.ndarray,
+        destination_vid: np.ndarray,
+        edge_costs_USD_t: np.ndarray,
+        edge_mask: np.ndarray,
+    ) -> "EdgeRouteIndex":
+        """
+        Args:
+            routes: Routes to index, edge indices should be positions in graph.
+            origin_vid: Origin vertex ID of each route.
+            destination_vid: Destination vertex ID of each route.
+            edge_costs_USD_t: Cost of traversing each edge of graph.
+            edge_mask: Boolean array, one element per edge of graph, True for
+                edges to index.
+
+        Returns:
+            Index of edges in `edge_mask` to routes traversing them.
+        """
+        edge_indices = routes.edge_indices[routes.offsets[0]: routes.offsets[-1]]
+        route_ids = np.repeat(np.arange(len(routes), dtype=np.int32), routes.route_lengths)
+        route_costs_USD_t = np.bincount(route_ids, weights=edge_costs_USD_t[edge_indices], minlength=len(routes))
+
+        # a route may only traverse an edge once, so no need to deduplicate
+        indexed = edge_mask[edge_indices]
+        edge_indices = edge_indices[indexed]
+        route_ids = route_ids[indexed]
+        order = np.argsort(edge_indices, kind="stable")
+        edges, counts = np.unique(edge_indices, return_counts=True)
+        offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(
+            edges=edges.astype(np.int64),
+            offsets=offsets,
+            route_ids=route_ids[order],
+            origin_vid=np.asarray(origin_vid, dtype=np.int32),
+            destination_vid=np.asarray(destination_vid, dtype=np.int32),
+            value_kusd=np.asarray(routes.value_kusd, dtype=np.float64),
+            volume_tons=np.asarray(routes.volume_tons, dtype=np.float64),
+            cost_USD_t=route_costs_USD_t,
+        )
+
+    def routes(self, edge: int) -> np.ndarray:
+        """
+        Args:
+            edge: Edge id to lookup routes for.
+
+        Returns:
+            IDs of routes traversing `edge`.
+        """
+        i = np.searchsorted(self.edges, edge)
+        return self.route_ids[self.offsets[i]: self.offsets[i + 1]]
+
+
+def init_worker(graph_dir: str, index_dir: str) -> None:
+    """
+    Create global variables referencing graph and edge route index to persist
+    through worker lifetime.
+
+    Args:
+        graph_dir: Directory CSRGraph arrays have been published to.
+        index_dir: Directory EdgeRouteIndex arrays have been published to.
+    """
+    print(f"Process {os.getpid()} initialising...")
+    csr_graph = attach_arrays(CSRGraph, graph_dir)
+    global graph, weight
+    graph = csr_graph.to_igraph()
+    # edges are removed by changing their weight, so take a private, writable copy
+    weight = np.array(csr_graph.weight)
+    global index
+    index = attach_arrays(EdgeRouteIndex, index_dir)
+    return
+
+
+def remove_edge(edge: int, root: str) -> tuple[int, float, float, float, float]:
+    """
+    Remove an edge from the graph (by giving it infinite weight), and find the
+    new least cost of every route which traversed it.
+
+    Args:
+        edge: ID of edge to remove.
+        root: 'origin' to run one shortest path search per origin of the
+            disrupted routes, or 'destination' to run one per destination over
+            the reversed graph.
+
+    Returns:
+        Edge ID, sum over rerouted flows of change in cost multiplied by
+            volume (USD), number of unroutable flows, and the value and volume
+            of those flows.
+    """
+    route_ids: np.ndarray = index.routes(edge)
+    origin_vid = index.origin_vid[route_ids]
+    destination_vid = index.destination_vid[route_ids]
+
+    intact_weight = weight[edge]
+    weight[edge] = np.inf
+    try:
+        cost_USD_t = np.full(len(route_ids), np.inf)
+        key_vid, other_vid, mode = {
+            "origin": (origin_vid, destination_vid, "out"),
+            "destination": (destination_vid, origin_vid, "in"),
+        }[root]
+        for key in np.unique(key_vid):
+            flows, = np.nonzero(key_vid == key)
+            targets, target_positions = np.unique(other_vid[flows], return_inverse=True)
+            distances = graph.distances(
+                source=[int(key)],
+                target=targets.tolist(),
+                weights=weight,
+                mode=mode
+            )[0]
+            cost_USD_t[flows] = np.asarray(distances)[target_positions]
+    finally:
+        weight[edge] = intact_weight
+
+    # any route still costing infinity must have traversed the removed edge
+    unroutable = ~np.isfinite(cost_USD_t)
+    volume_tons = index.volume_tons[route_ids]
+    delta_cost_USD = ((cost_USD_t - index.cost_USD_t[route_ids]) * volume_tons)[~unroutable].sum()
+    return (
+        edge,
+        delta_cost_USD,
+        unroutable.sum(),
+        index.value_kusd[route_ids][unroutable].sum(),
+        volume_tons[unroutable].sum(),
+    )
+
+
+def remove_edge_batch(
+    root: str,
+    edges: np.ndarray
+) -> tuple[list[tuple[int, float, float, float, float]], TaskTiming]:
+    """
+    Args:
+        root: 'origin' or 'destination', see `remove_edge`.
+        edges: IDs of edges to remove, one at a time.
+
+    Returns:
+        Result of `remove_edge` for each edge, and the time taken.
+    """
+    start = task_clock()
+    return [remove_edge(edge, root) for edge in edges], task_timing(start)
+
+
+def edge_criticality(
+    routes: RouteStore,
+    edges: gpd.GeoDataFrame,
+    n_cpu: int,
+    modes: tuple[str, ...] = ("road", "rail"),
+    root: str = "destination",
+    batch_size: int = 1_000,
+    vertices: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    For every edge of the given modes which carries flow, remove that edge
+    alone from the network, reroute the flows which crossed it and measure
+    the cost of doing so.
+
+    Args:
+        routes: Routes across intact network, as output by
+            `trade_flow.routing.route_from_all_nodes`. Edge indices should be
+            positions in `edges`.
+        edges: Table of edges the routes were found across. First column
+            should be source node id and second destination node id. Should
+            also contain 'mode' and 'cost_USD_t' columns.
+        n_cpu: Number of CPUs to use.
+        modes: Edges of these modes will be removed in turn.
+        root: 'origin' to run one shortest path search per origin of the
+            disrupted routes, or 'destination' to run one per destination
+            country over the reversed graph. The latter is typically faster.
+        batch_size: Target number of disrupted routes in each task sent to a
+            worker.
+        vertices: Table of vertices with 'vid' and 'id' columns. See
+            `trade_flow.routing.route_from_all_nodes`.
+
+    Returns:
+        Table indexed by edge (index label in `edges`), of edges ranked by
+            'delta_cost_USD', the increase in cost of rerouted flows (change
+            in route cost_USD_t multiplied by volume, summed over rerouted
+            flows). Also includes the flow (value and volume) across the edge,
+            the number of routes crossing it and the number, value and volume
+            of flows left unroutable by its removal.
+    """
+    if root not in {"origin", "destination"}:
+        raise ValueError(f"{root=} not recognised, must be 'origin' or 'destination'")
+
+    print("Creating graph...")
+    edge_source, edge_target, vertex_names = edge_vertex_ids(edges, vertices)
+    graph = CSRGraph.from_arrays(edge_source, edge_target, edges.cost_USD_t, len(vertex_names))
+    vertex_index = pd.Index(vertex_names)
+
+    print("Indexing routes by edge...")
+    # routes with no edges were unroutable even on the intact network
+    routes = routes.take(np.flatnonzero(routes.route_lengths > 0))
+    index = EdgeRouteIndex.from_routes(
+        routes,
+        vertex_index.get_indexer("road_" + pd.Series(routes.source_node).astype(str)),
+        vertex_index.get_indexer(routes.destination_node),
+        graph.weight,
+        edges["mode"].isin(modes).to_numpy(),
+    )
+    n_routes = np.diff(index.offsets)
+    print(f"{len(index.edges):,d} edges of {modes} carry flow")
+
+    temp_dir = tempfile.TemporaryDirectory()
+    print("Writing graph and index to disk...")
+    graph_dir = os.path.join(temp_dir.name, "graph")
+    publish_arrays(graph, graph_dir)
+    index_dir = os.path.join(temp_dir.name, "index")
+    publish_arrays(index, index_dir)
+
+    # size batches by number of routes to reroute, and process the largest first
+    batches = make_batches(index.edges, n_routes, batch_size)
+    print(f"Removing {len(index.edges):,d} edges in {len(batches):,d} batches...")
+
+    start = time.time()
+    results = []
+    with stage("edge_criticality.sweep"), multiprocessing.Pool(
+        processes=n_cpu,
+        initializer=init_worker,
+        initargs=(graph_dir, index_dir),
+    ) as pool:
+        with tqdm(total=len(index.edges), unit="edge") as progress:
+            for batch_results, timing in pool.imap_unordered(partial(remove_edge_batch, root), batches):
+                results.extend(batch_results)
+                progress.update(len(batch_results))
+                record_task("edge_criticality.sweep", len(batch_results), timing)
+
+    print(f"Criticality sweep completed in {time.time() - start:.2f}s")
+    temp_dir.cleanup()
+
+    criticality = pd.DataFrame(
+        results,
+        columns=[
+            "edge",
+            "delta_cost_USD",
+            "unroutable_flows",
+            "unroutable_value_kusd",
+            "unroutable_volume_tons",
+        ]
+    ).set_index("edge").sort_index()
+
+    route_ids = index.route_ids
+    edge_position = np.repeat(np.arange(len(index.edges)), n_routes)
+    criticality["routes"] = n_routes
+    criticality["value_kusd"] = np.bincount(edge_position, weights=index.value_kusd[route_ids], minlength=len(index.edges))
+    criticality["volume_tons"] = np.bincount(edge_position, weights=index.volume_tons[route_ids], minlength=len(index.edges))
+    criticality.index = pd.Index(edges.index[criticality.index], name="edge")
+
+    return criticality.sort_values("delta_cost_USD", ascending=False)
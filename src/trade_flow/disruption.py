@@ -1,67 +1,498 @@
+import multiprocessing
+import os
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import rasterio
+import shapely
+from rasterio.windows import Window
+from tqdm import tqdm
 
 import snail.intersection
 
+from trade_flow.graph import fingerprint_arrays
+from trade_flow.instrument import TaskTiming, record_task, stage, task_clock, task_timing
 
-def filter_edges_by_raster(
-    edges: gpd.GeoDataFrame,
+
+def read_raster_values(
     raster_path: str,
-    failure_threshold: float,
-    band: int = 1
-) -> gpd.GeoDataFrame:
+    index_i: np.ndarray,
+    index_j: np.ndarray,
+    band: int = 1,
+    tile_size: int = 1024,
+) -> np.ndarray:
     """
-    Remove edges from a network that are exposed to gridded values in excess of
-    a given threshold.
+    Read raster values at the given pixel indices, without reading the whole
+    raster into memory.
+
+    Pixels are grouped into tiles of `tile_size` x `tile_size`, and for each
+    tile containing any pixels, the smallest window covering them is read.
+    Peak memory is therefore bounded by the tile size, and total data read by
+    the footprint of the pixels requested.
 
     Args:
-        edges: Network edges to consider. Must contain geometry column containing linestrings.
         raster_path: Path to raster file on disk, openable by rasterio.
-        failure_threshold: Edges experiencing a raster value in excess of this will be
-            removed from the network.
+        index_i: Column (x) index of each pixel to read.
+        index_j: Row (y) index of each pixel to read.
         band: Band of raster to read data from.
+        tile_size: Maximum width and height of windows to read, in pixels.
 
     Returns:
-        Network without edges experiencing raster values in excess of threshold.
+        Raster value of each pixel, NaN for pixels outside the raster or
+            equal to the raster's nodata value.
     """
+    index_i = np.asarray(index_i, dtype=np.int64)
+    index_j = np.asarray(index_j, dtype=np.int64)
+    values = np.full(len(index_i), np.nan)
 
-    # we will create a new edge_id column, fail if we would overwrite
-    assert "edge_id" not in edges.columns
+    with rasterio.open(raster_path) as dataset:
+        in_raster = (index_i >= 0) & (index_i < dataset.width) & (index_j >= 0) & (index_j < dataset.height)
+        pixels, = np.nonzero(in_raster)
+        if len(pixels) == 0:
+            return values
 
-    # split out edges without geometry as snail will not handle them gracefully
-    print("Parition edges by existence of geometry...")
-    no_geom_edges = edges.loc[edges.geometry.type.isin({None}), :].copy()
-    with_geom_edges = edges.loc[~edges.geometry.type.isin({None}), :].copy()
+        # sort pixels by tile, so each tile's pixels are contiguous
+        tiles_wide = int(np.ceil(dataset.width / tile_size))
+        tile_ids = (index_j[pixels] // tile_size) * tiles_wide + index_i[pixels] // tile_size
+        order = np.argsort(tile_ids, kind="stable")
+        pixels = pixels[order]
+        _, starts = np.unique(tile_ids[order], return_index=True)
+
+        for tile_pixels in np.split(pixels, starts[1:]):
+            i = index_i[tile_pixels]
+            j = index_j[tile_pixels]
+            col_off, row_off = i.min(), j.min()
+            window = Window(col_off, row_off, i.max() - col_off + 1, j.max() - row_off + 1)
+            data = dataset.read(band, window=window)
+            values[tile_pixels] = data[j - row_off, i - col_off]
+
+        if dataset.nodata is not None:
+            values[values == dataset.nodata] = np.nan
+
+    return values
+
+
+def split_edges_by_grid(
+    edges: gpd.GeoDataFrame,
+    grid: snail.intersection.GridDefinition,
+    cache_dir: str | None = None,
+) -> pd.DataFrame:
+    """
+    Split edges where they cross the cells of a raster grid, and find the
+    raster indices of each split.
+
+    Splits depend only on the edges' geometry and the grid, not on raster
+    values, so may be reused for every raster sharing a grid.
+
+    Args:
+        edges: Network edges to split. Geometry should be linestrings, without
+            nulls.
+        grid: Grid to split edges on.
+        cache_dir: If given, store splits here, keyed by the content of the
+            edges' geometry and the grid. Splits already in the cache are not
+            computed again.
+
+    Returns:
+        Table of splits with 'edge_id' (position in `edges`), 'index_i',
+            'index_j' and 'length' (in units of grid CRS) columns.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        grid_description = f"{grid.crs}|{grid.width}|{grid.height}|{tuple(grid.transform)}"
+        fingerprint = fingerprint_arrays(
+            np.frombuffer(b"".join(shapely.to_wkb(edges.geometry.to_numpy())), dtype=np.uint8),
+            np.frombuffer(grid_description.encode(), dtype=np.uint8),
+        )
+        cache_path = os.path.join(cache_dir, f"{fingerprint}.parquet")
+        if os.path.exists(cache_path):
+            return pd.read_parquet(cache_path)
 
     # we need an id to select edges by
-    with_geom_edges["edge_id"] = range(len(with_geom_edges))
+    edges = gpd.GeoDataFrame({"edge_id": np.arange(len(edges))}, geometry=edges.geometry.to_numpy(), crs=edges.crs)
+
+    edges = snail.intersection.prepare_linestrings(edges)
+    splits = snail.intersection.split_linestrings(edges, grid)
+    splits = snail.intersection.apply_indices(splits, grid)
+
+    splits = pd.DataFrame(
+        {
+            "edge_id": splits.edge_id.to_numpy(dtype=np.int64),
+            "index_i": splits.index_i.to_numpy(dtype=np.int64),
+            "index_j": splits.index_j.to_numpy(dtype=np.int64),
+            "length": shapely.length(splits.geometry.to_numpy()),
+        }
+    )
+
+    if cache_path is not None:
+        splits.to_parquet(f"{cache_path}.tmp")
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    return splits
+
+
+def summarise_exposure(splits: pd.DataFrame, values: np.ndarray, n_edges: int) -> pd.DataFrame:
+    """
+    Args:
+        splits: Table of splits, as output by `split_edges_by_grid`.
+        values: Raster value of each split, NaN where missing.
+        n_edges: Number of edges split.
+
+    Returns:
+        Table of 'max_value', 'mean_value' and 'exposed_fraction' for each
+            edge, by position. See `edge_exposure`.
+    """
+    edge_positions = splits.edge_id.to_numpy()
+    length = splits.length.to_numpy()
+    has_value = ~np.isnan(values)
+
+    def sum_by_edge(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(edge_positions, weights=weights, minlength=n_edges)
+
+    max_value = np.full(n_edges, -np.inf)
+    np.maximum.at(max_value, edge_positions[has_value], values[has_value])
+    max_value[np.isneginf(max_value)] = np.nan
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_value = sum_by_edge(np.where(has_value, values * length, 0)) / sum_by_edge(np.where(has_value, length, 0))
+        exposed_fraction = sum_by_edge(np.where(has_value & (values > 0), length, 0)) / sum_by_edge(length)
+
+    return pd.DataFrame(
+        {
+            "max_value": max_value,
+            "mean_value": mean_value,
+            "exposed_fraction": np.nan_to_num(exposed_fraction),
+        }
+    )
+
+
+def label_exposure(exposure: pd.DataFrame, edges: gpd.GeoDataFrame, has_geometry: np.ndarray) -> pd.DataFrame:
+    """
+    Args:
+        exposure: Exposure of each edge, by position in `edges`.
+        edges: Edges exposure was found for.
+        has_geometry: Boolean array, True for edges with geometry.
+
+    Returns:
+        Exposure indexed as `edges`, with 'exposed_length_km' if possible.
+    """
+    exposure = exposure.set_axis(edges.index)
+    exposure.loc[~has_geometry, "exposed_fraction"] = np.nan
+    if "distance_km" in edges.columns:
+        exposure["exposed_length_km"] = exposure.exposed_fraction * edges.distance_km
+    return exposure
+
+
+def edge_exposure(
+    edges: gpd.GeoDataFrame,
+    raster_path: str,
+    band: int = 1,
+    cache_dir: str | None = None,
+) -> pd.DataFrame:
+    """
+    Summarise the raster values each edge of a network is exposed to.
+
+    Args:
+        edges: Network edges to consider. Must contain geometry column
+            containing linestrings. If edges have a 'distance_km' column, the
+            exposed length is also given in km.
+        raster_path: Path to raster file on disk, openable by rasterio.
+        band: Band of raster to read data from.
+        cache_dir: If given, cache splits of edges by raster grid here, see
+            `split_edges_by_grid`.
+
+    Returns:
+        Table indexed as `edges` with columns 'max_value', 'mean_value'
+            (weighted by length of edge with a value), 'exposed_fraction' (of
+            length of edge, where value is greater than zero) and, if
+            possible, 'exposed_length_km'. Edges without geometry, or outside
+            the raster, have NaN max and mean values.
+    """
+    # split out edges without geometry as snail will not handle them gracefully
+    has_geometry = ~edges.geometry.isna().to_numpy()
+    with_geom_positions, = np.nonzero(has_geometry)
 
     print("Read raster transform...")
     grid = snail.intersection.GridDefinition.from_raster(raster_path)
 
-    print("Prepare linestrings...")
-    edges = snail.intersection.prepare_linestrings(with_geom_edges)
+    print("Split edges by raster grid...")
+    with stage("edge_exposure.split"):
+        splits = split_edges_by_grid(edges.iloc[with_geom_positions], grid, cache_dir)
+        splits["edge_id"] = with_geom_positions[splits.edge_id.to_numpy()]
 
-    print("Split linestrings...")
-    splits = snail.intersection.split_linestrings(edges, grid)
+    print("Read raster values for splits...")
+    with stage("edge_exposure.read_raster"):
+        values = read_raster_values(raster_path, splits.index_i.to_numpy(), splits.index_j.to_numpy(), band)
 
-    print("Lookup raster indices...")
-    splits_with_indices = snail.intersection.apply_indices(splits, grid)
+    print("Summarise exposure by edge...")
+    return label_exposure(summarise_exposure(splits, values, len(edges)), edges, has_geometry)
 
-    print("Read raster data into memory...")
+
+def edge_pixel_bounds(geometry: np.ndarray, dataset) -> np.ndarray:
+    """
+    Args:
+        geometry: Edge linestrings, in CRS of raster.
+        dataset: Open rasterio dataset.
+
+    Returns:
+        Array of (min column, min row, max column, max row) pixel indices of
+            each edge's bounding box, clipped to the raster.
+    """
+    bounds = shapely.bounds(geometry)
+    inverse = ~dataset.transform
+    cols_a, rows_a = inverse * (bounds[:, 0], bounds[:, 1])
+    cols_b, rows_b = inverse * (bounds[:, 2], bounds[:, 3])
+    pixel_bounds = np.floor(
+        np.column_stack(
+            [
+                np.minimum(cols_a, cols_b),
+                np.minimum(rows_a, rows_b),
+                np.maximum(cols_a, cols_b),
+                np.maximum(rows_a, rows_b),
+            ]
+        )
+    ).astype(np.int64)
+    upper = np.array([dataset.width, dataset.height, dataset.width, dataset.height]) - 1
+    return np.clip(pixel_bounds, -1, upper + 1)
+
+
+def window_has_hazard(dataset, band: int, window: Window, block_size: int) -> bool:
+    """
+    Check if any pixel in a window of a raster has a value greater than zero,
+    reading at most `block_size` x `block_size` pixels at a time.
+
+    Args:
+        dataset: Open rasterio dataset.
+        band: Band of raster to read data from.
+        window: Window to check, within raster.
+        block_size: Maximum width and height of windows to read, in pixels.
+
+    Returns:
+        True if any value in window is greater than zero (and not nodata).
+    """
+    for row_off in range(window.row_off, window.row_off + window.height, block_size):
+        for col_off in range(window.col_off, window.col_off + window.width, block_size):
+            block = Window(
+                col_off,
+                row_off,
+                min(block_size, window.col_off + window.width - col_off),
+                min(block_size, window.row_off + window.height - row_off),
+            )
+            data = dataset.read(band, window=block)
+            if dataset.nodata is not None:
+                data = data[data != dataset.nodata]
+            if (data > 0).any():
+                return True
+    return False
+
+
+def init_worker(raster_path: str, band: int, tile_size: int, cache_dir: str | None) -> None:
+    """
+    Create global variables referencing raster and its grid to persist
+    through worker lifetime.
+
+    Args:
+        raster_path: Path to raster file on disk, openable by rasterio.
+        band: Band of raster to read data from.
+        tile_size: Maximum width and height of windows to read, in pixels.
+        cache_dir: Directory to cache splits in, or None.
+    """
+    global raster_args
+    raster_args = (raster_path, band, tile_size, cache_dir)
+    global grid
+    grid = snail.intersection.GridDefinition.from_raster(raster_path)
+    return
+
+
+def tile_exposure(
+    task: tuple[np.ndarray, np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, pd.DataFrame | None, TaskTiming]:
+    """
+    Find the exposure of the edges assigned to one tile of a raster.
+
+    Args:
+        task: Positions of tile's edges in network, WKB of their geometry and
+            (min column, min row, max column, max row) pixel bounds covering
+            them, clipped to raster.
+
+    Returns:
+        Positions of tile's edges, their exposure (see `summarise_exposure`),
+            or None if the raster has no hazard across the tile's edges, and
+            the time taken.
+    """
+    start = task_clock()
+    positions, wkb, (col_min, row_min, col_max, row_max) = task
+    raster_path, band, tile_size, cache_dir = raster_args
+
+    window = Window(col_min, row_min, col_max - col_min + 1, row_max - row_min + 1)
     with rasterio.open(raster_path) as dataset:
-        raster = dataset.read(band)
+        if window.width < 1 or window.height < 1 or not window_has_hazard(dataset, band, window, tile_size):
+            return positions, None, task_timing(start)
+
+    tile_edges = gpd.GeoDataFrame(geometry=shapely.from_wkb(wkb), crs=grid.crs)
+    splits = split_edges_by_grid(tile_edges, grid, cache_dir)
+    values = read_raster_values(raster_path, splits.index_i.to_numpy(), splits.index_j.to_numpy(), band, tile_size)
+    return positions, summarise_exposure(splits, values, len(tile_edges)), task_timing(start)
+
+
+def tiled_edge_exposure(
+    edges: gpd.GeoDataFrame,
+    raster_path: str,
+    n_cpu: int,
+    band: int = 1,
+    tile_size: int = 2048,
+    cache_dir: str | None = None,
+) -> pd.DataFrame:
+    """
+    Summarise the raster values each edge of a network is exposed to, as
+    `edge_exposure`, working on square tiles of the raster in parallel.
+
+    Each edge is assigned to the tile containing the centre of its bounding
+    box, so a tile's edges are close together and each worker reads only a
+    small part of the raster. Tiles where the raster has no values greater
+    than zero across their edges are skipped without splitting the edges.
+
+    Args:
+        edges: Network edges to consider. Must contain geometry column
+            containing linestrings, in the CRS of the raster. If edges have a
+            'distance_km' column, the exposed length is also given in km.
+        raster_path: Path to raster file on disk, openable by rasterio.
+        n_cpu: Number of CPUs to use.
+        band: Band of raster to read data from.
+        tile_size: Width and height of tiles, in pixels.
+        cache_dir: If given, cache splits of each tile's edges by raster grid
+            here, see `split_edges_by_grid`.
+
+    Returns:
+        Table indexed as `edges`, see `edge_exposure`. Edges of skipped tiles
+            have NaN max and mean values and zero exposed fraction.
+    """
+    has_geometry = ~edges.geometry.isna().to_numpy()
+    with_geom_positions, = np.nonzero(has_geometry)
+    geometry = edges.geometry.to_numpy()[with_geom_positions]
+
+    print("Assigning edges to raster tiles...")
+    with rasterio.open(raster_path) as dataset:
+        pixel_bounds = edge_pixel_bounds(geometry, dataset)
+        width, height = dataset.width, dataset.height
+    tiles_wide = int(np.ceil(width / tile_size)) + 1
+
+    # offset by one so edges overhanging the raster's top or left have a tile
+    centre = (pixel_bounds[:, :2] + pixel_bounds[:, 2:]) // 2 + 1
+    tile_ids = (centre[:, 1] // tile_size) * tiles_wide + centre[:, 0] // tile_size
+    order = np.argsort(tile_ids, kind="stable")
+    _, starts = np.unique(tile_ids[order], return_index=True)
+
+    tasks = []
+    for tile_order in np.split(order, starts[1:]) if len(order) else []:
+        tile_bounds = pixel_bounds[tile_order]
+        col_min, row_min = np.maximum(tile_bounds[:, :2].min(axis=0), 0)
+        col_max, row_max = np.minimum(tile_bounds[:, 2:].max(axis=0), [width - 1, height - 1])
+        tasks.append(
+            (
+                with_geom_positions[tile_order],
+                shapely.to_wkb(geometry[tile_order]),
+                (col_min, row_min, col_max, row_max),
+            )
+        )
+
+    print(f"Intersecting {len(with_geom_positions):,d} edges in {len(tasks):,d} tiles...")
+    exposure = pd.DataFrame(
+        {
+            "max_value": np.full(len(edges), np.nan),
+            "mean_value": np.full(len(edges), np.nan),
+            "exposed_fraction": np.zeros(len(edges)),
+        }
+    )
+    n_skipped = 0
+    with stage("tiled_edge_exposure.intersect"), multiprocessing.Pool(
+        processes=n_cpu,
+        initializer=init_worker,
+        initargs=(raster_path, band, tile_size, cache_dir),
+    ) as pool:
+        for positions, tile_result, timing in tqdm(pool.imap_unordered(tile_exposure, tasks), total=len(tasks)):
+            if tile_result is None:
+                n_skipped += 1
+            else:
+                exposure.iloc[positions] = tile_result.to_numpy()
+            record_task("tiled_edge_exposure.intersect", len(positions), timing)
+    print(f"Skipped {n_skipped:,d} of {len(tasks):,d} tiles without hazard")
+
+    return label_exposure(exposure, edges, has_geometry)
 
-    print("Lookup raster value for splits...")
-    values = snail.intersection.get_raster_values_for_splits(splits_with_indices, raster)
-    splits_with_values = splits_with_indices.copy()
-    splits_with_values["raster_value"] = values
 
-    print(f"Filter out edges with splits experiencing values in excess of {failure_threshold} threshold...")
-    failed_splits_mask = splits_with_values.raster_value > failure_threshold
-    failed_edge_ids = set(splits_with_values[failed_splits_mask].edge_id.unique())
-    surviving_edges_with_geom = edges.loc[~edges.edge_id.isin(failed_edge_ids), :]
+def failed_edge_mask(
+    edges: pd.DataFrame,
+    exposure: pd.DataFrame,
+    failure_threshold: float,
+) -> np.ndarray:
+    """
+    Find the edges of a network exposed to values in excess of a given
+    threshold.
+
+    Args:
+        edges: Network edges to consider.
+        exposure: Exposure of (some of) `edges`, as output by `edge_exposure`.
+        failure_threshold: Edges experiencing a value in excess of this fail.
+
+    Returns:
+        Boolean array, one element per edge, True where edge fails.
+    """
+    # edges are matched to their exposure by index label, which must be unambiguous
+    if not edges.index.is_unique:
+        raise ValueError("Edges must have a unique index to match them to their exposure")
+    failed_edges = exposure.index[exposure.max_value > failure_threshold]
+    return edges.index.isin(failed_edges)
+
+
+def filter_edges_by_exposure(
+    edges: gpd.GeoDataFrame,
+    exposure: pd.DataFrame,
+    failure_threshold: float,
+) -> gpd.GeoDataFrame:
+    """
+    Remove edges from a network that are exposed to values in excess of a
+    given threshold.
+
+    Args:
+        edges: Network edges to consider.
+        exposure: Exposure of (some of) `edges`, as output by `edge_exposure`.
+        failure_threshold: Edges experiencing a value in excess of this will
+            be removed from the network.
+
+    Returns:
+        Network without edges experiencing values in excess of threshold.
+    """
+    print(f"Filter out edges experiencing values in excess of {failure_threshold} threshold...")
+    return edges.loc[~failed_edge_mask(edges, exposure, failure_threshold), :]
+
+
+def filter_edges_by_raster(
+    edges: gpd.GeoDataFrame,
+    raster_path: str,
+    failure_threshold: float,
+    band: int = 1,
+    cache_dir: str | None = None,
+) -> gpd.GeoDataFrame:
+    """
+    Remove edges from a network that are exposed to gridded values in excess of
+    a given threshold.
+
+    Args:
+        edges: Network edges to consider. Must contain geometry column containing linestrings.
+        raster_path: Path to raster file on disk, openable by rasterio.
+        failure_threshold: Edges experiencing a raster value in excess of this will be
+            removed from the network.
+        band: Band of raster to read data from.
+        cache_dir: If given, cache splits of edges by raster grid here, see
+            `split_edges_by_grid`.
+
+    Returns:
+        Network without edges experiencing raster values in excess of threshold.
+    """
+    exposure = edge_exposure(edges, raster_path, band, cache_dir)
+    surviving_edges = filter_edges_by_exposure(edges, exposure, failure_threshold)
 
     print("Done filtering edges...")
-    return pd.concat([no_geom_edges, surviving_edges_with_geom]).sort_index().drop(columns=["edge_id"])
\ No newline at end of file
+    return surviving_edges
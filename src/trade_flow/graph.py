@@ -0,0 +1,318 @@
+"""
+Represent a network as flat arrays which may be published to disk once and
+memory-mapped by many worker processes, rather than pickled and copied to each.
+"""
+
+import dataclasses
+import hashlib
+import os
+from dataclasses import dataclass
+
+import igraph as ig
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def publish_arrays(obj, directory: str) -> None:
+    """
+    Write each array field of a dataclass instance to `directory` as a .npy file.
+
+    Args:
+        obj: Dataclass instance with only np.ndarray fields.
+        directory: Directory to write arrays to, will be created if necessary.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for field in dataclasses.fields(obj):
+        np.save(os.path.join(directory, f"{field.name}.npy"), getattr(obj, field.name))
+    return
+
+
+def attach_arrays(cls: type, directory: str):
+    """
+    Create a dataclass instance from arrays written by `publish_arrays`. The
+    arrays are memory-mapped, so processes attaching to the same directory
+    share the same pages of memory (via the OS page cache) rather than each
+    holding a copy.
+
+    Args:
+        cls: Dataclass type with only np.ndarray fields.
+        directory: Directory arrays were published to.
+
+    Returns:
+        Instance of `cls`, with read-only memory-mapped fields.
+    """
+    return cls(
+        **{
+            field.name: np.load(os.path.join(directory, f"{field.name}.npy"), mmap_mode="r")
+            for field in dataclasses.fields(cls)
+        }
+    )
+
+
+def fingerprint_arrays(*arrays: np.ndarray) -> str:
+    """
+    Hash the contents of some arrays, e.g. to check if a cached result derived
+    from them is still valid.
+
+    Args:
+        arrays: Arrays to hash.
+
+    Returns:
+        Hex digest of arrays' dtypes, shapes and data.
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+def vertex_ids(edges: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Assign integer vertex ids to the string node ids of `edges`.
+
+    Vertex ids are assigned in order of first appearance in the first two
+    columns of `edges`, read row by row. This is the same numbering
+    ig.Graph.DataFrame(edges, use_vids=False) would use.
+
+    Args:
+        edges: Table of edges, first column should be source node id and
+            second destination node id.
+
+    Returns:
+        Source vertex id of each edge, target vertex id of each edge, and node
+            id of each vertex.
+    """
+    node_ids = np.column_stack([edges.iloc[:, 0].to_numpy(), edges.iloc[:, 1].to_numpy()]).ravel()
+    codes, vertex_names = pd.factorize(node_ids)
+    codes = codes.astype(np.int32).reshape(-1, 2)
+    return codes[:, 0].copy(), codes[:, 1].copy(), np.asarray(vertex_names, dtype=object)
+
+
+def intern_vertices(edges: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Assign dense integer vertex ids to the string node ids of `edges`, once,
+    when building a network. See `vertex_ids` for numbering.
+
+    Args:
+        edges: Table of edges, first column should be source node id and
+            second destination node id.
+
+    Returns:
+        Table of vertices with 'vid' and 'id' columns, and `edges` with
+            'from_vid' and 'to_vid' columns appended.
+    """
+    from_vid, to_vid, vertex_names = vertex_ids(edges)
+    vertices = pd.DataFrame(
+        {
+            "vid": np.arange(len(vertex_names), dtype=np.int32),
+            "id": vertex_names,
+        }
+    )
+    return vertices, edges.assign(from_vid=from_vid, to_vid=to_vid)
+
+
+def edge_vertex_ids(
+    edges: pd.DataFrame,
+    vertices: pd.DataFrame | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Integer vertex ids of the source and target of each edge.
+
+    If `vertices` is given and `edges` has 'from_vid' and 'to_vid' columns (as
+    written by `intern_vertices`), use these. Otherwise assign vertex ids with
+    `vertex_ids`.
+
+    A subset of a network's edges (e.g. after removing some) may be used with
+    the vertices table of the whole network. Vertices without any edges will
+    then be present in the returned node ids.
+
+    Args:
+        edges: Table of edges.
+        vertices: Table of vertices with 'vid' and 'id' columns.
+
+    Returns:
+        Source vertex id of each edge, target vertex id of each edge, and node
+            id of each vertex.
+    """
+    if vertices is None or not {"from_vid", "to_vid"}.issubset(edges.columns):
+        return vertex_ids(edges)
+
+    if not np.array_equal(vertices.vid.to_numpy(), np.arange(len(vertices))):
+        raise ValueError("Vertex ids must be dense, sorted and start at 0")
+    return (
+        edges.from_vid.to_numpy(dtype=np.int32),
+        edges.to_vid.to_numpy(dtype=np.int32),
+        vertices.id.to_numpy(dtype=object),
+    )
+
+
+@dataclass
+class CSRGraph:
+    """
+    Directed, weighted graph as arrays.
+
+    Edge ids are positions in the edge table the graph was built from. Edge e
+    runs from `edge_source[e]` to `edge_target[e]` with weight `weight[e]`.
+    Routing workers build their own index from these arrays (an igraph.Graph,
+    or an AdjacencyMatrix published alongside), so no index is published.
+    """
+    edge_source: np.ndarray
+    edge_target: np.ndarray
+    weight: np.ndarray
+    # single element, as every field is an array to publish
+    vertex_count: np.ndarray
+
+    @property
+    def n_vertices(self) -> int:
+        return int(self.vertex_count[0])
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_source)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        edge_source: np.ndarray,
+        edge_target: np.ndarray,
+        weight: np.ndarray,
+        n_vertices: int,
+    ) -> "CSRGraph":
+        """
+        Args:
+            edge_source: Source vertex id of each edge.
+            edge_target: Target vertex id of each edge.
+            weight: Cost of traversing each edge.
+            n_vertices: Number of vertices in graph.
+
+        Returns:
+            Graph.
+        """
+        return cls(
+            edge_source=np.asarray(edge_source, dtype=np.int32),
+            edge_target=np.asarray(edge_target, dtype=np.int32),
+            weight=np.asarray(weight, dtype=np.float64),
+            vertex_count=np.array([n_vertices], dtype=np.int64),
+        )
+
+    def to_igraph(self) -> ig.Graph:
+        """
+        igraph keeps its own copy of the topology, in the private memory of
+        the calling process. Weights are not copied onto the graph (as an
+        attribute they would be held as a list of Python floats), instead
+        pass `weight` as the `weights` argument of igraph's shortest path
+        methods. igraph converts these on every call, which is much slower
+        from a memory-mapped array than an in-memory one.
+
+        Returns:
+            igraph.Graph with the same vertex and edge ids, without weights.
+        """
+        return ig.Graph(
+            n=self.n_vertices,
+            edges=np.column_stack([self.edge_source, self.edge_target]),
+            directed=True
+        )
+
+
+@dataclass
+class AdjacencyMatrix:
+    """
+    Directed, weighted graph as a sparse adjacency matrix in canonical CSR
+    form (sorted column indices, no duplicate entries), for routing with
+    scipy.sparse.csgraph.
+
+    A matrix holds at most one entry per pair of vertices, so where several
+    edges join the same pair of vertices, only the least cost edge (lowest
+    edge id of any tied) is kept. Zero cost entries are stored explicitly, and
+    csgraph treats them as edges.
+
+    Entry k of the matrix is in row `entry_keys[k] // n_vertices`, column
+    `indices[k]`, has weight `data[k]` and is edge `edge_ids[k]` of the
+    CSRGraph it was built from.
+    """
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    edge_ids: np.ndarray
+    # row * n_vertices + column of each entry, ascending
+    entry_keys: np.ndarray
+
+    @property
+    def n_vertices(self) -> int:
+        return len(self.indptr) - 1
+
+    @classmethod
+    def from_graph(
+        cls,
+        graph: CSRGraph,
+        reverse: bool = False,
+        edge_mask: np.ndarray | None = None,
+    ) -> "AdjacencyMatrix":
+        """
+        Args:
+            graph: Graph to build matrix from.
+            reverse: If True, build matrix of the reversed graph, with an
+                entry in row j, column i for each edge from i to j.
+            edge_mask: Boolean array, one element per edge of graph, True for
+                edges to leave out of the matrix (e.g. those removed by a
+                hazard).
+
+        Returns:
+            Adjacency matrix of graph.
+        """
+        if reverse:
+            rows, columns = graph.edge_target, graph.edge_source
+        else:
+            rows, columns = graph.edge_source, graph.edge_target
+
+        # sort by vertex pair, then weight, then edge id and keep the first edge of each pair
+        order = np.lexsort((np.arange(graph.n_edges), graph.weight, columns, rows))
+        if edge_mask is not None:
+            order = order[~np.asarray(edge_mask, dtype=bool)[order]]
+        rows = np.asarray(rows)[order]
+        columns = np.asarray(columns)[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        rows, columns, edge_ids = rows[keep], columns[keep], order[keep]
+
+        # scipy.sparse.csgraph indexes with int32, if we do too then `to_scipy`
+        # need not copy the (possibly memory-mapped) arrays to upcast them
+        if len(rows) > np.iinfo(np.int32).max:
+            raise ValueError(f"{len(rows)} entries is too many for an int32 indexed matrix")
+        indptr = np.zeros(graph.n_vertices + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=graph.n_vertices), out=indptr[1:])
+        return cls(
+            indptr=indptr,
+            indices=columns.astype(np.int32),
+            data=np.asarray(graph.weight, dtype=np.float64)[edge_ids],
+            edge_ids=edge_ids.astype(np.int32),
+            entry_keys=rows.astype(np.int64) * graph.n_vertices + columns,
+        )
+
+    def to_scipy(self) -> sparse.csr_matrix:
+        """
+        The matrix references this instance's arrays rather than copying them,
+        so if they are memory-mapped, so is the matrix.
+
+        Returns:
+            scipy.sparse.csr_matrix of shape (n_vertices, n_vertices).
+        """
+        return sparse.csr_matrix(
+            (self.data, self.indices, self.indptr),
+            shape=(self.n_vertices, self.n_vertices)
+        )
+
+    def find_edges(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            rows: Row of each entry to lookup.
+            columns: Column of each entry to lookup, all entries must exist.
+
+        Returns:
+            Edge id of each entry.
+        """
+        keys = np.asarray(rows, dtype=np.int64) * self.n_vertices + columns
+        return self.edge_ids[np.searchsorted(self.entry_keys, keys)]
@@ -0,0 +1,263 @@
+"""
+Record the wall time, CPU time and peak memory of named stages of work, and
+the throughput of the worker processes they use, and write these to JSON.
+
+Stages are recorded in a registry for the whole process, in the manner of
+`logging`. Library code wraps its stages with `stage`, and workers time each
+task with `task_clock` and `task_timing`, returning the timing with the task's
+results for the parent to `record_task`. A workflow script then calls
+`write_metrics` once, at the end.
+
+As the registry is per process, instrumented rules should run as a Snakemake
+`script:` (in a process of its own), not a `run:` block, which may share the
+Snakemake process, and its registry and peak memory, with other jobs.
+"""
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class StageMetrics:
+    """
+    Totals over every run of a named stage.
+    """
+    calls: int = 0
+    wall_time_s: float = 0.0
+    # of this process and any child processes which exited during the stage
+    cpu_time_s: float = 0.0
+    # high water mark of resident memory of this process, during the stage
+    peak_rss_mb: float = 0.0
+
+
+@dataclass
+class WorkerMetrics:
+    """
+    Totals over the tasks of a stage run by one worker process.
+    """
+    tasks: int = 0
+    items: int = 0
+    wall_time_s: float = 0.0
+    cpu_time_s: float = 0.0
+    peak_rss_mb: float = 0.0
+
+
+@dataclass
+class TaskTiming:
+    """
+    Measurements of a task, taken in the worker process which ran it.
+    """
+    pid: int
+    wall_time_s: float
+    cpu_time_s: float
+    peak_rss_mb: float
+
+
+# stage name -> metrics
+stages: dict[str, StageMetrics] = {}
+# stage name -> worker process id -> metrics
+workers: dict[str, dict[int, WorkerMetrics]] = {}
+# peak memory seen so far by each stage currently running, innermost last
+open_stage_peaks: list[float] = []
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns:
+        High water mark of resident memory of this process, in MB. Since the
+            last `reset_peak_rss`, where supported.
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    # reported in kB
+                    return int(line.split()[1]) * 1024 / 1E6
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS, kB elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1E6
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the high water mark of resident memory to the current resident
+    memory. Only supported on Linux, elsewhere the peak is of the process'
+    lifetime.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        pass
+    return
+
+
+def cpu_time_s() -> float:
+    """
+    Returns:
+        User and system CPU time of this process and its waited for children.
+    """
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def update_open_stage_peaks(rss_mb: float) -> None:
+    """
+    Args:
+        rss_mb: Peak memory seen, to record against every running stage.
+    """
+    for i, peak in enumerate(open_stage_peaks):
+        open_stage_peaks[i] = max(peak, rss_mb)
+    return
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Record the wall time, CPU time and peak memory of the body of this
+    context as a run of stage `name`. Stages may be nested.
+
+    Args:
+        name: Name of stage, e.g. 'route_from_all_nodes.routing'.
+    """
+    # resetting the high water mark would lose the peak of any enclosing stages
+    update_open_stage_peaks(peak_rss_mb())
+    reset_peak_rss()
+    open_stage_peaks.append(peak_rss_mb())
+
+    wall_start = time.perf_counter()
+    cpu_start = cpu_time_s()
+    try:
+        yield
+    finally:
+        wall_time_s = time.perf_counter() - wall_start
+        stage_cpu_time_s = cpu_time_s() - cpu_start
+        update_open_stage_peaks(peak_rss_mb())
+        stage_peak_rss_mb = open_stage_peaks.pop()
+
+        metrics = stages.setdefault(name, StageMetrics())
+        metrics.calls += 1
+        metrics.wall_time_s += wall_time_s
+        metrics.cpu_time_s += stage_cpu_time_s
+        metrics.peak_rss_mb = max(metrics.peak_rss_mb, stage_peak_rss_mb)
+
+
+def task_clock() -> tuple[float, float]:
+    """
+    Start timing a task in a worker process.
+
+    Returns:
+        Wall and CPU clock readings to pass to `task_timing`.
+    """
+    return time.perf_counter(), time.process_time()
+
+
+def task_timing(start: tuple[float, float]) -> TaskTiming:
+    """
+    Finish timing a task in a worker process.
+
+    Args:
+        start: Reading of `task_clock` as task started.
+
+    Returns:
+        Timing of task, to return to the parent process.
+    """
+    wall_start, cpu_start = start
+    return TaskTiming(
+        pid=os.getpid(),
+        wall_time_s=time.perf_counter() - wall_start,
+        cpu_time_s=time.process_time() - cpu_start,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def record_task(name: str, n_items: int, timing: TaskTiming) -> None:
+    """
+    Record a task completed by a worker process as part of stage `name`.
+
+    Args:
+        name: Name of stage the task belongs to.
+        n_items: Number of items (e.g. origins) processed by the task.
+        timing: Timing of the task, from `task_timing`.
+    """
+    metrics = workers.setdefault(name, {}).setdefault(timing.pid, WorkerMetrics())
+    metrics.tasks += 1
+    metrics.items += int(n_items)
+    metrics.wall_time_s += timing.wall_time_s
+    metrics.cpu_time_s += timing.cpu_time_s
+    metrics.peak_rss_mb = max(metrics.peak_rss_mb, timing.peak_rss_mb)
+    return
+
+
+def reset() -> None:
+    """
+    Forget all recorded metrics.
+    """
+    stages.clear()
+    workers.clear()
+    return
+
+
+def metrics_summary() -> dict:
+    """
+    Returns:
+        Recorded metrics, with the throughput of each worker (items per
+            second of task wall time) and its mean across each stage's workers.
+    """
+    worker_summary = {}
+    for name, stage_workers in workers.items():
+        per_worker = {
+            str(pid): {
+                **asdict(metrics),
+                "items_per_s": metrics.items / metrics.wall_time_s if metrics.wall_time_s > 0 else None,
+            }
+            for pid, metrics in stage_workers.items()
+        }
+        rates = [w["items_per_s"] for w in per_worker.values() if w["items_per_s"] is not None]
+        worker_summary[name] = {
+            "n_workers": len(per_worker),
+            "items": sum(w["items"] for w in per_worker.values()),
+            "mean_items_per_s_per_worker": sum(rates) / len(rates) if rates else None,
+            "peak_worker_rss_mb": max(w["peak_rss_mb"] for w in per_worker.values()),
+            "workers": per_worker,
+        }
+
+    return {
+        "stages": {name: asdict(metrics) for name, metrics in stages.items()},
+        "workers": worker_summary,
+    }
+
+
+def write_metrics(path: str, **context) -> None:
+    """
+    Write recorded metrics to a JSON file, then forget them, so metrics
+    written later in the same process are not mixed with these.
+
+    Args:
+        path: Path to write metrics to.
+        **context: Additional JSON serialisable items to store, e.g. input
+            sizes or the number of CPUs requested.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as fp:
+        json.dump(
+            {
+                "host": platform.node(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "context": context,
+                **metrics_summary(),
+            },
+            fp,
+            indent=2
+        )
+    reset()
+    return
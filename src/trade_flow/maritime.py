@@ -0,0 +1,179 @@
+"""
+Estimate the geometry of maritime routes between ports, from a network of
+shipping lanes made for visualisation.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.ops import linemerge
+from tqdm import tqdm
+
+from trade_flow.graph import CSRGraph, attach_arrays, fingerprint_arrays, publish_arrays, vertex_ids
+from trade_flow.instrument import TaskTiming, record_task, stage, task_clock, task_timing
+
+
+def init_worker(graph_dir: str, vis_edges_path: str) -> None:
+    """
+    Create global variables referencing visualisation graph and its edge
+    geometries to persist through worker lifetime.
+
+    Args:
+        graph_dir: Directory CSRGraph arrays of visualisation network have been published to.
+        vis_edges_path: Path to visualisation network edges geoparquet file.
+    """
+    print(f"Process {os.getpid()} initialising...")
+    csr_graph = attach_arrays(CSRGraph, graph_dir)
+    global graph, weight
+    graph = csr_graph.to_igraph()
+    weight = np.array(csr_graph.weight)
+    global vis_geometries
+    vis_geometries = gpd.read_parquet(vis_edges_path, columns=["geometry"]).geometry.to_numpy()
+    return
+
+
+def route_geometries_from_port(
+    task: tuple[int, np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray, TaskTiming]:
+    """
+    Find least distance routes from one port to many, and merge the
+    visualisation edges of each route into a single geometry.
+
+    Args:
+        task: Vertex ID of source port, vertex IDs of destination ports and
+            an identifier for each source -> destination pair.
+
+    Returns:
+        Pair identifiers, WKB of each route's geometry and the time taken.
+    """
+    start = task_clock()
+    source_vid, target_vids, pair_ids = task
+    edge_paths: list[list[int]] = graph.get_shortest_paths(
+        int(source_vid),
+        target_vids.tolist(),
+        weights=weight,
+        output="epath"
+    )
+    geometries = [linemerge(list(vis_geometries[edge_path])) for edge_path in edge_paths]
+    return pair_ids, shapely.to_wkb(geometries), task_timing(start)
+
+
+def vis_network_fingerprint(vis_edges: gpd.GeoDataFrame) -> str:
+    """
+    Args:
+        vis_edges: Visualisation network edges.
+
+    Returns:
+        Digest of network topology, distances and geometry.
+    """
+    from_vid, to_vid, vertex_names = vertex_ids(vis_edges)
+    return fingerprint_arrays(
+        from_vid,
+        to_vid,
+        np.frombuffer("\n".join(map(str, vertex_names)).encode(), dtype=np.uint8),
+        vis_edges["distance"].to_numpy(dtype=np.float64),
+        np.frombuffer(b"".join(shapely.to_wkb(vis_edges.geometry.to_numpy())), dtype=np.uint8),
+    )
+
+
+def maritime_route_geometries(
+    port_pairs: pd.DataFrame,
+    vis_edges_path: str,
+    n_cpu: int,
+    cache_dir: str | None = None,
+) -> gpd.GeoSeries:
+    """
+    Estimate the geometry of maritime routes between pairs of ports, as the
+    least distance path across a visualisation network of shipping lanes.
+
+    Pairs are grouped by source port, and all routes from one source are found
+    with a single shortest path search. Sources are processed across a pool of
+    workers.
+
+    Args:
+        port_pairs: Table with from_port and to_port columns, port ids are node
+            ids of visualisation network.
+        vis_edges_path: Path to visualisation network edges geoparquet file. The
+            first two columns should be source and destination node ids and
+            edges should have a 'distance' column.
+        n_cpu: Number of CPUs to use.
+        cache_dir: If given, store geometries here, keyed by the content of
+            the visualisation network. Pairs already in the cache are not
+            routed again.
+
+    Returns:
+        Route geometry of each pair, indexed as `port_pairs`.
+    """
+    vis_edges = gpd.read_parquet(vis_edges_path)
+    from_vid, to_vid, vertex_names = vertex_ids(vis_edges)
+    vertex_index = pd.Index(vertex_names)
+
+    pairs = pd.DataFrame(
+        {
+            "from_port": port_pairs.from_port.to_numpy(),
+            "to_port": port_pairs.to_port.to_numpy(),
+        }
+    )
+    pair_keys = pd.MultiIndex.from_frame(pairs)
+    wkb = np.full(len(pairs), None, dtype=object)
+
+    cache_path = None
+    cache = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, f"{vis_network_fingerprint(vis_edges)}.parquet")
+        if os.path.exists(cache_path):
+            cache = pd.read_parquet(cache_path)
+            cache_positions = pd.MultiIndex.from_frame(cache[["from_port", "to_port"]]).get_indexer(pair_keys)
+            cached = cache_positions != -1
+            wkb[cached] = cache.geometry.to_numpy()[cache_positions[cached]]
+            print(f"Found {cached.sum():,d} of {len(pairs):,d} route geometries in cache")
+
+    to_route = pd.isna(wkb)
+    if to_route.any():
+        source_vids = vertex_index.get_indexer(pairs.from_port[to_route])
+        target_vids = vertex_index.get_indexer(pairs.to_port[to_route])
+        if (source_vids == -1).any() or (target_vids == -1).any():
+            raise KeyError("Some ports are missing from the visualisation network")
+
+        # one task per source port
+        pair_ids = np.flatnonzero(to_route)
+        order = np.argsort(source_vids, kind="stable")
+        sources, starts = np.unique(source_vids[order], return_index=True)
+        tasks = [
+            (source, target_vids[order][start: end], pair_ids[order][start: end])
+            for source, start, end in zip(sources, starts, [*starts[1:], len(order)])
+        ]
+
+        graph = CSRGraph.from_arrays(from_vid, to_vid, vis_edges["distance"], len(vertex_names))
+        temp_dir = tempfile.TemporaryDirectory()
+        graph_dir = os.path.join(temp_dir.name, "graph")
+        publish_arrays(graph, graph_dir)
+
+        print(f"Routing {len(pair_ids):,d} port pairs from {len(tasks):,d} ports...")
+        with stage("maritime_route_geometries.routing"), multiprocessing.Pool(
+            processes=n_cpu,
+            initializer=init_worker,
+            initargs=(graph_dir, vis_edges_path),
+        ) as pool:
+            for task_pair_ids, task_wkb, timing in tqdm(
+                pool.imap_unordered(route_geometries_from_port, tasks),
+                total=len(tasks)
+            ):
+                wkb[task_pair_ids] = task_wkb
+                record_task("maritime_route_geometries.routing", len(task_pair_ids), timing)
+
+        temp_dir.cleanup()
+
+        if cache_path is not None:
+            cache = pd.concat([cache, pairs.assign(geometry=wkb)[to_route]])
+            cache = cache.drop_duplicates(subset=["from_port", "to_port"], keep="last")
+            cache.to_parquet(f"{cache_path}.tmp")
+            os.replace(f"{cache_path}.tmp", cache_path)
+
+    return gpd.GeoSeries(shapely.from_wkb(wkb), index=port_pairs.index, crs=4326)
@@ -5,12 +5,18 @@ Add destination country nodes
 Duplicate, reverse and append all intermodal, road and rail edges (to match maritime)
 """
 
+from dataclasses import dataclass
+from typing import Sequence
+
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import pyproj
+import shapely
 from scipy.spatial import cKDTree
-from shapely.geometry import LineString
+
+from trade_flow.instrument import stage
+from trade_flow.routing import DESTINATION_LINK_COST_USD_T
 
 
 def duplicate_reverse_and_append_edges(edges: pd.DataFrame) -> pd.DataFrame:
@@ -32,31 +38,39 @@ def duplicate_reverse_and_append_edges(edges: pd.DataFrame) -> pd.DataFrame:
     return pd.concat([edges, reversed_edges])
 
 
-def clean_maxspeed(value: str, default_km_h: float, min_km_h = 20, max_km_h = 140) -> float:
+def clean_maxspeeds(values: pd.Series, default_km_h: float, min_km_h = 20, max_km_h = 140) -> np.ndarray:
     """
-    Cast, check and return the value of OSM maxspeed tag.
+    Cast, check and return values of OSM maxspeed tag.
 
     Args:
-        value: Speed limit value to clean
+        values: Speed limit values to clean
         default_km_h: Where data is missing or obviously wrong, return this value.
 
     Returns:
-        Hopefully a sensible numeric speed limit value in km h-1
+        Hopefully sensible numeric speed limit values in km h-1
     """
 
-    try:
-        speed_km_h = float(value)
-    except ValueError:
-        return default_km_h
-
-    if np.isnan(speed_km_h):
-        return default_km_h
-    elif (speed_km_h < min_km_h) or (speed_km_h > max_km_h):
-        return default_km_h
-    elif (speed_km_h >= min_km_h) and (speed_km_h <= max_km_h):
-        return speed_km_h
-    else:
-        raise RuntimeError(f"Unforeseen consequences with {speed_km_h=}")
+    def to_float(value) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    speed_km_h = pd.to_numeric(values, errors="coerce")
+    # to_numeric is stricter than float(), e.g. float("1_00") == 100.0
+    # retry the (few, distinct) values it could not parse
+    unparsed = speed_km_h.isna() & values.notna()
+    if unparsed.any():
+        unparsed_values = values[unparsed]
+        uniques = pd.unique(unparsed_values)
+        speed_km_h = speed_km_h.astype(float)
+        speed_km_h[unparsed] = np.array([to_float(value) for value in uniques])[
+            pd.Index(uniques).get_indexer(unparsed_values)
+        ]
+
+    speed_km_h = speed_km_h.to_numpy(dtype=float)
+    in_range = (speed_km_h >= min_km_h) & (speed_km_h <= max_km_h)
+    return np.where(in_range, speed_km_h, default_km_h)
 
 
 def preprocess_road_network(
@@ -91,20 +105,20 @@ def preprocess_road_network(
     edges["distance_km"] = edges.geometry.to_crs(edges.estimate_utm_crs()).length / 1_000
     
     edges["mode"] = "road"
-    edges["max_speed_km_h"] = edges.tag_maxspeed.apply(clean_maxspeed, args=(default_max_speed_km_h,))
-    edges["avg_speed_km_h"] = edges.max_speed_km_h.apply(lambda x: np.clip(2/3 * x, None, default_max_speed_km_h))
+    edges["max_speed_km_h"] = clean_maxspeeds(edges.tag_maxspeed, default_max_speed_km_h)
+    edges["avg_speed_km_h"] = np.clip(2/3 * edges.max_speed_km_h, None, default_max_speed_km_h)
     
     edges["cost_USD_t"] = cost_USD_t_km * edges["distance_km"] + cost_USD_t_h * edges["distance_km"] * 1 / edges["avg_speed_km_h"]
-    edges["id"] = edges.apply(lambda row: f"{row['mode']}_{row['id']}", axis=1)
-    edges["to_id"] = edges.apply(lambda row: f"{row['mode']}_{row['to_id']}", axis=1)
-    edges["from_id"] = edges.apply(lambda row: f"{row['mode']}_{row['from_id']}", axis=1)
+    edges["id"] = "road_" + edges["id"].astype(str)
+    edges["to_id"] = "road_" + edges["to_id"].astype(str)
+    edges["from_id"] = "road_" + edges["from_id"].astype(str)
 
     if directional:
         edges = duplicate_reverse_and_append_edges(edges)
     
     nodes = gpd.read_parquet(nodes_path)
     nodes["mode"] = "road"
-    nodes["id"] = nodes.apply(lambda row: f"{row['mode']}_{row['id']}", axis=1)
+    nodes["id"] = "road_" + nodes["id"].astype(str)
 
     return nodes, edges
 
@@ -143,16 +157,16 @@ def preprocess_rail_network(
     edges["mode"] = "rail"
     
     edges["cost_USD_t"] = cost_USD_t_km * edges["distance_km"] + cost_USD_t_h * edges["distance_km"] * 1 / avg_speed_km_h
-    edges["id"] = edges.apply(lambda row: f"{row['mode']}_{row['id']}", axis=1)
-    edges["to_id"] = edges.apply(lambda row: f"{row['mode']}_{row['to_id']}", axis=1)
-    edges["from_id"] = edges.apply(lambda row: f"{row['mode']}_{row['from_id']}", axis=1)
+    edges["id"] = "rail_" + edges["id"].astype(str)
+    edges["to_id"] = "rail_" + edges["to_id"].astype(str)
+    edges["from_id"] = "rail_" + edges["from_id"].astype(str)
 
     if directional:
         edges = duplicate_reverse_and_append_edges(edges)
     
     nodes = gpd.read_parquet(nodes_path)
     nodes["mode"] = "rail"
-    nodes["id"] = nodes.apply(lambda row: f"{row['mode']}_{row['id']}", axis=1)
+    nodes["id"] = "rail_" + nodes["id"].astype(str)
 
     return nodes, edges
 
@@ -179,44 +193,55 @@ def preprocess_maritime_network(nodes_path: str, edges_path: str) -> tuple[gpd.G
     ports_mask = nodes.infra == "port"
 
     # we want to connect our road and rail nodes to the port_land node of the port_in, port_out, port_land trifecta
-    nodes.loc[ports_mask, "id"] = nodes.loc[ports_mask, :].apply(lambda row: f"{row.id}_land", axis=1)
+    nodes.loc[ports_mask, "id"] = nodes.loc[ports_mask, "id"] + "_land"
 
     return nodes, edges
 
 
-def find_nearest_points(
-    a: gpd.GeoDataFrame,
-    b: gpd.GeoDataFrame,
-    b_id_col: str,
-) -> gpd.GeoDataFrame:
+def find_neighbouring_points(
+    a: np.ndarray,
+    b: np.ndarray,
+    max_distance: float,
+    k: int = 1,
+    within_radius: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Given two GeoDataFrames of point locations, `a` and `b`, for each point in `a`, find the closest in `b`.
-
-    Modified from:
-    https://gis.stackexchange.com/questions/222315/finding-nearest-point-in-other-geodataframe-using-geopandas
+    For each point in `a`, find the closest `k` points in `b`, or all the
+    points in `b` within `max_distance`, which are closer than `max_distance`.
 
-    a: Table of points to start from, we run over every row here
-    b: Table of candidate closest points
-    b_id_col: Name of column in b identifying points
+    Args:
+        a: Coordinates of points to start from, shape (n, 2)
+        b: Coordinates of candidate neighbouring points, shape (m, 2)
+        max_distance: Only return neighbours closer than this
+        k: Number of nearest neighbours to find, ignored if `within_radius`
+        within_radius: If True, find every neighbour closer than `max_distance`
 
     Returns:
-        `a`, joined with the values from `b_id_col` from the points of `b` which are closest
+        Position in `a`, position in `b` and distance of each pair of
+            neighbouring points, ordered by position in `a`, then distance.
     """
+    tree = cKDTree(b)
+    if within_radius:
+        neighbours = tree.query_ball_point(a, r=max_distance, return_sorted=True)
+        n_neighbours = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+        a_positions = np.repeat(np.arange(len(a)), n_neighbours)
+        b_positions = np.fromiter(
+            (i for point_neighbours in neighbours for i in point_neighbours),
+            dtype=np.int64,
+            count=n_neighbours.sum()
+        )
+        distances = np.linalg.norm(a[a_positions] - b[b_positions], axis=1)
+        order = np.lexsort((distances, a_positions))
+        a_positions, b_positions, distances = a_positions[order], b_positions[order], distances[order]
+    else:
+        # where b has fewer than k points, missing neighbours have infinite distance
+        distances, b_positions = tree.query(a, k=k)
+        distances = distances.reshape(-1)
+        b_positions = b_positions.reshape(-1)
+        a_positions = np.repeat(np.arange(len(a)), k)
 
-    # find nearest point in b for each and every point in a
-    tree = cKDTree(b.geometry.get_coordinates().to_numpy())
-    distances, indicies = tree.query(a.geometry.get_coordinates().to_numpy(), k=1)
-    nearest_points = b.iloc[indicies][[b_id_col, "geometry"]] \
-        .reset_index(drop=True).rename(columns={"geometry": "nearest_node_geometry"})
-    
-    return pd.concat(
-        [
-            a.reset_index(drop=True),
-            nearest_points,
-            pd.Series(data=distances, name='distance')
-        ], 
-        axis=1
-    )
+    close = distances < max_distance
+    return a_positions[close], b_positions[close], distances[close]
 
 
 def create_edges_to_nearest_nodes(
@@ -224,65 +249,101 @@ def create_edges_to_nearest_nodes(
     b: gpd.GeoDataFrame,
     max_distance_m: float,
     projected_coordinate_system: pyproj.crs.crs.CRS,
+    k: int = 1,
+    within_radius: bool = False,
 ) -> gpd.GeoDataFrame:
     """
-    Given two sets of nodes, a and b, loop through nodes in a, finding the closest 
-    node in b (which is less than `max_distance_m` away). Create a linear linestring
-    connecting these points.
+    Given two sets of nodes, a and b, for each node in a find the closest node
+    (or `k` closest nodes, or all nodes within `max_distance_m`) in b which are
+    less than `max_distance_m` away. Create linear linestrings connecting these points.
 
     Args:
         a: Table of nodes to connect from, containing GeoSeries of point locations.
             Must contain "id", "iso_a3" and "geometry" columns.
         b: Table of candidate notes to connect to, containing Geoseries of point locations.
             Must contain "id" and "geometry" columns.
-        max_distance_m: Edges only created if their span in metres is equal to or less than this value.
+        max_distance_m: Edges only created if their span in metres is less than this value.
         projected_coordinate_system: Project points to this CRS (must use metres!) before estimating distances.
+        k: Number of nearest nodes in b to connect each node in a to.
+        within_radius: If True, connect each node in a to every node in b
+            within `max_distance_m`, ignoring `k`.
 
     Returns:
         Table of linking edges.
     """
-    
-    point_pairs = find_nearest_points(
-        a.to_crs(projected_coordinate_system),
-        b.to_crs(projected_coordinate_system).rename(columns={"id": "nearest_node_id"}),
-        "nearest_node_id"
-    ).rename(columns={"distance": "distance_m"})
-
-    point_pairs = point_pairs[point_pairs.distance_m < max_distance_m]
-
-    edges = point_pairs.apply(
-        lambda row: {
-            "from_id": row.id,
-            "to_id": row.nearest_node_id,
-            "from_iso_a3": row.iso_a3,
-            "to_iso_a3": row.iso_a3,  # assume link does not cross a border
-            "geometry": LineString([row.geometry, row.nearest_node_geometry]),
-            "distance_m": row.distance_m
-        },
-        axis=1,
-        result_type="expand"
+
+    a_xy = shapely.get_coordinates(a.geometry.to_crs(projected_coordinate_system).to_numpy())
+    b_xy = shapely.get_coordinates(b.geometry.to_crs(projected_coordinate_system).to_numpy())
+    a_positions, b_positions, distances_m = find_neighbouring_points(
+        a_xy, b_xy, max_distance_m, k=k, within_radius=within_radius
     )
-    
-    return gpd.GeoDataFrame(edges).reset_index(drop=True).set_crs(projected_coordinate_system)
+
+    edges = pd.DataFrame(
+        {
+            "from_id": a.id.to_numpy()[a_positions],
+            "to_id": b.id.to_numpy()[b_positions],
+            "from_iso_a3": a.iso_a3.to_numpy()[a_positions],
+            "to_iso_a3": a.iso_a3.to_numpy()[a_positions],  # assume link does not cross a border
+            "geometry": shapely.linestrings(np.stack([a_xy[a_positions], b_xy[b_positions]], axis=1)),
+            "distance_m": distances_m,
+        }
+    )
+
+    return gpd.GeoDataFrame(edges, geometry="geometry", crs=projected_coordinate_system)
+
+
+def parse_port_road_connections(port_road_connections: int | dict, maximum_intermodal_connection_m: float) -> dict:
+    """
+    Interpret the `port_road_connections` config, describing which road nodes
+    to connect each domestic port to.
+
+    Args:
+        port_road_connections: Either a mapping with a 'mode' of 'nearest',
+            connecting each port to its 'k' nearest road nodes (closer than
+            `maximum_intermodal_connection_m`), or 'within_radius', connecting
+            each port to every road node closer than 'radius_m'. An integer
+            is taken as the 'k' of the 'nearest' mode.
+        maximum_intermodal_connection_m: Only link ports to road nodes closer
+            than this in 'nearest' mode.
+
+    Returns:
+        Keyword arguments 'max_distance_m', 'k' and 'within_radius' for
+            `create_edges_to_nearest_nodes`.
+    """
+    if isinstance(port_road_connections, int):
+        port_road_connections = {"mode": "nearest", "k": port_road_connections}
+
+    mode = port_road_connections.get("mode")
+    if mode == "nearest":
+        k = port_road_connections.get("k")
+        if not isinstance(k, int) or k < 1:
+            raise ValueError(f"port_road_connections {mode=} requires an integer k of at least 1, got {k=}")
+        return {"max_distance_m": maximum_intermodal_connection_m, "k": k, "within_radius": False}
+    elif mode == "within_radius":
+        radius_m = port_road_connections.get("radius_m")
+        if not isinstance(radius_m, (int, float)) or radius_m <= 0:
+            raise ValueError(f"port_road_connections {mode=} requires a positive radius_m, got {radius_m=}")
+        return {"max_distance_m": float(radius_m), "k": 1, "within_radius": True}
+    else:
+        raise ValueError(f"port_road_connections {mode=} not recognised, must be 'nearest' or 'within_radius'")
 
 
-def find_importing_node_id(row: pd.Series, exporting_country: str) -> str:
+def find_importing_node_ids(edges: pd.DataFrame, exporting_country: str) -> pd.Series:
     """
-    Return the node id lying in the importing country
+    Return the node ids lying in the importing country.
 
     Args:
-        row: Table row with columns from_iso_a3, to_iso_a3, from_id and to_id
+        edges: Table with columns from_iso_a3, to_iso_a3, from_id and to_id
         exporting_country: ISO A3 code of exporting country
 
     Returns
-        node id
+        node id for each edge
     """
-    if row.from_iso_a3 == exporting_country and row.to_iso_a3 != exporting_country:
-        return row.to_id
-    elif row.from_iso_a3 != exporting_country and row.to_iso_a3 == exporting_country:
-        return row.from_id
-    else:
-        raise RuntimeError
+    exports = (edges.from_iso_a3 == exporting_country) & (edges.to_iso_a3 != exporting_country)
+    imports = (edges.from_iso_a3 != exporting_country) & (edges.to_iso_a3 == exporting_country)
+    if not (exports | imports).all():
+        raise RuntimeError("Edges must cross the border of the exporting country")
+    return edges.to_id.where(exports, edges.from_id)
 
 
 def create_edges_to_destination_countries(
@@ -307,33 +368,273 @@ def create_edges_to_destination_countries(
     assert len(destination_country_nodes.iso_a3) == len(destination_country_nodes.iso_a3.unique())
     assert origin_nodes.crs == destination_country_nodes.crs
 
-    def make_edge(row: pd.Series) -> dict:
-        destination = destination_country_nodes.set_index("iso_a3").loc[row.iso_a3]
-        return {
-            "from_id": row.id,
-            "to_id": destination.id,
-            "from_iso_a3": row.iso_a3,
-            "to_iso_a3": row.iso_a3,
+    # position of destination for each origin
+    destination_index = pd.Index(destination_country_nodes.iso_a3)
+    destination_positions = destination_index.get_indexer(origin_nodes.iso_a3)
+    if (destination_positions == -1).any():
+        missing = set(origin_nodes.iso_a3[destination_positions == -1])
+        raise KeyError(f"No destination country nodes for {missing}")
+    destinations = destination_country_nodes.iloc[destination_positions]
+
+    edges = pd.DataFrame(
+        {
+            "from_id": origin_nodes.id.to_numpy(),
+            "to_id": destinations.id.to_numpy(),
+            "from_iso_a3": origin_nodes.iso_a3.to_numpy(),
+            "to_iso_a3": origin_nodes.iso_a3.to_numpy(),
             "mode": "imaginary",
-            "geometry": LineString(
-                [
-                    row.geometry,
-                    destination.geometry
-                ]
+            "geometry": shapely.linestrings(
+                np.stack(
+                    [
+                        shapely.get_coordinates(origin_nodes.geometry.to_numpy()),
+                        shapely.get_coordinates(destinations.geometry.to_numpy()),
+                    ],
+                    axis=1
+                )
             ),
-            "cost_USD_t": cost_USD_t
+            "cost_USD_t": cost_USD_t,
         }
+    )
+
+    return gpd.GeoDataFrame(edges, geometry="geometry", crs=origin_nodes.crs)
+
+
+def create_destination_country_nodes(
+    admin_boundaries: gpd.GeoDataFrame,
+    iso_a3: Sequence[str],
+    study_country: str,
+) -> gpd.GeoDataFrame:
+    """
+    Create a node for each destination country, at a representative point
+    within its boundary.
+
+    Args:
+        admin_boundaries: Table of country boundaries with GID_0 and geometry columns.
+        iso_a3: ISO A3 codes of countries present in the network, may contain
+            nulls and duplicates.
+        study_country: ISO A3 code of exporting country, which is not a destination.
+
+    Returns:
+        Table of destination country nodes with id, iso_a3 and geometry columns.
+    """
+    countries = set(pd.Series(iso_a3).dropna().unique())
+    countries.discard(study_country)
+
+    country_nodes = admin_boundaries.set_index("GID_0").loc[list(countries), ["geometry"]] \
+        .sort_index().reset_index().rename(columns={"GID_0": "iso_a3"})
+    country_nodes["id"] = "GID_0_" + country_nodes.iso_a3
+    country_nodes.geometry = country_nodes.geometry.representative_point()
+    return country_nodes.loc[:, ["id", "iso_a3", "geometry"]]
+
+
+def create_multi_modal_network(
+    road_nodes: gpd.GeoDataFrame,
+    road_edges: gpd.GeoDataFrame,
+    rail_nodes: gpd.GeoDataFrame,
+    rail_edges: gpd.GeoDataFrame,
+    maritime_nodes: gpd.GeoDataFrame,
+    maritime_edges: gpd.GeoDataFrame,
+    destination_country_nodes: gpd.GeoDataFrame,
+    study_country: str,
+    intermodal_cost_USD_t: dict[str, float],
+    port_road_connections: int | dict = 1,
+    maximum_intermodal_connection_m: float = 2_000,
+) -> tuple[gpd.GeoDataFrame, pd.DataFrame, gpd.GeoDataFrame]:
+    """
+    Combine preprocessed road, rail and maritime networks into one directed
+    multi-modal network. Link the modes together where their nodes are close,
+    and connect land border crossings and foreign ports to their destination
+    country node.
 
-    edges = origin_nodes.apply(
-        make_edge,
-        axis=1,
-        result_type="expand"
+    Args:
+        road_nodes: Road nodes, as output by `preprocess_road_network`.
+        road_edges: Road edges, as output by `preprocess_road_network`.
+        rail_nodes: Rail nodes, as output by `preprocess_rail_network`.
+        rail_edges: Rail edges, as output by `preprocess_rail_network`.
+        maritime_nodes: Maritime nodes, as output by `preprocess_maritime_network`.
+        maritime_edges: Maritime edges, as output by `preprocess_maritime_network`,
+            with geometry.
+        destination_country_nodes: Node for each destination country, with id,
+            iso_a3 and geometry columns.
+        study_country: ISO A3 code of exporting country.
+        intermodal_cost_USD_t: Cost of transfer between modes, keyed by
+            'road_rail', 'maritime_road' and 'maritime_rail'.
+        port_road_connections: Road nodes to connect each domestic port to,
+            see `parse_port_road_connections`.
+        maximum_intermodal_connection_m: Only link nodes of different modes
+            closer than this.
+
+    Returns:
+        Table of nodes, table of edges (with no repeated from_id -> to_id
+            pairs, indexed from 0) and table of the nodes on the far side of
+            land border crossings.
+    """
+    port_road_args = parse_port_road_connections(port_road_connections, maximum_intermodal_connection_m)
+
+    with stage("multi_modal.intermodal_connections"):
+        print("Making intermodal connections...")
+        stations = rail_nodes.loc[rail_nodes.station == True, ["id", "iso_a3", "geometry"]]
+        domestic_ports = maritime_nodes.loc[
+            (maritime_nodes.infra == "port") & (maritime_nodes.iso_a3 == study_country),
+            ["id", "iso_a3", "geometry"]
+        ]
+
+        # road-rail
+        rail_road_edges = create_edges_to_nearest_nodes(
+            stations,
+            road_nodes.loc[:, ["id", "geometry"]],
+            maximum_intermodal_connection_m,
+            rail_nodes.estimate_utm_crs()
+        ).to_crs(epsg=4326)
+        rail_road_edges["mode"] = "road_rail"
+
+        # road-maritime
+        maritime_road_edges = create_edges_to_nearest_nodes(
+            domestic_ports,
+            road_nodes.loc[:, ["id", "geometry"]],
+            projected_coordinate_system=road_nodes.estimate_utm_crs(),
+            **port_road_args,
+        ).to_crs(epsg=4326)
+        maritime_road_edges["mode"] = "maritime_road"
+
+        # rail-maritime
+        maritime_rail_edges = create_edges_to_nearest_nodes(
+            domestic_ports,
+            stations.loc[:, ["id", "geometry"]],
+            maximum_intermodal_connection_m,
+            road_nodes.estimate_utm_crs()
+        ).to_crs(epsg=4326)
+        maritime_rail_edges["mode"] = "maritime_rail"
+
+        # as the maritime edges are directional, we're making road, rail and intermodal directional too (so duplicate)
+        intermodal_edges = duplicate_reverse_and_append_edges(
+            pd.concat([rail_road_edges, maritime_road_edges, maritime_rail_edges])
+        )
+        intermodal_edges["cost_USD_t"] = intermodal_edges["mode"].map(intermodal_cost_USD_t)
+
+    # concatenate different kinds of nodes and edges
+    node_cols = ["id", "iso_a3", "geometry"]
+    nodes = gpd.GeoDataFrame(
+        pd.concat(
+            [
+                road_nodes.loc[:, node_cols],
+                rail_nodes.loc[:, node_cols],
+                maritime_nodes.loc[:, node_cols]
+            ]
+        ),
+        crs=4326
     )
-    
-    return gpd.GeoDataFrame(edges).reset_index(drop=True).set_crs(origin_nodes.crs)
 
+    edge_cols = ["from_id", "to_id", "from_iso_a3", "to_iso_a3", "mode", "cost_USD_t", "geometry"]
+    edges = pd.concat(
+        [
+            intermodal_edges.loc[:, edge_cols],
+            road_edges.loc[:, edge_cols],
+            rail_edges.loc[:, edge_cols],
+            maritime_edges.loc[:, edge_cols]
+        ]
+    )
 
-def path_edges_from_ordered_id_list(path_node_ids: list[str], edges: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    with stage("multi_modal.destination_connections"):
+        print("Making terminal connections to destination countries...")
+        # find nodes which lie on far side of border crossing
+        border_crossing_mask = \
+            (edges.from_iso_a3 != edges.to_iso_a3) \
+            & ((edges.from_iso_a3 == study_country) | (edges.to_iso_a3 == study_country)) \
+            & ((edges["mode"] == "road") | (edges["mode"] == "rail"))
+        importing_node_ids = find_importing_node_ids(edges[border_crossing_mask], study_country)
+        importing_nodes = nodes.set_index("id").loc[importing_node_ids].reset_index()
+        # some importing nodes may be labelled as the study country, drop these
+        importing_nodes = gpd.GeoDataFrame(importing_nodes[importing_nodes.iso_a3 != study_country], crs=4326)
+
+        # connect these nodes to their containing country
+        land_border_edges = create_edges_to_destination_countries(importing_nodes, destination_country_nodes)
+
+        # connect foreign ports to their country
+        foreign_ports = maritime_nodes[(maritime_nodes.infra == "port") & (maritime_nodes.iso_a3 != study_country)]
+        port_edges = create_edges_to_destination_countries(
+            foreign_ports,
+            destination_country_nodes,
+            DESTINATION_LINK_COST_USD_T
+        )
+
+        edges = pd.concat(
+            [
+                edges.loc[:, edge_cols],
+                duplicate_reverse_and_append_edges(land_border_edges.loc[:, edge_cols]),
+                duplicate_reverse_and_append_edges(port_edges.loc[:, edge_cols]),
+            ]
+        ).reset_index(drop=True)
+
+        # there are duplicate edges (repeated from_id -> to_id pairs), drop these here
+        edges = edges[~edges.duplicated(subset=["from_id", "to_id"], keep="first")].reset_index(drop=True)
+
+    nodes = pd.concat([nodes, destination_country_nodes.loc[:, node_cols]]).reset_index(drop=True)
+
+    return nodes, edges, importing_nodes
+
+
+@dataclass
+class EdgeIndex:
+    """
+    Lookup from (from_id, to_id) node id pairs to the position of the edge
+    joining them. Build once with `from_edges` and reuse for many paths.
+    """
+    # unique (from_id, to_id) pairs
+    node_pairs: pd.MultiIndex
+    # position in edges of the edge joining each pair of node_pairs
+    positions: np.ndarray
+    # whether more than one edge joins each pair of node_pairs
+    ambiguous: np.ndarray
+
+    @classmethod
+    def from_edges(cls, edges: pd.DataFrame) -> "EdgeIndex":
+        """
+        Args:
+            edges: Table of edges with from_id and to_id columns
+
+        Returns:
+            Index of edges
+        """
+        node_pairs = pd.MultiIndex.from_arrays([edges.from_id.to_numpy(), edges.to_id.to_numpy()])
+        duplicated = node_pairs.duplicated(keep=False)
+        first = ~node_pairs.duplicated(keep="first")
+        return cls(
+            node_pairs=node_pairs[first],
+            positions=np.flatnonzero(first),
+            ambiguous=duplicated[first],
+        )
+
+    def path_edge_positions(self, paths: Sequence[Sequence[str]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the edges traversed by many paths in one lookup.
+
+        Args:
+            paths: Sequential node ids of each path through graph
+
+        Returns:
+            Offsets of each path into edge positions (length of number of
+                paths + 1), and the ordered positions in edges of the edges of
+                all paths. The edges of path i are
+                `positions[offsets[i]: offsets[i + 1]]`.
+        """
+        n_hops = np.array([max(len(path) - 1, 0) for path in paths], dtype=np.int64)
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum(n_hops, out=offsets[1:])
+        from_ids = [node_id for path in paths for node_id in path[:-1]]
+        to_ids = [node_id for path in paths for node_id in path[1:]]
+
+        pair_positions = self.node_pairs.get_indexer(pd.MultiIndex.from_arrays([from_ids, to_ids]))
+        assert (pair_positions != -1).all(), "No edge joins some consecutive nodes of path"
+        assert not self.ambiguous[pair_positions].any(), "More than one edge joins some consecutive nodes of path"
+        return offsets, self.positions[pair_positions]
+
+
+def path_edges_from_ordered_id_list(
+    path_node_ids: list[str],
+    edges: gpd.GeoDataFrame,
+    edge_index: EdgeIndex | None = None,
+) -> gpd.GeoDataFrame:
     """
     If `path_node_ids` are sequential nodes forming a path through a graph made of `edges`,
     return the subset of ordered edges connecting these nodes.
@@ -341,14 +642,13 @@ def path_edges_from_ordered_id_list(path_node_ids: list[str], edges: gpd.GeoData
     Args:
         path_node_ids: Sequential node ids of some path through graph
         edges: Set of edges containing possible path edges
+        edge_index: Index of `edges`, pass this when looking up many paths
+            across the same edges to avoid rebuilding it on every call
 
     Returns:
         Ordered subset of `edges` corresponding to path prescribed by `path_node_ids`
     """
-    route_edges = []
-    for i, from_node_id in enumerate(path_node_ids[:-1]):
-        to_node_id = path_node_ids[i + 1]
-        edge = edges[(edges.from_id == from_node_id) & (edges.to_id == to_node_id)]
-        assert len(edge) == 1
-        route_edges.append(edge)
-    return pd.concat(route_edges)
\ No newline at end of file
+    if edge_index is None:
+        edge_index = EdgeIndex.from_edges(edges)
+    _, positions = edge_index.path_edge_positions([path_node_ids])
+    return edges.iloc[positions]
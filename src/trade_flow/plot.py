@@ -1,8 +1,14 @@
+import multiprocessing
+import os
+
 import geopandas as gpd
+import matplotlib
+import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import shapely
 from shapely.ops import split
+from tqdm import tqdm
 
 
 def chop_at_antimeridian(gdf: gpd.GeoDataFrame, drop_null_geometry: bool = False) -> gpd.GeoDataFrame:
@@ -26,7 +32,16 @@ def chop_at_antimeridian(gdf: gpd.GeoDataFrame, drop_null_geometry: bool = False
     assert set(gdf.geometry.type) == {'LineString'}
 
     def split_on_meridian(gdf: gpd.GeoDataFrame, meridian: shapely.geometry.LineString) -> gpd.GeoDataFrame:
-        return gdf.assign(geometry=gdf.apply(lambda row: split(row.geometry, meridian), axis=1)).explode(index_parts=False)
+        geometry = gdf.geometry.to_numpy()
+        # only lines touching the meridian can be split by it, split those alone
+        touching = shapely.intersects(geometry, meridian)
+        parts = np.empty(len(gdf), dtype=object)
+        parts[~touching] = geometry[~touching]
+        parts[touching] = [split(line, meridian) for line in geometry[touching]]
+        parts, positions = shapely.get_parts(parts, return_index=True)
+        chopped = gdf.iloc[positions].copy()
+        chopped.geometry = gpd.GeoSeries(parts, index=chopped.index, crs=gdf.crs)
+        return chopped
 
     xlim = 179.9
     ylim = 90
@@ -34,19 +49,130 @@ def chop_at_antimeridian(gdf: gpd.GeoDataFrame, drop_null_geometry: bool = False
     split_e = split_on_meridian(gdf, shapely.geometry.LineString([(xlim, ylim), (xlim, -ylim)]))
     split_e_and_w = split_on_meridian(split_e, shapely.geometry.LineString([(-xlim, ylim), (-xlim, -ylim)]))
 
-    def crosses_antimeridian(row: pd.Series) -> bool:
-        """
-        Check if there are longitudes in a geometry that are near the antimeridian
-            (i.e. -180) and both sides of it. If so, return true.
-        """
-        x, _ = row.geometry.coords.xy
-        longitudes_near_antimeridian = np.array(x)[np.argwhere(np.abs(np.abs(x) - 180) < xlim).ravel()]
-        if len(longitudes_near_antimeridian) == 0:
-            return False
-        hemispheres = np.unique(np.sign(longitudes_near_antimeridian))
-        if (-1 in hemispheres) and (1 in hemispheres):
-            return True
-        else:
-            return False
-
-    return split_e_and_w[~split_e_and_w.apply(crosses_antimeridian, axis=1)]
\ No newline at end of file
+    # check if there are longitudes in a geometry that are near the antimeridian
+    # (i.e. -180) and both sides of it, if so, it crosses the antimeridian
+    coordinates, geometry_positions = shapely.get_coordinates(split_e_and_w.geometry.to_numpy(), return_index=True)
+    x = coordinates[:, 0]
+    near_antimeridian = np.abs(np.abs(x) - 180) < xlim
+    n_geometries = len(split_e_and_w)
+    east = np.bincount(geometry_positions, weights=near_antimeridian & (x > 0), minlength=n_geometries) > 0
+    west = np.bincount(geometry_positions, weights=near_antimeridian & (x < 0), minlength=n_geometries) > 0
+    crosses_antimeridian = east & west
+
+    return split_e_and_w[~crosses_antimeridian]
+
+
+def init_port_plot_worker(world: gpd.GeoDataFrame) -> None:
+    """
+    Configure matplotlib and keep a basemap to persist through worker lifetime.
+
+    Args:
+        world: Basemap to draw beneath every plot.
+    """
+    matplotlib.use("Agg")
+    plt.style.use("bmh")
+    global basemap
+    basemap = world
+    return
+
+
+def plot_port_routes(task: tuple[str, gpd.GeoDataFrame, gpd.GeoDataFrame, str]) -> str | None:
+    """
+    Plot the estimated routes from a port, over the basemap.
+
+    Args:
+        task: Port id, port node, routes from port (already chopped at the
+            antimeridian) and path to save figure to.
+
+    Returns:
+        Port id if plotting failed, otherwise None.
+    """
+    port_id, port, routes, filepath = task
+    f, ax = plt.subplots(figsize=(10,10))
+    try:
+        try:
+            routes.plot(
+                column="to_port",
+                categorical=True,
+                ax=ax
+            )
+        except ValueError:
+            return port_id
+        port.plot(
+            ax=ax,
+            markersize=500,
+            marker="*",
+            facecolor="none",
+            color="r"
+        )
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+        basemap.plot(ax=ax, linewidth=0.5, alpha=0.4)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        port_name, = port.name
+        ax.set_title(f"{port_id} ({port_name.replace('_', ', ')}) estimated routes")
+        ax.get_xaxis().set_visible(False)
+        ax.get_yaxis().set_visible(False)
+
+        f.savefig(filepath)
+    finally:
+        plt.close(f)
+    return None
+
+
+def plot_port_connections(
+    maritime_nodes: gpd.GeoDataFrame,
+    maritime_edges: gpd.GeoDataFrame,
+    world: gpd.GeoDataFrame,
+    output_dir: str,
+    n_cpu: int,
+) -> None:
+    """
+    Plot the routes from each port, one figure per port, rendered across a
+    pool of workers.
+
+    Maritime geometry is chopped at the antimeridian once, up front, rather
+    than for each port.
+
+    Args:
+        maritime_nodes: Maritime network nodes, with id and name columns.
+        maritime_edges: Maritime network edges, with from_port, to_port and
+            (possibly null) geometry columns.
+        world: Basemap to draw beneath every plot.
+        output_dir: Directory to save figures to, as {port_id}.png.
+        n_cpu: Number of CPUs to use.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    failed = []
+    try:
+        chopped = chop_at_antimeridian(maritime_edges, drop_null_geometry=True)
+    except ValueError:
+        # some geometry cannot be split, chop port by port and skip those ports
+        chopped_by_port = []
+        for port_id, routes in maritime_edges.groupby("from_port", sort=False):
+            try:
+                chopped_by_port.append(chop_at_antimeridian(routes, drop_null_geometry=True))
+            except ValueError:
+                failed.append(port_id)
+        chopped = pd.concat(chopped_by_port) if chopped_by_port else maritime_edges.iloc[:0]
+
+    port_nodes = maritime_nodes.set_index("id", drop=False)
+    tasks = [
+        (port_id, port_nodes.loc[[f"{port_id}_land"]], routes, os.path.join(output_dir, f"{port_id}.png"))
+        for port_id, routes in chopped.groupby("from_port", sort=False)
+    ]
+
+    with multiprocessing.Pool(
+        processes=n_cpu,
+        initializer=init_port_plot_worker,
+        initargs=(world,),
+    ) as pool:
+        for port_id in tqdm(pool.imap_unordered(plot_port_routes, tasks), total=len(tasks)):
+            if port_id is not None:
+                failed.append(port_id)
+
+    for port_id in failed:
+        print(f"Failed to plot {port_id}, skipping...")
+    return
@@ -0,0 +1,340 @@
+"""
+Compact, columnar storage for routes (source -> destination pairs, their
+flows and the edges they traverse).
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+
+@dataclass
+class RouteStore:
+    """
+    Routes held as flat arrays, one element per route, plus a compressed
+    sparse row (CSR) representation of the edges constituting each route.
+
+    The edges of route i are `edge_indices[offsets[i]: offsets[i + 1]]`.
+
+    Source and destination nodes are stored as integer codes into arrays of
+    labels, e.g. `source_labels[source_codes[i]]` is the source node of route i.
+    """
+    source_codes: np.ndarray
+    source_labels: np.ndarray
+    destination_codes: np.ndarray
+    destination_labels: np.ndarray
+    value_kusd: np.ndarray
+    volume_tons: np.ndarray
+    offsets: np.ndarray
+    edge_indices: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.value_kusd)
+
+    @property
+    def source_node(self) -> np.ndarray:
+        """Source node of each route."""
+        return self.source_labels[self.source_codes]
+
+    @property
+    def destination_node(self) -> np.ndarray:
+        """Destination node of each route."""
+        return self.destination_labels[self.destination_codes]
+
+    @property
+    def route_lengths(self) -> np.ndarray:
+        """Number of edges in each route."""
+        return np.diff(self.offsets)
+
+    def route(self, i: int) -> np.ndarray:
+        """
+        Args:
+            i: Position of route in store.
+
+        Returns:
+            Edge indices of route i.
+        """
+        return self.edge_indices[self.offsets[i]: self.offsets[i + 1]]
+
+    @classmethod
+    def from_paths(
+        cls,
+        source_nodes: Sequence[str],
+        destination_nodes: Sequence[str],
+        value_kusd: Sequence[float],
+        volume_tons: Sequence[float],
+        edge_paths: Sequence[Sequence[int]],
+    ) -> "RouteStore":
+        """
+        Create store from per-route sequences, e.g. edge paths returned by
+        igraph.Graph.get_shortest_paths.
+
+        Args:
+            source_nodes: Source node of each route.
+            destination_nodes: Destination node of each route.
+            value_kusd: Value of flow along each route.
+            volume_tons: Volume of flow along each route.
+            edge_paths: Edge indices of each route.
+
+        Returns:
+            Store of routes.
+        """
+        lengths = np.fromiter(map(len, edge_paths), dtype=np.int64, count=len(edge_paths))
+        offsets = np.zeros(len(edge_paths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        edge_indices = np.fromiter(
+            (edge for path in edge_paths for edge in path),
+            dtype=np.int32,
+            count=offsets[-1]
+        )
+        return cls.from_edge_arrays(
+            source_nodes,
+            destination_nodes,
+            value_kusd,
+            volume_tons,
+            offsets,
+            edge_indices,
+        )
+
+    @classmethod
+    def from_edge_arrays(
+        cls,
+        source_nodes: Sequence[str],
+        destination_nodes: Sequence[str],
+        value_kusd: Sequence[float],
+        volume_tons: Sequence[float],
+        offsets: np.ndarray,
+        edge_indices: np.ndarray,
+    ) -> "RouteStore":
+        """
+        Create store from per-route sequences and the edges of every route
+        already in CSR form.
+
+        Args:
+            source_nodes: Source node of each route.
+            destination_nodes: Destination node of each route.
+            value_kusd: Value of flow along each route.
+            volume_tons: Volume of flow along each route.
+            offsets: Edges of route i are `edge_indices[offsets[i]: offsets[i + 1]]`.
+            edge_indices: Edge indices of all routes, concatenated.
+
+        Returns:
+            Store of routes.
+        """
+        source_codes, source_labels = pd.factorize(np.asarray(source_nodes, dtype=object))
+        destination_codes, destination_labels = pd.factorize(np.asarray(destination_nodes, dtype=object))
+        return cls(
+            source_codes=source_codes.astype(np.int32),
+            source_labels=np.asarray(source_labels, dtype=object),
+            destination_codes=destination_codes.astype(np.int32),
+            destination_labels=np.asarray(destination_labels, dtype=object),
+            value_kusd=np.asarray(value_kusd, dtype=np.float64),
+            volume_tons=np.asarray(volume_tons, dtype=np.float64),
+            offsets=np.asarray(offsets, dtype=np.int64),
+            edge_indices=np.asarray(edge_indices, dtype=np.int32),
+        )
+
+    @classmethod
+    def empty(cls) -> "RouteStore":
+        """
+        Returns:
+            Store containing no routes.
+        """
+        return cls.from_paths([], [], [], [], [])
+
+    @classmethod
+    def concat(cls, stores: Iterable["RouteStore"]) -> "RouteStore":
+        """
+        Concatenate stores, recoding source and destination nodes to a common
+        set of labels.
+
+        Args:
+            stores: Stores to concatenate, in order.
+
+        Returns:
+            Single store containing all routes.
+        """
+        stores = [store for store in stores if len(store) > 0]
+        if not stores:
+            return cls.empty()
+
+        def recode(codes_attr: str, labels_attr: str) -> tuple[np.ndarray, np.ndarray]:
+            labels = pd.unique(np.concatenate([getattr(store, labels_attr) for store in stores]))
+            label_index = pd.Index(labels)
+            codes = np.concatenate(
+                [
+                    label_index.get_indexer(getattr(store, labels_attr))[getattr(store, codes_attr)]
+                    for store in stores
+                ]
+            )
+            return codes.astype(np.int32), np.asarray(labels, dtype=object)
+
+        source_codes, source_labels = recode("source_codes", "source_labels")
+        destination_codes, destination_labels = recode("destination_codes", "destination_labels")
+
+        lengths = np.concatenate([store.route_lengths for store in stores])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return cls(
+            source_codes=source_codes,
+            source_labels=source_labels,
+            destination_codes=destination_codes,
+            destination_labels=destination_labels,
+            value_kusd=np.concatenate([store.value_kusd for store in stores]),
+            volume_tons=np.concatenate([store.volume_tons for store in stores]),
+            offsets=offsets,
+            edge_indices=np.concatenate(
+                [store.edge_indices[store.offsets[0]: store.offsets[-1]] for store in stores]
+            ),
+        )
+
+    def take(self, indices: np.ndarray) -> "RouteStore":
+        """
+        Select (and potentially reorder) routes by position.
+
+        Args:
+            indices: Positions of routes to take.
+
+        Returns:
+            Store of selected routes.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.route_lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position in self.edge_indices of each edge of each selected route
+        edge_positions = np.repeat(self.offsets[indices] - offsets[:-1], lengths) \
+            + np.arange(offsets[-1], dtype=np.int64)
+        return RouteStore(
+            source_codes=self.source_codes[indices],
+            source_labels=self.source_labels,
+            destination_codes=self.destination_codes[indices],
+            destination_labels=self.destination_labels,
+            value_kusd=self.value_kusd[indices],
+            volume_tons=self.volume_tons[indices],
+            offsets=offsets,
+            edge_indices=self.edge_indices[edge_positions],
+        )
+
+    def to_table(self) -> pa.Table:
+        """
+        Returns:
+            Arrow table with dictionary encoded source and destination node
+                columns and a list column of edge indices.
+        """
+        return pa.table(
+            {
+                "source_node": pa.DictionaryArray.from_arrays(
+                    self.source_codes, pa.array(self.source_labels)
+                ),
+                "destination_node": pa.DictionaryArray.from_arrays(
+                    self.destination_codes, pa.array(self.destination_labels)
+                ),
+                "value_kusd": self.value_kusd,
+                "volume_tons": self.volume_tons,
+                "edge_indices": pa.LargeListArray.from_arrays(
+                    self.offsets - self.offsets[0],
+                    pa.array(self.edge_indices[self.offsets[0]: self.offsets[-1]], type=pa.int32())
+                ),
+            }
+        )
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "RouteStore":
+        """
+        Create store from Arrow table (as written by `to_table`). Where the
+        table consists of a single chunk, numeric arrays are views onto the
+        Arrow buffers (no copy).
+
+        Args:
+            table: Table with source_node, destination_node, value_kusd,
+                volume_tons and edge_indices columns.
+
+        Returns:
+            Store of routes.
+        """
+
+        def dictionary_column(name: str) -> tuple[np.ndarray, np.ndarray]:
+            column = table.column(name)
+            if not pa.types.is_dictionary(column.type):
+                column = column.dictionary_encode()
+            column = column.unify_dictionaries()
+            if column.num_chunks == 0:
+                return np.array([], dtype=np.int32), np.array([], dtype=object)
+            if column.num_chunks == 1:
+                codes = column.chunk(0).indices.to_numpy(zero_copy_only=False)
+            else:
+                codes = np.concatenate([chunk.indices.to_numpy(zero_copy_only=False) for chunk in column.chunks])
+            labels = column.chunk(0).dictionary.to_numpy(zero_copy_only=False)
+            return codes.astype(np.int32, copy=False), labels.astype(object)
+
+        def numeric_column(name: str) -> np.ndarray:
+            return table.column(name).combine_chunks().to_numpy(zero_copy_only=False)
+
+        source_codes, source_labels = dictionary_column("source_node")
+        destination_codes, destination_labels = dictionary_column("destination_node")
+
+        edge_lists = table.column("edge_indices").combine_chunks()
+        offsets = edge_lists.offsets.to_numpy().astype(np.int64, copy=False)
+        edge_indices = edge_lists.values.to_numpy(zero_copy_only=False)
+
+        return cls(
+            source_codes=source_codes,
+            source_labels=source_labels,
+            destination_codes=destination_codes,
+            destination_labels=destination_labels,
+            value_kusd=numeric_column("value_kusd"),
+            volume_tons=numeric_column("volume_tons"),
+            offsets=offsets,
+            edge_indices=edge_indices.astype(np.int32, copy=False),
+        )
+
+    def to_parquet(self, path: str) -> None:
+        """
+        Write store to disk as parquet, with edge indices as a list column.
+
+        Args:
+            path: Path to write to.
+        """
+        pq.write_table(self.to_table(), path)
+
+    @classmethod
+    def read_parquet(cls, path: str) -> "RouteStore":
+        """
+        Args:
+            path: Path to parquet file written by `to_parquet`.
+
+        Returns:
+            Store of routes.
+        """
+        return cls.from_table(pq.read_table(path, memory_map=True))
+
+    def to_feather(self, path: str) -> None:
+        """
+        Write store to disk as uncompressed Arrow IPC (feather) file, which may
+        be memory-mapped when read.
+
+        Args:
+            path: Path to write to.
+        """
+        feather.write_feather(self.to_table(), path, compression="uncompressed")
+
+    @classmethod
+    def read_feather(cls, path: str) -> "RouteStore":
+        """
+        Memory-map a store written by `to_feather`, numeric arrays will
+        reference the file's pages rather than copies in memory.
+
+        Args:
+            path: Path to feather file written by `to_feather`.
+
+        Returns:
+            Store of routes.
+        """
+        return cls.from_table(feather.read_table(path, memory_map=True))
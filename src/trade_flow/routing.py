@@ -2,28 +2,28 @@
 Allocate flows (value and volume) from an origin-destination (OD) file across a network of edges.
 """
 
+import dataclasses
+import json
 import multiprocessing
 import os
 import tempfile
 import time
+from dataclasses import dataclass
+from functools import partial
 
-import igraph as ig
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from scipy.sparse.csgraph import dijkstra
 from tqdm import tqdm
 
-
-# dict containing:
-# 'value_kusd' -> float
-# 'volume_tons' -> float
-# 'edge_indicies' -> list[indicies]
-FlowResult = dict[str, float | list[int]]
-
-# dict with FlowResult values
-# source node, destination country -> FlowResult dict
-# e.g.
-# ('thailand_4_123', 'GID_0_GBR')  -> FlowResult dict
-RouteResult = dict[tuple[str, str], FlowResult]
+from trade_flow.graph import (
+    AdjacencyMatrix, CSRGraph, attach_arrays, edge_vertex_ids, fingerprint_arrays, publish_arrays
+)
+from trade_flow.instrument import TaskTiming, record_task, stage, task_clock, task_timing
+from trade_flow.route_store import RouteStore
 
 
 # We do not do routing within partner countries, instead we terminate at a port
@@ -36,85 +36,694 @@ RouteResult = dict[tuple[str, str], FlowResult]
 # these imaginary links and remove them.
 DESTINATION_LINK_COST_USD_T: float = 1E6
 
+# key of shard file metadata listing the vertices routed in that shard
+SHARD_VIDS_KEY: bytes = b"trade_flow:vids"
+
+# maximum number of entries in the distance and predecessor matrices returned
+# by each call to scipy's dijkstra, i.e. trees grown per call * vertices
+# at 2**24, ~200MB per worker (float64 distances and int32 predecessors)
+CSGRAPH_MAX_MATRIX_ENTRIES: int = 2 ** 24
+
+
+@dataclass
+class ODIndex:
+    """
+    OD flows held as contiguous arrays of vertex ids, sorted by key (origin
+    or destination vertex id). The flows for any one key are a slice of these
+    arrays, so looking them up costs no more than the number of flows for that
+    key (rather than a scan of the whole OD).
+
+    Within a key, flows retain their order in the original OD.
+    """
+    # sorted unique key values
+    keys: np.ndarray
+    # flows for keys[i] are found at [offsets[i]: offsets[i + 1]]
+    offsets: np.ndarray
+    origin_vid: np.ndarray
+    destination_vid: np.ndarray
+    value_kusd: np.ndarray
+    volume_tons: np.ndarray
+
+    @classmethod
+    def from_od(cls, od: pd.DataFrame, key: str = "origin_vid") -> "ODIndex":
+        """
+        Sort and index OD table by `key`.
+
+        Args:
+            od: Table of flows from 'origin_vid' to 'destination_vid', should
+                also contain 'value_kusd' and 'volume_tons'.
+            key: Column of `od` to group flows by.
 
-def init_worker(graph_filepath: str, od_filepath: str) -> None:
+        Returns:
+            Indexed OD.
+        """
+        key_values = od[key].to_numpy()
+        order = np.argsort(key_values, kind="stable")
+        keys, counts = np.unique(key_values, return_counts=True)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(
+            keys=keys,
+            offsets=offsets,
+            origin_vid=od.origin_vid.to_numpy(dtype=np.int32)[order],
+            destination_vid=od.destination_vid.to_numpy(dtype=np.int32)[order],
+            value_kusd=od.value_kusd.to_numpy(dtype=np.float64)[order],
+            volume_tons=od.volume_tons.to_numpy(dtype=np.float64)[order],
+        )
+
+    def flows(self, key: int) -> slice:
+        """
+        Args:
+            key: Key value to lookup flows for.
+
+        Returns:
+            Slice of OD arrays containing flows for `key`.
+        """
+        i = np.searchsorted(self.keys, key)
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+
+# edges removed from the graph in the scenario a worker is currently routing
+# (None if routing across the intact graph)
+removed_edges: np.ndarray | None = None
+
+
+def init_worker(graph_dir: str, od_dir: str, backend: str = "igraph") -> None:
     """
     Create global variables referencing graph and OD to persist through worker lifetime.
 
     Args:
-        graph_filepath: Filepath of pickled igraph.Graph to route over.
-        od_filepath: Filepath to table of flows from origin node 'id' to
-            destination country 'partner_GID_0', should also contain 'value_kusd'
-            and 'volume_tons'.
+        graph_dir: Directory graph arrays have been published to. CSRGraph
+            arrays for the 'igraph' backend, AdjacencyMatrix arrays for 'scipy'.
+        od_dir: Directory ODIndex arrays have been published to.
+        backend: Shortest path implementation to route with, see
+            `route_from_all_nodes`.
     """
     print(f"Process {os.getpid()} initialising...")
-    global graph
-    graph = ig.Graph.Read_Pickle(graph_filepath)
+    global routing_backend
+    routing_backend = backend
+    if backend == "igraph":
+        csr_graph = attach_arrays(CSRGraph, graph_dir)
+        global graph, weight
+        # igraph holds a private copy of the topology, and converts weights on every
+        # search, which is much faster from an in-memory array than a memory-mapped one
+        graph = csr_graph.to_igraph()
+        weight = np.array(csr_graph.weight)
+    else:
+        # scipy routes over the memory-mapped arrays without copying them
+        global adjacency, csgraph
+        adjacency = attach_arrays(AdjacencyMatrix, graph_dir)
+        csgraph = adjacency.to_scipy()
     global od
-    od = pd.read_parquet(od_filepath)
+    od = attach_arrays(ODIndex, od_dir)
+    return
+
+
+def init_scenario_worker(graph_root: str, od_root: str, edge_masks_path: str, backend: str = "igraph") -> None:
+    """
+    Create global variables referencing graph, OD and edge masks of each
+    scenario to persist through worker lifetime.
+
+    Args:
+        graph_root: Directory containing an 'intact' subdirectory with the
+            graph arrays of the intact network published to it, see
+            `init_worker`. For the 'scipy' backend, also one subdirectory per
+            scenario (named by scenario number) with the AdjacencyMatrix of
+            the network without that scenario's removed edges.
+        od_root: Directory containing an 'intact' subdirectory and one
+            subdirectory per scenario (named by scenario number), each with
+            ODIndex arrays published to it.
+        edge_masks_path: Path to .npy boolean array of shape (n_scenarios,
+            n_edges), True where an edge is removed in a scenario.
+        backend: Shortest path implementation to route with, see
+            `route_from_all_nodes`.
+    """
+    init_worker(os.path.join(graph_root, "intact"), os.path.join(od_root, "intact"), backend)
+    global scenario_graph_root, scenario_od_root
+    scenario_graph_root = graph_root
+    scenario_od_root = od_root
+    global edge_masks
+    edge_masks = np.load(edge_masks_path, mmap_mode="r")
+    if backend == "igraph":
+        global intact_weight
+        intact_weight = weight
+    global current_scenario
+    current_scenario = None
+    return
+
+
+def select_scenario(scenario: int | None) -> None:
+    """
+    Switch worker to routing a different scenario. With igraph, removed edges
+    are given infinite weight, so the graph itself need not be rebuilt. With
+    scipy, attach to the scenario's matrix.
+
+    Args:
+        scenario: Number of scenario to route, or None for the intact graph.
+    """
+    global current_scenario, od, removed_edges, weight, adjacency, csgraph
+    if scenario == current_scenario:
+        return
+    scenario_dir = "intact" if scenario is None else str(scenario)
+    od = attach_arrays(ODIndex, os.path.join(scenario_od_root, scenario_dir))
+    if routing_backend == "scipy":
+        # removed edges are absent from the scenario's matrix
+        adjacency = attach_arrays(AdjacencyMatrix, os.path.join(scenario_graph_root, scenario_dir))
+        csgraph = adjacency.to_scipy()
+    elif scenario is None:
+        removed_edges = None
+        weight = intact_weight
+    else:
+        removed_edges = np.asarray(edge_masks[scenario])
+        weight = np.where(removed_edges, np.inf, intact_weight)
+    current_scenario = scenario
     return
 
 
-def route_from_node(from_node: str) -> RouteResult:
+def drop_removed_edge_paths(edge_paths: list[list[int]]) -> list[list[int]]:
     """
-    Route flows from single 'from_node' to destinations across graph. Record value and
-    volume flowing across each edge.
+    Infinite weight edges are still traversed if there is no other way to
+    reach a vertex. Treat any such path as no path at all.
 
     Args:
-        from_node: Node ID of source node.
+        edge_paths: Edge indices of each route.
 
     Returns:
-        Mapping from (source node, destination country node) key, to value of
-            flow, volume of flow and list of edge ids of route.
+        Edge paths, with any path using a removed edge emptied.
+    """
+    if removed_edges is None:
+        return edge_paths
+    return [[] if removed_edges[edge_path].any() else edge_path for edge_path in edge_paths]
+
+
+def route_from_node(from_vid: int) -> RouteStore:
     """
-    print(f"Process {os.getpid()} routing {from_node}...")
+    Route flows from single origin vertex to destinations across graph. Record
+    value and volume flowing across each edge.
+
+    Args:
+        from_vid: Vertex ID of source node.
 
-    from_node_od = od[od.id == from_node]
-    destination_nodes: list[str] = [f"GID_0_{iso_a3}" for iso_a3 in from_node_od.partner_GID_0.unique()]
+    Returns:
+        Routes from source vertex to each destination country vertex, with
+            value of flow, volume of flow and edge ids of route.
+    """
+    flows: slice = od.flows(from_vid)
+    destination_vids: np.ndarray = od.destination_vid[flows]
+
+    routes_edge_list: list[list[int]] = graph.get_shortest_paths(
+        from_vid,
+        destination_vids.tolist(),
+        weights=weight,
+        output="epath"
+    )
+    assert len(routes_edge_list) == len(destination_vids)
+    routes_edge_list = drop_removed_edge_paths(routes_edge_list)
+
+    # trade value and volume for each pairing of from_node and partner country
+    routes = RouteStore.from_paths(
+        [from_vid] * len(destination_vids),
+        destination_vids,
+        od.value_kusd[flows],
+        od.volume_tons[flows],
+        routes_edge_list
+    )
+
+    return routes
+
+
+def route_to_destination(destination_vid: int) -> RouteStore:
+    """
+    Route flows to single destination vertex from all origins with a flow to
+    it. Grow one shortest path tree from the destination over the reversed
+    graph and read the least cost route for every origin from that tree.
+
+    Args:
+        destination_vid: Vertex ID of destination country node.
+
+    Returns:
+        Routes from each source vertex to destination country vertex, with
+            value of flow, volume of flow and edge ids of route.
+    """
+    flows: slice = od.flows(destination_vid)
+    from_vids: np.ndarray = od.origin_vid[flows]
+
+    # with mode="in" we traverse edges backwards, from destination to source
+    # the edge paths returned start at the destination, so reverse them
+    routes_edge_list: list[list[int]] = graph.get_shortest_paths(
+        destination_vid,
+        from_vids.tolist(),
+        weights=weight,
+        mode="in",
+        output="epath"
+    )
+    assert len(routes_edge_list) == len(from_vids)
+    routes_edge_list = drop_removed_edge_paths(routes_edge_list)
+
+    routes = RouteStore.from_paths(
+        from_vids,
+        [destination_vid] * len(from_vids),
+        od.value_kusd[flows],
+        od.volume_tons[flows],
+        [edge_path[::-1] for edge_path in routes_edge_list]
+    )
+
+    return routes
+
+
+def predecessor_paths(
+    adjacency: AdjacencyMatrix,
+    predecessors: np.ndarray,
+    trees: np.ndarray,
+    ends: np.ndarray,
+    reverse: bool,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read paths from shortest path trees, walking from the end of every path
+    back towards the root of its tree, one step for all paths at a time.
+
+    Args:
+        adjacency: Matrix the trees were grown over.
+        predecessors: Predecessor matrix returned by scipy's dijkstra, one row
+            per tree, negative where a vertex has no predecessor.
+        trees: Row of `predecessors` holding the tree of each path.
+        ends: Vertex ID each path ends at.
+        reverse: If False, give the edges of each path from end to root,
+            if True, from root to end.
+
+    Returns:
+        Offsets and edge indices of paths, as `RouteStore`. Paths to the root
+            itself or to vertices the tree does not reach are empty.
+    """
+    path_ids: list[np.ndarray] = [np.array([], dtype=np.int64)]
+    steps: list[np.ndarray] = [np.array([], dtype=np.int64)]
+    edge_indices: list[np.ndarray] = [np.array([], dtype=np.int32)]
+
+    active = np.arange(len(ends))
+    current = np.asarray(ends, dtype=np.int64)
+    step = 0
+    while len(active) > 0:
+        previous = predecessors[trees[active], current]
+        reached = previous >= 0
+        active, current, previous = active[reached], current[reached], previous[reached]
+        path_ids.append(active)
+        steps.append(np.full(len(active), step))
+        edge_indices.append(adjacency.find_edges(previous, current))
+        current = previous
+        step += 1
+
+    path_ids = np.concatenate(path_ids)
+    steps = np.concatenate(steps)
+    order = np.lexsort((-steps if reverse else steps, path_ids))
+    offsets = np.zeros(len(ends) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(path_ids, minlength=len(ends)), out=offsets[1:])
+    return offsets, np.concatenate(edge_indices)[order]
+
+
+def route_many(root: str, vids: np.ndarray) -> RouteStore:
+    """
+    Route flows for many origins or destinations with scipy's dijkstra, which
+    grows shortest path trees from many vertices per call. The routes of every
+    flow are then read from the trees' predecessors together.
+
+    The worker's matrix is of the reversed graph when rooting trees at
+    destinations, as for `route_to_destination`.
+
+    Args:
+        root: 'origin' or 'destination', see `route_batch`.
+        vids: Vertex IDs of origins or destinations to route.
+
+    Returns:
+        Routes of all flows from or to `vids`, with value of flow, volume of
+            flow and edge ids of route.
+    """
+    trees_per_call = max(1, CSGRAPH_MAX_MATRIX_ENTRIES // adjacency.n_vertices)
 
-    routes_edge_list = []
-    try:
-        routes_edge_list: list[list[int]] = graph.get_shortest_paths(
-            f"road_{from_node}",
-            destination_nodes,
-            weights="cost_USD_t",
-            output="epath"
+    routes: list[RouteStore] = []
+    for i in range(0, len(vids), trees_per_call):
+        call_vids = np.asarray(vids[i: i + trees_per_call])
+        _, predecessors = dijkstra(csgraph, indices=call_vids, return_predecessors=True)
+
+        flows = [od.flows(vid) for vid in call_vids]
+        flow_index = np.concatenate([np.arange(f.start, f.stop) for f in flows])
+        trees = np.repeat(np.arange(len(call_vids)), [f.stop - f.start for f in flows])
+        origin_vids = od.origin_vid[flow_index]
+        destination_vids = od.destination_vid[flow_index]
+
+        offsets, edge_indices = predecessor_paths(
+            adjacency,
+            predecessors,
+            trees,
+            destination_vids if root == "origin" else origin_vids,
+            # trees rooted at origins are read from destination back to origin
+            reverse=root == "origin",
         )
-    except ValueError as error:
-        if "no such vertex" in str(error):
-            print(f"{error}... skipping destination")
-            pass
-        else:
-            raise error
+        routes.append(
+            RouteStore.from_edge_arrays(
+                origin_vids,
+                destination_vids,
+                od.value_kusd[flow_index],
+                od.volume_tons[flow_index],
+                offsets,
+                edge_indices,
+            )
+        )
+
+    return RouteStore.concat(routes)
+
+
+def write_shard(routes: RouteStore, vids: np.ndarray, shard_dir: str) -> str:
+    """
+    Write the routes for a completed batch to disk. The vertices that were
+    routed are recorded in the file's metadata, so we can tell which batches
+    are complete even if they yielded no routes.
+
+    Files are first written to a temporary path and then moved into place, so
+    a shard that exists is complete.
+
+    Args:
+        routes: Routes of batch.
+        vids: Vertex IDs of batch.
+        shard_dir: Directory to write shard to.
+
+    Returns:
+        Path of shard.
+    """
+    path = os.path.join(shard_dir, f"shard-{vids[0]}-{len(vids)}.arrow")
+    table = routes.to_table()
+    table = table.replace_schema_metadata({SHARD_VIDS_KEY: json.dumps(np.asarray(vids).tolist())})
+    feather.write_feather(table, f"{path}.tmp", compression="uncompressed")
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def read_shard_vids(path: str) -> np.ndarray:
+    """
+    Args:
+        path: Path of shard written by `write_shard`.
+
+    Returns:
+        Vertex IDs routed in this shard.
+    """
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata
+    return np.array(json.loads(metadata[SHARD_VIDS_KEY]), dtype=np.int64)
+
+
+def list_shards(shard_dir: str) -> list[str]:
+    """
+    Args:
+        shard_dir: Directory of shards written by `write_shard`.
+
+    Returns:
+        Paths of complete shards in directory.
+    """
+    if not os.path.isdir(shard_dir):
+        return []
+    return sorted(
+        os.path.join(shard_dir, filename) for filename in os.listdir(shard_dir) if filename.endswith(".arrow")
+    )
+
+
+def prepare_work_dir(work_dir: str, fingerprint: str) -> np.ndarray:
+    """
+    Create or resume from a routing work directory.
+
+    If the work directory was created for different inputs (graph, OD,
+    routing root or backend), any shards are stale and are removed.
+
+    Args:
+        work_dir: Directory to keep shards of completed routing batches in.
+        fingerprint: Digest of routing inputs.
+
+    Returns:
+        Vertex IDs already routed.
+    """
+    shard_dir = os.path.join(work_dir, "shards")
+    fingerprint_path = os.path.join(work_dir, "fingerprint")
+    os.makedirs(shard_dir, exist_ok=True)
 
-    routes: RouteResult = {}
+    previous_fingerprint = None
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as fp:
+            previous_fingerprint = fp.read().strip()
+    if previous_fingerprint != fingerprint:
+        stale_shards = list_shards(shard_dir)
+        if stale_shards:
+            print(f"Routing inputs changed, removing {len(stale_shards):,d} stale shards from {shard_dir}")
+        for path in stale_shards:
+            os.remove(path)
+        with open(fingerprint_path, "w") as fp:
+            fp.write(fingerprint)
 
-    if routes_edge_list:
-        assert len(routes_edge_list) == len(destination_nodes)
+    done = [read_shard_vids(path) for path in list_shards(shard_dir)]
+    return np.concatenate(done) if done else np.array([], dtype=np.int64)
+
+
+def route_batch(
+    root: str,
+    shard_dir: str | None,
+    vids: np.ndarray
+) -> tuple[int, RouteStore | None, TaskTiming]:
+    """
+    Route flows for a batch of origins or destinations.
+
+    Args:
+        root: 'origin' to route from each of `vids` with `route_from_node`, or
+            'destination' to route to each of `vids` with `route_to_destination`.
+        shard_dir: If given, write routes to a shard file in this directory
+            rather than returning them.
+        vids: Vertex IDs of origins or destinations to route.
+
+    Returns:
+        Number of vertices routed, their routes (or None if written to disk)
+            and the time taken.
+    """
+    start = task_clock()
+    if routing_backend == "scipy":
+        routes = route_many(root, vids)
     else:
-        return routes
-
-    # lookup trade value and volume for each pairing of from_node and partner country
-    for i, destination_node in enumerate(destination_nodes):
-        # "GID_0_GBR" -> "GBR"
-        iso_a3 = destination_node.split("_")[-1]
-        route = from_node_od[
-            (from_node_od.id == from_node) & (from_node_od.partner_GID_0 == iso_a3)
-        ]
-        value_kusd, = route.value_kusd
-        volume_tons, = route.volume_tons
-
-        routes[(from_node, destination_node)] = {
-            "value_kusd": value_kusd,
-            "volume_tons": volume_tons,
-            "edge_indices": routes_edge_list[i]
-        }
+        func = {"origin": route_from_node, "destination": route_to_destination}[root]
+        routes = RouteStore.concat([func(vid) for vid in vids])
+    if shard_dir is not None:
+        write_shard(routes, vids, shard_dir)
+        return len(vids), None, task_timing(start)
+    return len(vids), routes, task_timing(start)
+
+
+def route_scenario_batch(
+    root: str,
+    task: tuple[int | None, str | None, np.ndarray]
+) -> tuple[int | None, int, RouteStore | None, TaskTiming]:
+    """
+    Route flows for a batch of origins or destinations in a given scenario.
+
+    Args:
+        root: 'origin' or 'destination', see `route_batch`.
+        task: Number of scenario (None for intact graph), directory to write
+            a shard of routes to (or None to return them) and vertex IDs of
+            origins or destinations to route.
+
+    Returns:
+        Number of scenario, number of vertices routed, their routes (or None
+            if written to disk) and the time taken.
+    """
+    start = task_clock()
+    scenario, shard_dir, vids = task
+    select_scenario(scenario)
+    n_routed, routes, _ = route_batch(root, shard_dir, vids)
+    return scenario, n_routed, routes, task_timing(start)
+
+
+def make_batches(vids: np.ndarray, n_flows: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    """
+    Pack vertices into batches, each with roughly `batch_size` flows to route.
+
+    Vertices are sorted by their number of flows, largest first, before
+    packing. Batches are returned in the same order, so that the slowest
+    routing tasks are started first and do not hold up the tail of a run.
+
+    Args:
+        vids: Vertex IDs to batch.
+        n_flows: Number of flows to route for each vertex.
+        batch_size: Target number of flows in each batch. Any vertex with
+            more flows than this will be placed in a batch of its own.
+
+    Returns:
+        Batches of vertex IDs.
+    """
+    order = np.argsort(-np.asarray(n_flows), kind="stable")
+    vids = np.asarray(vids)[order]
+    n_flows = np.asarray(n_flows)[order]
+
+    batches = []
+    batch_start = 0
+    batch_flows = 0
+    for i, n in enumerate(n_flows):
+        if batch_flows > 0 and batch_flows + n > batch_size:
+            batches.append(vids[batch_start: i])
+            batch_start = i
+            batch_flows = 0
+        batch_flows += n
+    if batch_start < len(vids):
+        batches.append(vids[batch_start:])
+    return batches
+
+
+def order_as_od(routes: RouteStore, od: pd.DataFrame) -> RouteStore:
+    """
+    Order routes by first appearance of origin in OD, then by order of
+    destinations for that origin.
+
+    Args:
+        routes: Routes labelled by vertex IDs.
+        od: Table of flows with 'origin_vid' and 'destination_vid' columns.
+
+    Returns:
+        Routes reordered.
+
+    Raises:
+        KeyError: If there is no route for some flow of the OD.
+    """
+    origin_order, _ = pd.factorize(od.origin_vid)
+    ordered_od = od.iloc[origin_order.argsort(kind="stable")]
+    route_keys = pd.MultiIndex.from_arrays(
+        [routes.source_node.astype(np.int64), routes.destination_node.astype(np.int64)]
+    )
+    od_keys = pd.MultiIndex.from_arrays(
+        [ordered_od.origin_vid.to_numpy(dtype=np.int64), ordered_od.destination_vid.to_numpy(dtype=np.int64)]
+    )
+    positions = route_keys.get_indexer(od_keys)
+    if (positions == -1).any():
+        missing = od_keys[positions == -1]
+        raise KeyError(f"No route for {len(missing):,d} flows of OD, e.g. (origin_vid, destination_vid) {missing[0]}")
+    return routes.take(positions)
 
-    print(f"Process {os.getpid()} finished routing {from_node}...")
-    return routes
 
+def routable_od(od: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drop flows we cannot route because their nodes are missing from the graph.
+
+    Routing from an origin is all or nothing: if either the origin or any of
+    its destination country nodes are missing from the graph, none of the
+    origin's flows are routed.
+
+    Args:
+        od: Table of flows from origin node 'id' with 'origin_vid' and
+            'destination_vid' columns, the latter set to -1 where a node is
+            missing from the graph.
+
+    Returns:
+        Subset of `od` where origin and all destinations of that origin exist in graph.
+    """
+    in_graph = (od.origin_vid != -1) & (od.destination_vid != -1)
+    routable = in_graph.groupby(od.id).transform("all")
+    return od[routable]
+
+
+def prepare_graph_and_od(
+    od: pd.DataFrame,
+    edges: gpd.GeoDataFrame,
+    vertices: pd.DataFrame | None = None,
+) -> tuple[CSRGraph, np.ndarray, pd.DataFrame]:
+    """
+    Build graph from edges and find the vertices of each OD flow.
+
+    Args:
+        od: Table of flows from origin node 'id' to destination country
+            'partner_GID_0', should also contain 'value_kusd' and 'volume_tons'.
+        edges: Table of edges to construct graph from. First column should be
+            source node id and second destination node id. Should also contain
+            'cost_USD_t' column.
+        vertices: Table of vertices with 'vid' and 'id' columns. If given and
+            `edges` has 'from_vid' and 'to_vid' columns, the graph is built
+            from these integer ids. See `trade_flow.graph.edge_vertex_ids`.
+
+    Returns:
+        Graph, node id of each vertex and routable subset of OD with
+            'origin_vid' and 'destination_vid' columns.
+    """
+    print("Creating graph...")
+    # cannot add vertices as edges reference port493_out, port281_in, etc. which are missing from nodes file
+    # instead, number vertices in order of appearance in edges (unless already numbered)
+    edge_source, edge_target, vertex_names = edge_vertex_ids(edges, vertices)
+    graph = CSRGraph.from_arrays(edge_source, edge_target, edges.cost_USD_t, len(vertex_names))
 
-def route_from_all_nodes(od: pd.DataFrame, edges: gpd.GeoDataFrame, n_cpu: int) -> RouteResult:
+    # resolve node names to vertex ids once, here
+    # vertices without any edges (e.g. all removed) are treated as missing from graph
+    vertex_index = pd.Index(vertex_names)
+    has_edges = np.bincount(edge_source, minlength=len(vertex_names)) \
+        + np.bincount(edge_target, minlength=len(vertex_names)) > 0
+
+    def lookup(names: pd.Series) -> np.ndarray:
+        vids = vertex_index.get_indexer(names)
+        return np.where((vids != -1) & has_edges[vids], vids, -1)
+
+    od = od.assign(
+        origin_vid=lookup("road_" + od.id.astype(str)),
+        destination_vid=lookup("GID_0_" + od.partner_GID_0.astype(str)),
+    )
+    n_flows = len(od)
+    od = routable_od(od)
+    if len(od) != n_flows:
+        print(f"Dropped {n_flows - len(od):,d} flows with nodes missing from graph")
+
+    return graph, vertex_names, od
+
+
+def label_routes(routes: RouteStore, od: pd.DataFrame, vertex_names: np.ndarray) -> RouteStore:
+    """
+    Relabel routes from vertex IDs to OD origin ids and destination node ids.
+
+    Args:
+        routes: Routes labelled by vertex IDs.
+        od: Table of flows with 'id' and 'origin_vid' columns.
+        vertex_names: Node id of each vertex.
+
+    Returns:
+        Relabelled routes.
+    """
+    origin_ids = pd.Series(od.id.to_numpy(), index=od.origin_vid.to_numpy())
+    origin_ids = origin_ids[~origin_ids.index.duplicated()]
+    return dataclasses.replace(
+        routes,
+        source_labels=origin_ids.loc[routes.source_labels.astype(np.int64)].to_numpy(dtype=object),
+        destination_labels=vertex_names[routes.destination_labels.astype(np.int64)],
+    )
+
+
+def routes_using_edges(routes: RouteStore, edge_mask: np.ndarray) -> np.ndarray:
+    """
+    Find routes traversing any of a set of edges.
+
+    Args:
+        routes: Routes to check.
+        edge_mask: Boolean array, one element per edge of network, True for
+            edges of interest.
+
+    Returns:
+        Boolean array, one element per route, True where route uses any
+            masked edge.
+    """
+    route_ids = np.repeat(np.arange(len(routes)), routes.route_lengths)
+    n_masked = np.bincount(
+        route_ids,
+        weights=edge_mask[routes.edge_indices[routes.offsets[0]: routes.offsets[-1]]],
+        minlength=len(routes)
+    )
+    return n_masked > 0
+
+
+def route_from_all_nodes(
+    od: pd.DataFrame,
+    edges: gpd.GeoDataFrame,
+    n_cpu: int,
+    root: str = "origin",
+    batch_size: int = 1_000,
+    work_dir: str | None = None,
+    vertices: pd.DataFrame | None = None,
+    backend: str = "igraph",
+) -> RouteStore:
     """
     Route flows from origins to destinations across graph.
 
@@ -122,101 +731,528 @@ def route_from_all_nodes(od: pd.DataFrame, edges: gpd.GeoDataFrame, n_cpu: int)
         od: Table of flows from origin node 'id' to destination country
             'partner_GID_0', should also contain 'value_kusd' and 'volume_tons'.
         edges: Table of edges to construct graph from. First column should be
-            source node id and second destination node id.
+            source node id and second destination node id. Should also contain
+            'cost_USD_t' column.
         n_cpu: Number of CPUs to use for routing.
+        root: Where to root shortest path trees. If 'origin', run one shortest
+            path search per origin node. If 'destination', run one search per
+            destination country over the reversed graph, reading the route for
+            every origin from that tree. The latter is much faster when there
+            are many more origins than destinations. Both give the same routes
+            (except where there are multiple least cost routes).
+        batch_size: Target number of flows to route in each task sent to a
+            worker. Origins (or destinations) are packed into batches of
+            roughly this many flows, and the largest batches are routed first.
+        work_dir: If given, write the routes of each batch to a shard file in
+            this directory as it completes. If routing is interrupted, calling
+            again with the same inputs and `work_dir` will skip the origins (or
+            destinations) already routed. Shards are not removed on
+            completion, the caller may do so once the routes are safely stored.
+        vertices: Table of vertices with 'vid' and 'id' columns, as written by
+            network creation. If given, and `edges` has 'from_vid' and 'to_vid'
+            columns, build graph from these integer vertex ids rather than
+            interning node id strings.
+        backend: Shortest path implementation. If 'igraph', search from one
+            origin (or destination) at a time with igraph. If 'scipy', search
+            from many per call with scipy.sparse.csgraph.dijkstra over a sparse
+            matrix, reading routes from the predecessors of each tree. Where
+            several edges join the same pair of nodes, the matrix keeps only
+            the least cost edge. Both give routes of the same cost, but may
+            pick different routes where there are ties. Each igraph worker
+            holds a private copy of the graph (~45 bytes per edge, e.g.
+            ~180MB for 4M edges), so memory grows with `n_cpu`. scipy
+            workers route over the memory-mapped arrays, shared between
+            workers, and hold only the trees of their current search.
 
     Returns:
-        Mapping from source node, to destination country node, to flow in value
-            and volume along this route and list of edge indices constituting
+        Routes from source node to destination country node, with flow in
+            value and volume along each route and the edge indices constituting
             the route.
     """
+    if root not in {"origin", "destination"}:
+        raise ValueError(f"{root=} not recognised, must be 'origin' or 'destination'")
+    if backend not in {"igraph", "scipy"}:
+        raise ValueError(f"{backend=} not recognised, must be 'igraph' or 'scipy'")
 
-    print("Creating graph...")
-    # cannot add vertices as edges reference port493_out, port281_in, etc. which are missing from nodes file
-    # use_vids=False as edges.from_id and edges_to_id are not integers
-    graph = ig.Graph.DataFrame(edges, directed=True, use_vids=False)
+    with stage("route_from_all_nodes.prepare"):
+        graph, vertex_names, od = prepare_graph_and_od(od, edges, vertices)
+
+        # publish graph and OD as arrays to disk once, rather than pickling to each worker
+        # workers will memory-map these, sharing the pages between them
+        temp_dir = tempfile.TemporaryDirectory()
+
+        print("Writing graph to disk...")
+        graph_dir = os.path.join(temp_dir.name, "graph")
+        if backend == "igraph":
+            publish_arrays(graph, graph_dir)
+        else:
+            # trees rooted at destinations are grown over the reversed graph
+            publish_arrays(AdjacencyMatrix.from_graph(graph, reverse=root == "destination"), graph_dir)
 
-    temp_dir = tempfile.TemporaryDirectory()
+        print("Writing OD to disk...")
+        od_dir = os.path.join(temp_dir.name, "od")
+        od_key = {"origin": "origin_vid", "destination": "destination_vid"}[root]
+        od_index = ODIndex.from_od(od, od_key)
+        publish_arrays(od_index, od_dir)
 
-    print("Writing graph to disk...")
-    graph_filepath = os.path.join(temp_dir.name, "graph.pickle")
-    graph.write_pickle(graph_filepath)
+    n_flows_by_vid = od[od_key].value_counts(sort=False)
+    if work_dir is not None:
+        shard_dir = os.path.join(work_dir, "shards")
+        routed_vids = prepare_work_dir(
+            work_dir,
+            fingerprint_arrays(
+                graph.edge_source,
+                graph.edge_target,
+                graph.weight,
+                od_index.origin_vid,
+                od_index.destination_vid,
+                od_index.value_kusd,
+                od_index.volume_tons,
+                np.frombuffer(f"{root}/{backend}".encode(), dtype=np.uint8),
+            )
+        )
+        if len(routed_vids) > 0:
+            print(f"Resuming, {len(routed_vids):,d} of {len(n_flows_by_vid):,d} {root}s already routed")
+    else:
+        shard_dir = None
+        routed_vids = np.array([], dtype=np.int64)
+    to_route = n_flows_by_vid[~n_flows_by_vid.index.isin(routed_vids)]
 
-    print("Writing OD to disk...")
-    od_filepath = os.path.join(temp_dir.name, "od.pq")
-    od.to_parquet(od_filepath)
+    # size batches by number of flows to route, and route the largest first
+    batches = make_batches(to_route.index.to_numpy(), to_route.to_numpy(), batch_size)
+    print(f"Routing {to_route.sum():,d} flows in {len(batches):,d} batches...")
 
-    print("Routing...")
     start = time.time()
-    from_nodes = od.id.unique()
-    args = ((from_node,) for from_node in from_nodes)
-    # as each process is created, it will load the graph and od from disk in
+    routes: list[RouteStore] = []
+    # as each process is created, it will attach to the graph and od on disk in
     # init_worker and then persist these in memory as globals between chunks
-    with multiprocessing.Pool(
+    with stage("route_from_all_nodes.routing"), multiprocessing.Pool(
         processes=n_cpu,
         initializer=init_worker,
-        initargs=(graph_filepath, od_filepath),
+        initargs=(graph_dir, od_dir, backend),
     ) as pool:
-        routes: list[RouteResult] = pool.starmap(route_from_node, args)
+        with tqdm(total=len(n_flows_by_vid), initial=len(n_flows_by_vid) - len(to_route), unit=root) as progress:
+            for n_routed, batch_routes, timing in pool.imap_unordered(
+                partial(route_batch, root, shard_dir),
+                batches
+            ):
+                if batch_routes is not None:
+                    routes.append(batch_routes)
+                progress.update(n_routed)
+                record_task("route_from_all_nodes.routing", n_routed, timing)
 
-    print("\n")
     print(f"Routing completed in {time.time() - start:.2f}s")
 
     temp_dir.cleanup()
 
-    # flatten our list of RouteResult dicts into one dict
-    return {k: v for item in routes for (k, v) in item.items()}
+    with stage("route_from_all_nodes.collect"):
+        if shard_dir is not None:
+            print("Merging route shards...")
+            routes = [RouteStore.read_feather(path) for path in list_shards(shard_dir)]
 
+        # combine routes from each batch into one store, batches complete in any
+        # order, so sort by OD
+        all_routes = order_as_od(RouteStore.concat(routes), od)
 
-def lookup_route_costs(
-    routes_path: str,
-    edges_path: str,
-    destination_link_cost_USD_t: float = DESTINATION_LINK_COST_USD_T
-) -> pd.DataFrame:
+        # relabel routes from vertex ids to OD origin ids and destination node ids
+        return label_routes(all_routes, od, vertex_names)
+
+
+def route_scenarios(
+    od: pd.DataFrame,
+    edges: gpd.GeoDataFrame,
+    edge_masks: dict[str, np.ndarray],
+    n_cpu: int,
+    root: str = "origin",
+    batch_size: int = 1_000,
+    work_dir: str | None = None,
+    vertices: pd.DataFrame | None = None,
+    backend: str = "igraph",
+) -> tuple[RouteStore, dict[str, RouteStore]]:
     """
-    For each route (source -> destination pair), lookup the edges
-    of the least cost route (the route taken) and sum those costs.
-    Store alongside value and volume of route.
+    Route flows across an intact network and many degraded versions of it
+    (e.g. a hazard at several return periods), building the graph only once.
+
+    Each scenario removes a set of edges from the graph. With igraph, by
+    giving them infinite weight. With scipy, a matrix without them is built
+    from the graph's arrays for each scenario. Only flows whose intact route
+    used a removed edge are routed again in that scenario, the other intact
+    routes are reused.
+
+    Unlike routing over a network with the edges deleted, flows which cannot
+    reach their destination in a scenario are kept, with an empty route.
 
     Args:
-        routes_path: Path to routes table, should have multi-index: (source node,
-            destination node) and include value_kusd, volume_tons and edge_indices
-            columns
-        edges_path: Path to edges table, should have cost_USD_t column which we
-            will positional index into with edge_indices from the routes table.
-        destination_link_cost_USD_t: Cost of traversing 'destination' links, to
-            partner entities. There should only be one of these links in any given
-            route.
-
-    Returns:
-        Routes appended with their total cost in USD t-1
-    """
-    routes_with_edge_indices: pd.DataFrame = pd.read_parquet(routes_path)
-    edges: gpd.GeoDataFrame = gpd.read_parquet(edges_path)
-    cost_col_id = edges.columns.get_loc("cost_USD_t")
-    routes = []
-    for index, route_data in tqdm(routes_with_edge_indices.iterrows(), total=len(routes_with_edge_indices)):
-        source_node, destination_node = index
-        cost_including_destination_link_USD_t = edges.iloc[route_data.edge_indices, cost_col_id].sum()
-
-        cost_USD_t: float = cost_including_destination_link_USD_t % destination_link_cost_USD_t
-
-        if int(cost_including_destination_link_USD_t // destination_link_cost_USD_t) != 1:
-            # must have exactly 1 destination link, otherwise not a valid route
-            continue
-
-        if cost_USD_t != 0:
-            routes.append(
-                (
-                    source_node,
-                    destination_node.split("_")[-1],
-                    route_data.value_kusd,
-                    route_data.volume_tons,
-                    cost_USD_t
+        od: Table of flows from origin node 'id' to destination country
+            'partner_GID_0', should also contain 'value_kusd' and 'volume_tons'.
+        edges: Table of edges to construct graph from. See `route_from_all_nodes`.
+        edge_masks: Mapping from scenario name to boolean array, one element
+            per edge, True where edge is removed in that scenario.
+        n_cpu: Number of CPUs to use for routing.
+        root: Where to root shortest path trees. See `route_from_all_nodes`.
+        batch_size: Target number of flows to route in each task sent to a
+            worker. See `route_from_all_nodes`.
+        work_dir: If given, write the routes of each batch to a shard file in
+            an 'intact' subdirectory of this directory, or one named for the
+            scenario, as it completes. Calling again with the same inputs and
+            `work_dir` will skip the batches already routed. See
+            `route_from_all_nodes`.
+        vertices: Table of vertices with 'vid' and 'id' columns. See
+            `route_from_all_nodes`.
+        backend: Shortest path implementation. See `route_from_all_nodes`.
+
+    Returns:
+        Routes across intact network and routes for each scenario, all in the
+            same order. Edge indices are positions in `edges`.
+    """
+    if root not in {"origin", "destination"}:
+        raise ValueError(f"{root=} not recognised, must be 'origin' or 'destination'")
+    if backend not in {"igraph", "scipy"}:
+        raise ValueError(f"{backend=} not recognised, must be 'igraph' or 'scipy'")
+    scenario_names = list(edge_masks.keys())
+    for name in scenario_names:
+        if len(edge_masks[name]) != len(edges):
+            raise ValueError(f"Edge mask for {name} has {len(edge_masks[name])} elements, expected {len(edges)}")
+
+    with stage("route_scenarios.prepare"):
+        graph, vertex_names, od = prepare_graph_and_od(od, edges, vertices)
+        od_key = {"origin": "origin_vid", "destination": "destination_vid"}[root]
+
+        temp_dir = tempfile.TemporaryDirectory()
+        print("Writing graph and scenarios to disk...")
+        graph_root = os.path.join(temp_dir.name, "graph")
+        if backend == "igraph":
+            publish_arrays(graph, os.path.join(graph_root, "intact"))
+        else:
+            # trees rooted at destinations are grown over the reversed graph
+            reverse = root == "destination"
+            publish_arrays(AdjacencyMatrix.from_graph(graph, reverse), os.path.join(graph_root, "intact"))
+            for i, name in enumerate(scenario_names):
+                publish_arrays(
+                    AdjacencyMatrix.from_graph(graph, reverse, np.asarray(edge_masks[name], dtype=bool)),
+                    os.path.join(graph_root, str(i))
+                )
+        edge_masks_path = os.path.join(temp_dir.name, "edge_masks.npy")
+        np.save(
+            edge_masks_path,
+            np.stack([np.asarray(edge_masks[name], dtype=bool) for name in scenario_names])
+            if scenario_names else np.zeros((0, len(edges)), dtype=bool)
+        )
+        od_root = os.path.join(temp_dir.name, "od")
+        publish_arrays(ODIndex.from_od(od, od_key), os.path.join(od_root, "intact"))
+
+    def tasks(
+        scenario: int | None,
+        scenario_od: pd.DataFrame,
+        name: str,
+        edge_mask: np.ndarray,
+    ) -> tuple[str | None, list[tuple[int | None, str | None, np.ndarray]]]:
+        """
+        Batch the flows of a scenario, skipping any already in `work_dir`.
+        Returns the directory shards will be written to and the tasks.
+        """
+        n_flows_by_vid = scenario_od[od_key].value_counts(sort=False)
+        shard_dir = None
+        if work_dir is not None:
+            scenario_work_dir = os.path.join(work_dir, name)
+            shard_dir = os.path.join(scenario_work_dir, "shards")
+            routed_vids = prepare_work_dir(
+                scenario_work_dir,
+                fingerprint_arrays(
+                    graph.edge_source,
+                    graph.edge_target,
+                    graph.weight,
+                    edge_mask,
+                    scenario_od.origin_vid.to_numpy(dtype=np.int32),
+                    scenario_od.destination_vid.to_numpy(dtype=np.int32),
+                    scenario_od.value_kusd.to_numpy(dtype=np.float64),
+                    scenario_od.volume_tons.to_numpy(dtype=np.float64),
+                    np.frombuffer(f"{root}/{backend}".encode(), dtype=np.uint8),
                 )
             )
+            if len(routed_vids) > 0:
+                print(f"{name}: resuming, {len(routed_vids):,d} of {len(n_flows_by_vid):,d} {root}s already routed")
+            n_flows_by_vid = n_flows_by_vid[~n_flows_by_vid.index.isin(routed_vids)]
+        batches = make_batches(n_flows_by_vid.index.to_numpy(), n_flows_by_vid.to_numpy(), batch_size)
+        return shard_dir, [(scenario, shard_dir, batch) for batch in batches]
+
+    def collect(shard_dir: str | None, routes: list[RouteStore]) -> RouteStore:
+        if shard_dir is not None:
+            routes = [RouteStore.read_feather(path) for path in list_shards(shard_dir)]
+        return RouteStore.concat(routes)
 
+    start = time.time()
+    with multiprocessing.Pool(
+        processes=n_cpu,
+        initializer=init_scenario_worker,
+        initargs=(graph_root, od_root, edge_masks_path, backend),
+    ) as pool:
+
+        print(f"Routing {len(od):,d} flows across intact network...")
+        intact_shard_dir, intact_tasks = tasks(None, od, "intact", np.zeros(len(edges), dtype=bool))
+        intact_routes: list[RouteStore] = []
+        with stage("route_scenarios.route_intact"):
+            for _, n_routed, batch_routes, timing in tqdm(
+                pool.imap_unordered(partial(route_scenario_batch, root), intact_tasks),
+                total=len(intact_tasks)
+            ):
+                if batch_routes is not None:
+                    intact_routes.append(batch_routes)
+                record_task("route_scenarios.route_intact", n_routed, timing)
+            intact = order_as_od(collect(intact_shard_dir, intact_routes), od)
+
+        # find the flows each scenario disrupts, and publish an OD of them
+        disrupted: dict[int, np.ndarray] = {}
+        scenario_shard_dirs: dict[int, str | None] = {}
+        scenario_tasks: list[tuple[int, str | None, np.ndarray]] = []
+        for i, name in enumerate(scenario_names):
+            edge_mask = np.asarray(edge_masks[name], dtype=bool)
+            disrupted[i] = routes_using_edges(intact, edge_mask)
+            disrupted_routes = intact.take(np.flatnonzero(disrupted[i]))
+            disrupted_od = pd.DataFrame(
+                {
+                    "origin_vid": disrupted_routes.source_node.astype(np.int32),
+                    "destination_vid": disrupted_routes.destination_node.astype(np.int32),
+                    "value_kusd": disrupted_routes.value_kusd,
+                    "volume_tons": disrupted_routes.volume_tons,
+                }
+            )
+            print(f"{name}: {disrupted[i].sum():,d} of {len(intact):,d} routes disrupted")
+            publish_arrays(ODIndex.from_od(disrupted_od, od_key), os.path.join(od_root, str(i)))
+            scenario_shard_dirs[i], batches = tasks(i, disrupted_od, name, edge_mask)
+            scenario_tasks.extend(batches)
+
+        print(f"Rerouting disrupted flows of {len(scenario_names):,d} scenarios...")
+        rerouted: dict[int, list[RouteStore]] = {i: [] for i in range(len(scenario_names))}
+        # tasks are ordered by scenario, so each worker switches scenario rarely
+        with stage("route_scenarios.reroute"):
+            for i, n_routed, batch_routes, timing in tqdm(
+                pool.imap_unordered(partial(route_scenario_batch, root), scenario_tasks),
+                total=len(scenario_tasks)
+            ):
+                if batch_routes is not None:
+                    rerouted[i].append(batch_routes)
+                record_task("route_scenarios.reroute", n_routed, timing)
+
+    print(f"Routing completed in {time.time() - start:.2f}s")
+    temp_dir.cleanup()
+
+    with stage("route_scenarios.collect"):
+        scenario_routes: dict[str, RouteStore] = {}
+        for i, name in enumerate(scenario_names):
+            routes = RouteStore.concat(
+                [intact.take(np.flatnonzero(~disrupted[i])), collect(scenario_shard_dirs[i], rerouted[i])]
+            )
+            scenario_routes[name] = label_routes(order_as_od(routes, od), od, vertex_names)
+
+        return label_routes(intact, od, vertex_names), scenario_routes
+
+
+def degraded_edge_map(degraded_edges: pd.DataFrame, n_intact_edges: int) -> np.ndarray:
+    """
+    Map edge indices of an intact network to those of a degraded network.
+
+    The degraded network's edges should be a subset of the intact network's
+    edges, indexed by their position in the intact network (as output by
+    `filter_edges_by_raster` or the rules that join its results).
+
+    Args:
+        degraded_edges: Edges of degraded network.
+        n_intact_edges: Number of edges in intact network.
+
+    Returns:
+        Position in `degraded_edges` of each intact edge, -1 where the edge
+            has been removed.
+    """
+    edge_map = np.full(n_intact_edges, -1, dtype=np.int64)
+    edge_map[degraded_edges.index.to_numpy()] = np.arange(len(degraded_edges))
+    return edge_map
+
+
+def masked_edge_map(edge_mask: np.ndarray) -> np.ndarray:
+    """
+    Map edge indices of an intact network to those of the degraded network
+    left after removing the masked edges, as `degraded_edge_map` but without
+    relying on the degraded edges' index.
+
+    Args:
+        edge_mask: Boolean array, one element per intact edge, True where the
+            edge is removed.
+
+    Returns:
+        Position in the degraded network of each intact edge, -1 where the
+            edge has been removed.
+    """
+    edge_mask = np.asarray(edge_mask, dtype=bool)
+    return np.where(edge_mask, -1, np.cumsum(~edge_mask) - 1)
+
+
+def reroute_disrupted_flows(
+    intact_routes: RouteStore,
+    degraded_edges: gpd.GeoDataFrame,
+    edge_map: np.ndarray,
+    n_cpu: int,
+    **kwargs,
+) -> RouteStore:
+    """
+    Allocate flows across a degraded network, rerouting only those flows whose
+    intact route used a removed edge.
+
+    Removing edges cannot make any route cheaper, so an intact route that
+    survives is still a least cost route over the degraded network. Those
+    routes are reused (with their edge indices mapped to the degraded
+    network) and the rest are routed again.
+
+    Args:
+        intact_routes: Routes across intact network.
+        degraded_edges: Table of edges of degraded network to construct graph
+            from. See `route_from_all_nodes`.
+        edge_map: Position in `degraded_edges` of each intact edge, -1 where
+            the edge has been removed. See `degraded_edge_map`.
+        n_cpu: Number of CPUs to use for routing.
+        **kwargs: Passed to `route_from_all_nodes` to reroute disrupted flows.
+
+    Returns:
+        Routes across degraded network, in the same order as `intact_routes`.
+    """
+    with stage("reroute_disrupted_flows.find_disrupted"):
+        # find routes with any edge removed
+        disrupted = routes_using_edges(intact_routes, edge_map == -1)
+        print(f"{disrupted.sum():,d} of {len(intact_routes):,d} routes disrupted")
+
+        undisrupted_routes = intact_routes.take(np.flatnonzero(~disrupted))
+        undisrupted_routes = dataclasses.replace(
+            undisrupted_routes,
+            edge_indices=edge_map[undisrupted_routes.edge_indices].astype(np.int32)
+        )
+
+        # the OD of the disrupted routes
+        disrupted_routes = intact_routes.take(np.flatnonzero(disrupted))
+        disrupted_od = pd.DataFrame(
+            {
+                "id": disrupted_routes.source_node,
+                # "GID_0_GBR" -> "GBR"
+                "partner_GID_0": [node.split("_")[-1] for node in disrupted_routes.destination_node],
+                "value_kusd": disrupted_routes.value_kusd,
+                "volume_tons": disrupted_routes.volume_tons,
+            }
+        )
+    rerouted_routes = route_from_all_nodes(disrupted_od, degraded_edges, n_cpu, **kwargs)
+
+    # restore order of intact routes
+    routes = RouteStore.concat([undisrupted_routes, rerouted_routes])
+    intact_keys = pd.MultiIndex.from_arrays([intact_routes.source_node, intact_routes.destination_node])
+    route_keys = pd.MultiIndex.from_arrays([routes.source_node, routes.destination_node])
+    return routes.take(np.argsort(intact_keys.get_indexer(route_keys), kind="stable"))
+
+
+def accumulate_edge_flows(
+    route_offsets: np.ndarray,
+    edge_indices: np.ndarray,
+    value_kusd: np.ndarray,
+    volume_tons: np.ndarray,
+    n_edges: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the value and volume of every route over the edges it traverses.
+
+    Routes are given in compressed form: the edges of route i are
+    `edge_indices[route_offsets[i]: route_offsets[i + 1]]`. Partial results
+    (e.g. from different batches of routes) may be summed.
+
+    Args:
+        route_offsets: Offsets into `edge_indices` for each route, length of
+            number of routes + 1.
+        edge_indices: Concatenated edge indices of all routes.
+        value_kusd: Value of flow along each route.
+        volume_tons: Volume of flow along each route.
+        n_edges: Number of edges in network.
+
+    Returns:
+        Value and volume flowing over each edge of the network.
+    """
+    route_lengths = np.diff(route_offsets)
+    edge_value_kusd = np.bincount(
+        edge_indices,
+        weights=np.repeat(value_kusd, route_lengths),
+        minlength=n_edges
+    )
+    edge_volume_tons = np.bincount(
+        edge_indices,
+        weights=np.repeat(volume_tons, route_lengths),
+        minlength=n_edges
+    )
+    return edge_value_kusd, edge_volume_tons
+
+
+def route_costs(
+    routes: RouteStore,
+    edge_costs_USD_t: np.ndarray,
+    destination_links: np.ndarray,
+) -> pd.DataFrame:
+    """
+    Sum the cost of the edges of every route in one pass over the routes' edge
+    indices, separating out the 'destination' links to partner entities.
+
+    Args:
+        routes: Routes with edge indices which are positions in `edge_costs_USD_t`.
+        edge_costs_USD_t: Cost of traversing each edge.
+        destination_links: Boolean array, one element per edge, True for
+            'destination' links (edges of mode 'imaginary').
+
+    Returns:
+        Table with a row per route, with source_node, destination_node,
+            value_kusd, volume_tons, cost_USD_t (excluding destination links)
+            and n_destination_links columns.
+    """
+    edge_indices = routes.edge_indices[routes.offsets[0]: routes.offsets[-1]]
+    route_ids = np.repeat(np.arange(len(routes)), routes.route_lengths)
+    is_destination_link = np.asarray(destination_links, dtype=bool)[edge_indices]
     return pd.DataFrame(
-        routes,
-        columns=["source_node", "destination_node", "value_kusd", "volume_tons", "cost_USD_t"]
+        {
+            "source_node": routes.source_node,
+            "destination_node": routes.destination_node,
+            "value_kusd": routes.value_kusd,
+            "volume_tons": routes.volume_tons,
+            "cost_USD_t": np.bincount(
+                route_ids[~is_destination_link],
+                weights=edge_costs_USD_t[edge_indices[~is_destination_link]],
+                minlength=len(routes)
+            ),
+            "n_destination_links": np.bincount(route_ids[is_destination_link], minlength=len(routes)),
+        }
     )
+
+
+def lookup_route_costs(routes_path: str, edges_path: str) -> pd.DataFrame:
+    """
+    For each route (source -> destination pair), lookup the edges
+    of the least cost route (the route taken) and sum those costs.
+    Store alongside value and volume of route.
+
+    Routes without exactly one destination link, or of zero cost, are dropped.
+
+    Args:
+        routes_path: Path to routes table, as written by `RouteStore.to_parquet`,
+            with source_node, destination_node, value_kusd, volume_tons and
+            edge_indices columns
+        edges_path: Path to edges table, should have cost_USD_t and mode
+            columns which we will positional index into with edge_indices from
+            the routes table. Edges of mode 'imaginary' are 'destination'
+            links, to partner entities. There should only be one of these
+            links in any given route.
+
+    Returns:
+        Routes appended with their total cost in USD t-1 (excluding the
+            destination link) and their number of destination links
+    """
+    routes = RouteStore.read_parquet(routes_path)
+    edges = pd.read_parquet(edges_path, columns=["cost_USD_t", "mode"])
+    costs = route_costs(routes, edges.cost_USD_t.to_numpy(), (edges["mode"] == "imaginary").to_numpy())
+
+    # must have exactly 1 destination link, otherwise not a valid route
+    costs = costs[(costs.n_destination_links == 1) & (costs.cost_USD_t != 0)].copy()
+    # "GID_0_GBR" -> "GBR"
+    costs["destination_node"] = costs.destination_node.str.split("_").str[-1]
+
+    return costs.reset_index(drop=True)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade_flow.routing import DESTINATION_LINK_COST_USD_T
+
+
+def grid_network(n: int, costs: np.ndarray) -> pd.DataFrame:
+    """
+    Road network on an n x n grid, with edges in both directions between
+    neighbouring nodes. Nodes in the first column are linked to destination
+    country AAA, and those in the last column to BBB.
+
+    Args:
+        n: Number of nodes along each side of grid.
+        costs: Cost of each road edge, in the order the edges are created.
+
+    Returns:
+        Table of edges with from_id, to_id, mode and cost_USD_t columns.
+    """
+    rows = []
+    for i in range(n):
+        for j in range(n):
+            node = i * n + j
+            if j + 1 < n:
+                rows.extend([(f"road_{node}", f"road_{node + 1}"), (f"road_{node + 1}", f"road_{node}")])
+            if i + 1 < n:
+                rows.extend([(f"road_{node}", f"road_{node + n}"), (f"road_{node + n}", f"road_{node}")])
+    edges = pd.DataFrame(rows, columns=["from_id", "to_id"])
+    edges["mode"] = "road"
+    edges["cost_USD_t"] = costs[: len(edges)]
+
+    destination_links = pd.DataFrame(
+        [(f"road_{i * n}", "GID_0_AAA") for i in range(n)]
+        + [(f"road_{i * n + n - 1}", "GID_0_BBB") for i in range(n)],
+        columns=["from_id", "to_id"]
+    )
+    destination_links["mode"] = "imaginary"
+    destination_links["cost_USD_t"] = DESTINATION_LINK_COST_USD_T
+    return pd.concat([edges, destination_links]).reset_index(drop=True)
+
+
+def grid_od(n: int) -> pd.DataFrame:
+    """
+    Flows from every node of an n x n grid to both destination countries.
+    """
+    od = pd.DataFrame(
+        {
+            "id": np.repeat(np.arange(n * n), 2),
+            "partner_GID_0": np.tile(["AAA", "BBB"], n * n),
+        }
+    )
+    od["value_kusd"] = np.arange(len(od), dtype=float) + 1
+    od["volume_tons"] = 2 * od["value_kusd"]
+    return od
+
+
+@pytest.fixture
+def tied_network() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Grid where every road edge costs the same, so most flows have several
+    least cost routes.
+    """
+    n = 5
+    return grid_network(n, np.ones(4 * n * n)), grid_od(n)
+
+
+@pytest.fixture
+def untied_network() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Grid with random edge costs, so every flow has a single least cost route.
+    """
+    n = 5
+    rng = np.random.default_rng(0)
+    return grid_network(n, rng.uniform(1, 10, 4 * n * n)), grid_od(n)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade_flow.criticality import edge_criticality
+from trade_flow.routing import route_costs, route_from_all_nodes
+
+from conftest import grid_od
+
+
+@pytest.fixture
+def spur_network(untied_network) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Grid with random edge costs, and a spur to a node reachable only by one
+    edge in each direction, so removing either leaves its flows unroutable.
+    Also an edge which no least cost route uses.
+    """
+    edges, _ = untied_network
+    n = 5
+    spur = pd.DataFrame(
+        {
+            "from_id": ["road_25", "road_0", "road_6"],
+            "to_id": ["road_0", "road_25", "road_0"],
+            "mode": "road",
+            "cost_USD_t": [1.0, 1.0, 1E3],
+        }
+    )
+    od = grid_od(n + 1)
+    od = od[od.id <= n * n].reset_index(drop=True)
+    return pd.concat([edges, spur]).reset_index(drop=True), od
+
+
+def costs_of(routes, edges: pd.DataFrame) -> pd.DataFrame:
+    return route_costs(routes, edges.cost_USD_t.to_numpy(), (edges["mode"] == "imaginary").to_numpy())
+
+
+@pytest.mark.parametrize("root", ["origin", "destination"])
+def test_edge_criticality_matches_routing_without_edge(spur_network, root):
+    edges, od = spur_network
+    routes = route_from_all_nodes(od, edges, 2, batch_size=10)
+    intact = costs_of(routes, edges)
+
+    criticality = edge_criticality(routes, edges, 2, root=root, batch_size=10)
+
+    # only road and rail edges carrying flow are removed
+    used = np.bincount(routes.edge_indices, minlength=len(edges)) > 0
+    carrying_flow = edges.index[used & (edges["mode"] == "road").to_numpy()]
+    assert set(criticality.index) == set(carrying_flow)
+    unused = edges.index[(edges.from_id == "road_6") & (edges.to_id == "road_0")]
+    assert not criticality.index.isin(unused).any()
+
+    spur_edge, = edges.index[(edges.from_id == "road_25") & (edges.to_id == "road_0")]
+    busiest = criticality.sort_values("routes").index[-3:]
+    for edge in [spur_edge, *busiest]:
+        degraded_edges = edges.drop(index=edge)
+        degraded = costs_of(route_from_all_nodes(od, degraded_edges, 2, batch_size=10), degraded_edges)
+        routable = (degraded.n_destination_links == 1).to_numpy()
+        rerouted = (degraded.cost_USD_t != intact.cost_USD_t).to_numpy() & routable
+
+        expected_delta_cost_USD = ((degraded.cost_USD_t - intact.cost_USD_t) * od.volume_tons)[routable].sum()
+        np.testing.assert_allclose(criticality.loc[edge, "delta_cost_USD"], expected_delta_cost_USD)
+        assert criticality.loc[edge, "unroutable_flows"] == (~routable).sum()
+        np.testing.assert_allclose(criticality.loc[edge, "unroutable_value_kusd"], od.value_kusd[~routable].sum())
+        np.testing.assert_allclose(criticality.loc[edge, "unroutable_volume_tons"], od.volume_tons[~routable].sum())
+        assert criticality.loc[edge, "routes"] >= rerouted.sum() + (~routable).sum()
+
+    # removing the spur leaves the flows from its node unroutable
+    assert criticality.loc[spur_edge, "unroutable_flows"] == (od.id == 25).sum()
+    assert criticality.loc[spur_edge, "delta_cost_USD"] == 0
@@ -0,0 +1,179 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString
+
+rasterio = pytest.importorskip("rasterio")
+pytest.importorskip("snail.intersection")
+
+import snail.intersection
+from rasterio.transform import from_origin
+
+from trade_flow.disruption import (
+    edge_exposure, failed_edge_mask, filter_edges_by_raster, read_raster_values, split_edges_by_grid,
+    tiled_edge_exposure
+)
+
+NODATA = -9999
+
+
+def write_raster(path: str, data: np.ndarray) -> str:
+    """
+    Write a single band raster of unit pixels, with its top left corner at
+    (0, data.shape[0]).
+    """
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=data.shape[0],
+        width=data.shape[1],
+        count=1,
+        dtype=data.dtype,
+        crs="EPSG:4326",
+        transform=from_origin(0, data.shape[0], 1, 1),
+        nodata=NODATA,
+    ) as dataset:
+        dataset.write(data, 1)
+    return path
+
+
+@pytest.fixture
+def raster_path(tmp_path) -> str:
+    """
+    4 x 4 raster of unit pixels covering x and y from 0 to 4, with one nodata
+    pixel in the top row.
+    """
+    data = np.array(
+        [
+            [0, 1, 2, NODATA],
+            [0, 0, 0, 0],
+            [3, 0, 0, 0],
+            [0, 0, 0, 0],
+        ],
+        dtype=np.float32,
+    )
+    return write_raster(str(tmp_path / "hazard.tif"), data)
+
+
+@pytest.fixture
+def edges() -> gpd.GeoDataFrame:
+    """
+    Edges along the top row of the raster, down its first column, outside it
+    and without geometry, with a non-range index.
+    """
+    return gpd.GeoDataFrame(
+        {"distance_km": [3.0, 3.0, 1.0, 1.0]},
+        geometry=[
+            LineString([(0.5, 3.5), (3.5, 3.5)]),
+            LineString([(0.5, 3.5), (0.5, 0.5)]),
+            LineString([(10.5, 3.5), (11.5, 3.5)]),
+            None,
+        ],
+        index=[30, 10, 20, 40],
+        crs="EPSG:4326",
+    )
+
+
+@pytest.mark.parametrize("tile_size", [1, 2, 1024])
+def test_read_raster_values_nodata_is_nan(raster_path, tile_size):
+    index_i = np.array([1, 3, 0, 2, -1, 4, 0, 3])
+    index_j = np.array([0, 0, 2, 3, 0, 1, 4, 0])
+    values = read_raster_values(raster_path, index_i, index_j, tile_size=tile_size)
+    # nodata pixel, twice, and pixels outside the raster are NaN
+    np.testing.assert_array_equal(values, [1, np.nan, 3, 0, np.nan, np.nan, np.nan, np.nan])
+
+
+def test_split_edges_by_grid_cache_hit_matches_miss(edges, raster_path, tmp_path, monkeypatch):
+    with_geometry = edges[~edges.geometry.isna()]
+    grid = snail.intersection.GridDefinition.from_raster(raster_path)
+    cache_dir = str(tmp_path / "splits")
+
+    expected = split_edges_by_grid(with_geometry, grid)
+    miss = split_edges_by_grid(with_geometry, grid, cache_dir)
+    pd.testing.assert_frame_equal(miss, expected)
+
+    # a hit must be read from the cache, not split again
+    def fail(*args, **kwargs):
+        raise AssertionError("Splits should have been read from cache")
+
+    monkeypatch.setattr(snail.intersection, "split_linestrings", fail)
+    hit = split_edges_by_grid(with_geometry, grid, cache_dir)
+    pd.testing.assert_frame_equal(hit, expected)
+
+    # different geometry is not a hit
+    with pytest.raises(AssertionError, match="from cache"):
+        split_edges_by_grid(with_geometry.iloc[:1], grid, cache_dir)
+
+
+def test_edge_exposure(edges, raster_path, tmp_path):
+    exposure = edge_exposure(edges, raster_path, cache_dir=str(tmp_path / "splits"))
+    pd.testing.assert_index_equal(exposure.index, edges.index)
+
+    # top row: 0.5 at 0, 1 at 1, 1 at 2 and 0.5 at nodata
+    np.testing.assert_allclose(exposure.loc[30, ["max_value", "mean_value"]], [2, 3 / 2.5])
+    np.testing.assert_allclose(exposure.loc[30, "exposed_fraction"], 2 / 3)
+    np.testing.assert_allclose(exposure.loc[30, "exposed_length_km"], 2)
+
+    # first column: 0.5 at 0, 1 at 0, 1 at 3 and 0.5 at 0
+    np.testing.assert_allclose(exposure.loc[10, ["max_value", "mean_value"]], [3, 1])
+    np.testing.assert_allclose(exposure.loc[10, "exposed_fraction"], 1 / 3)
+
+    # outside the raster
+    assert exposure.loc[20, ["max_value", "mean_value"]].isna().all()
+    assert exposure.loc[20, "exposed_fraction"] == 0
+
+    # without geometry
+    assert exposure.loc[40, ["max_value", "mean_value", "exposed_fraction"]].isna().all()
+
+
+def test_failed_edge_mask_matches_by_index(edges):
+    # exposure of some edges, in a different order
+    exposure = pd.DataFrame({"max_value": [3.0, 0.2, np.nan]}, index=[10, 30, 20])
+    mask = failed_edge_mask(edges, exposure, 0.5)
+    np.testing.assert_array_equal(mask, [False, True, False, False])
+
+    with pytest.raises(ValueError, match="unique index"):
+        failed_edge_mask(edges.set_axis([30, 10, 30, 40]), exposure, 0.5)
+
+
+def test_tiled_edge_exposure_matches_edge_exposure(tmp_path):
+    # 12 x 12 raster, without hazard in its bottom right quarter, so some tiles are skipped
+    rng = np.random.default_rng(0)
+    data = rng.uniform(0, 1, (12, 12)).astype(np.float32)
+    data[rng.uniform(size=data.shape) < 0.3] = 0
+    data[6:, 6:] = 0
+    data[2, 5] = NODATA
+    raster_path = write_raster(str(tmp_path / "hazard.tif"), data)
+
+    # edges of several lengths and directions, many crossing the 5 pixel tiles and some the raster's edge,
+    # and two in the last tile, within the quarter without hazard
+    start = rng.uniform(-1, 13, (40, 2))
+    end = start + rng.uniform(-4, 4, (40, 2))
+    geometry = [LineString([a, b]) for a, b in zip(start, end)]
+    geometry += [LineString([(9.2, 2.5), (10.8, 1.5)]), LineString([(11.5, 0.5), (10.5, 3.5)])]
+    edges = gpd.GeoDataFrame(
+        {"distance_km": rng.uniform(1, 10, len(geometry))},
+        geometry=geometry,
+        index=np.arange(len(geometry)) * 2 + 100,
+        crs="EPSG:4326",
+    )
+    edges.loc[102, "geometry"] = None
+
+    expected = edge_exposure(edges, raster_path)
+    tiled = tiled_edge_exposure(edges, raster_path, 2, tile_size=5, cache_dir=str(tmp_path / "splits"))
+    pd.testing.assert_index_equal(tiled.index, expected.index)
+
+    # edges of tiles without hazard are skipped, the others exposed exactly as without tiling
+    skipped = tiled.max_value.isna() & ~expected.max_value.isna()
+    assert skipped.any()
+    assert (expected.loc[skipped, "max_value"] <= 0).all()
+    assert (expected.loc[skipped, "exposed_fraction"] == 0).all()
+    assert (tiled.loc[skipped, "exposed_fraction"] == 0).all()
+    pd.testing.assert_frame_equal(tiled[~skipped], expected[~skipped])
+
+    for failure_threshold in [0, 0.5, 0.9]:
+        surviving = filter_edges_by_raster(edges, raster_path, failure_threshold)
+        failed = failed_edge_mask(edges, tiled, failure_threshold)
+        pd.testing.assert_index_equal(edges.index[~failed], surviving.index)
@@ -0,0 +1,24 @@
+import json
+
+from trade_flow import instrument
+from trade_flow.instrument import stage, write_metrics
+
+
+def test_write_metrics_forgets_written_stages(tmp_path):
+    # stages recorded by other tests in this process
+    instrument.reset()
+    with stage("first"):
+        pass
+    write_metrics(str(tmp_path / "first.json"))
+
+    with stage("second"), stage("second.inner"):
+        pass
+    write_metrics(str(tmp_path / "second.json"), n_items=1)
+
+    with open(tmp_path / "first.json") as fp:
+        assert set(json.load(fp)["stages"]) == {"first"}
+    with open(tmp_path / "second.json") as fp:
+        second = json.load(fp)
+    assert set(second["stages"]) == {"second", "second.inner"}
+    assert second["context"] == {"n_items": 1}
+    assert instrument.stages == {} and instrument.open_stage_peaks == []
@@ -0,0 +1,490 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from scipy.spatial import cKDTree
+from shapely.geometry import LineString
+
+from trade_flow.network_creation import (
+    EdgeIndex, clean_maxspeeds, create_edges_to_destination_countries, create_edges_to_nearest_nodes, create_multi_modal_network,
+    duplicate_reverse_and_append_edges, find_neighbouring_points, parse_port_road_connections, path_edges_from_ordered_id_list,
+    preprocess_road_network
+)
+
+STUDY_COUNTRY = "THA"
+INTERMODAL_COST_USD_T = {"road_rail": 5, "maritime_road": 4, "maritime_rail": 5}
+
+
+def points(rows: list[tuple], columns: list[str]) -> gpd.GeoDataFrame:
+    """
+    Table of point nodes from rows of (*columns, x, y).
+    """
+    table = pd.DataFrame([row[:-2] for row in rows], columns=columns)
+    xy = np.array([row[-2:] for row in rows], dtype=float)
+    return gpd.GeoDataFrame(table, geometry=shapely.points(xy), crs=4326)
+
+
+def lines(nodes: gpd.GeoDataFrame, rows: list[tuple], mode: str) -> gpd.GeoDataFrame:
+    """
+    Table of straight edges between nodes from rows of (from_id, to_id, cost_USD_t).
+    """
+    edges = pd.DataFrame(rows, columns=["from_id", "to_id", "cost_USD_t"])
+    node_index = nodes.set_index("id")
+    edges["from_iso_a3"] = node_index.iso_a3.loc[edges.from_id].to_numpy()
+    edges["to_iso_a3"] = node_index.iso_a3.loc[edges.to_id].to_numpy()
+    edges["mode"] = mode
+    geometry = shapely.linestrings(
+        np.stack(
+            [
+                shapely.get_coordinates(node_index.geometry.loc[edges.from_id].to_numpy()),
+                shapely.get_coordinates(node_index.geometry.loc[edges.to_id].to_numpy()),
+            ],
+            axis=1
+        )
+    )
+    return gpd.GeoDataFrame(edges, geometry=geometry, crs=4326)
+
+
+@pytest.fixture
+def toy_networks() -> dict[str, gpd.GeoDataFrame]:
+    """
+    Road and rail networks crossing the study country's border, a domestic
+    and a foreign port, and destination country nodes. One road node pair is
+    joined by two parallel edges.
+    """
+    road_nodes = points(
+        [
+            ("road_0", "THA", 100.00, 13.0),
+            ("road_1", "THA", 100.01, 13.0),
+            ("road_2", "LAO", 100.02, 13.0),
+            ("road_3", "LAO", 100.03, 13.0),
+        ],
+        ["id", "iso_a3"]
+    )
+    road_edges = lines(
+        road_nodes,
+        [
+            ("road_0", "road_1", 1.0),
+            # parallel edge, the first of a repeated pair is kept
+            ("road_0", "road_1", 0.5),
+            ("road_1", "road_0", 1.0),
+            # border crossings
+            ("road_1", "road_2", 2.0),
+            ("road_2", "road_1", 2.0),
+            ("road_2", "road_3", 1.0),
+            ("road_3", "road_2", 1.0),
+        ],
+        "road"
+    )
+    rail_nodes = points(
+        [
+            ("rail_0", "THA", True, 100.0001, 13.0001),
+            ("rail_1", "THA", False, 100.01, 13.01),
+            ("rail_2", "MMR", True, 99.99, 13.01),
+        ],
+        ["id", "iso_a3", "station"]
+    )
+    rail_edges = lines(
+        rail_nodes,
+        [
+            ("rail_0", "rail_1", 3.0),
+            ("rail_1", "rail_0", 3.0),
+            ("rail_1", "rail_2", 3.0),
+            ("rail_2", "rail_1", 3.0),
+        ],
+        "rail"
+    )
+    maritime_nodes = points(
+        [
+            ("port_1_land", "THA", "port", 100.0101, 13.0001),
+            ("port_1_out", "THA", "port_out", 100.02, 12.9),
+            ("port_2_land", "VNM", "port", 106.7, 10.8),
+            ("port_2_in", "VNM", "port_in", 106.8, 10.7),
+        ],
+        ["id", "iso_a3", "infra"]
+    )
+    maritime_edges = lines(
+        maritime_nodes,
+        [
+            ("port_1_land", "port_1_out", 1.0),
+            ("port_1_out", "port_2_in", 50.0),
+            ("port_2_in", "port_2_land", 1.0),
+        ],
+        "maritime"
+    )
+    destination_country_nodes = points(
+        [
+            ("GID_0_LAO", "LAO", 102.0, 19.0),
+            ("GID_0_MMR", "MMR", 96.0, 21.0),
+            ("GID_0_VNM", "VNM", 106.0, 16.0),
+        ],
+        ["id", "iso_a3"]
+    )
+    return {
+        "road_nodes": road_nodes,
+        "road_edges": road_edges,
+        "rail_nodes": rail_nodes,
+        "rail_edges": rail_edges,
+        "maritime_nodes": maritime_nodes,
+        "maritime_edges": maritime_edges,
+        "destination_country_nodes": destination_country_nodes,
+    }
+
+
+def baseline_multi_modal_edges(networks: dict[str, gpd.GeoDataFrame]) -> pd.DataFrame:
+    """
+    Edges of the multi-modal network as built by the original row-wise
+    implementation: a nearest point join, a per-row importing node lookup,
+    per-row destination links and a dedupe on concatenated node id strings.
+    """
+    road_nodes = networks["road_nodes"]
+    rail_nodes = networks["rail_nodes"]
+    maritime_nodes = networks["maritime_nodes"]
+    destination_country_nodes = networks["destination_country_nodes"]
+
+    def nearest_node_edges(a, b, max_distance_m, crs):
+        a = a.to_crs(crs).reset_index(drop=True)
+        b = b.to_crs(crs).reset_index(drop=True)
+        tree = cKDTree(b.geometry.get_coordinates().to_numpy())
+        distances, indices = tree.query(a.geometry.get_coordinates().to_numpy(), k=1)
+        rows = [
+            {
+                "from_id": row.id,
+                "to_id": b.id.iloc[j],
+                "from_iso_a3": row.iso_a3,
+                "to_iso_a3": row.iso_a3,
+                "geometry": LineString([row.geometry, b.geometry.iloc[j]]),
+            }
+            for (_, row), j, distance in zip(a.iterrows(), indices, distances)
+            if distance < max_distance_m
+        ]
+        return gpd.GeoDataFrame(rows, geometry="geometry", crs=crs).to_crs(epsg=4326)
+
+    def importing_node_id(row):
+        if row.from_iso_a3 == STUDY_COUNTRY and row.to_iso_a3 != STUDY_COUNTRY:
+            return row.to_id
+        elif row.from_iso_a3 != STUDY_COUNTRY and row.to_iso_a3 == STUDY_COUNTRY:
+            return row.from_id
+        else:
+            raise RuntimeError
+
+    def destination_edges(origin_nodes, cost_USD_t):
+        destinations = destination_country_nodes.set_index("iso_a3")
+        rows = [
+            {
+                "from_id": row.id,
+                "to_id": destinations.loc[row.iso_a3].id,
+                "from_iso_a3": row.iso_a3,
+                "to_iso_a3": row.iso_a3,
+                "mode": "imaginary",
+                "geometry": LineString([row.geometry, destinations.loc[row.iso_a3].geometry]),
+                "cost_USD_t": cost_USD_t,
+            }
+            for _, row in origin_nodes.iterrows()
+        ]
+        return gpd.GeoDataFrame(rows, geometry="geometry", crs=4326)
+
+    stations = rail_nodes.loc[rail_nodes.station == True, ["id", "iso_a3", "geometry"]]
+    domestic_ports = maritime_nodes.loc[
+        (maritime_nodes.infra == "port") & (maritime_nodes.iso_a3 == STUDY_COUNTRY),
+        ["id", "iso_a3", "geometry"]
+    ]
+    rail_road_edges = nearest_node_edges(stations, road_nodes, 2_000, rail_nodes.estimate_utm_crs())
+    rail_road_edges["mode"] = "road_rail"
+    maritime_road_edges = nearest_node_edges(domestic_ports, road_nodes, 2_000, road_nodes.estimate_utm_crs())
+    maritime_road_edges["mode"] = "maritime_road"
+    maritime_rail_edges = nearest_node_edges(domestic_ports, stations, 2_000, road_nodes.estimate_utm_crs())
+    maritime_rail_edges["mode"] = "maritime_rail"
+    intermodal_edges = duplicate_reverse_and_append_edges(
+        pd.concat([rail_road_edges, maritime_road_edges, maritime_rail_edges])
+    )
+    intermodal_edges["cost_USD_t"] = intermodal_edges["mode"].map(INTERMODAL_COST_USD_T)
+
+    edge_cols = ["from_id", "to_id", "from_iso_a3", "to_iso_a3", "mode", "cost_USD_t", "geometry"]
+    edges = pd.concat(
+        [
+            intermodal_edges.loc[:, edge_cols],
+            networks["road_edges"].loc[:, edge_cols],
+            networks["rail_edges"].loc[:, edge_cols],
+            networks["maritime_edges"].loc[:, edge_cols],
+        ]
+    )
+    nodes = pd.concat([road_nodes, rail_nodes, maritime_nodes]).loc[:, ["id", "iso_a3", "geometry"]]
+
+    border_crossing_mask = \
+        (edges.from_iso_a3 != edges.to_iso_a3) \
+        & ((edges.from_iso_a3 == STUDY_COUNTRY) | (edges.to_iso_a3 == STUDY_COUNTRY)) \
+        & ((edges["mode"] == "road") | (edges["mode"] == "rail"))
+    importing_node_ids = edges[border_crossing_mask].apply(importing_node_id, axis=1)
+    importing_nodes = nodes.set_index("id").loc[importing_node_ids].reset_index()
+    importing_nodes = importing_nodes[importing_nodes.iso_a3 != STUDY_COUNTRY]
+    foreign_ports = maritime_nodes[(maritime_nodes.infra == "port") & (maritime_nodes.iso_a3 != STUDY_COUNTRY)]
+
+    edges = pd.concat(
+        [
+            edges.loc[:, edge_cols],
+            duplicate_reverse_and_append_edges(destination_edges(importing_nodes, 1E6).loc[:, edge_cols]),
+            duplicate_reverse_and_append_edges(destination_edges(foreign_ports, 1E6).loc[:, edge_cols]),
+        ]
+    ).reset_index(drop=True)
+    unique_edge_id = edges.apply(lambda row: f"{row.from_id}_{row.to_id}", axis=1)
+    return edges[~unique_edge_id.duplicated(keep="first")].reset_index(drop=True)
+
+
+def test_create_multi_modal_network_matches_baseline(toy_networks):
+    _, edges, importing_nodes = create_multi_modal_network(
+        **toy_networks,
+        study_country=STUDY_COUNTRY,
+        intermodal_cost_USD_t=INTERMODAL_COST_USD_T,
+    )
+    expected = baseline_multi_modal_edges(toy_networks)
+
+    columns = ["from_id", "to_id", "mode", "cost_USD_t"]
+    pd.testing.assert_frame_equal(edges.loc[:, columns], expected.loc[:, columns], check_dtype=False)
+
+    # the network has each feature the comparison is meant to exercise
+    assert set(importing_nodes.id) == {"road_2", "rail_2"}
+    assert not edges.duplicated(subset=["from_id", "to_id"]).any()
+    parallel, = edges.index[(edges.from_id == "road_0") & (edges.to_id == "road_1")]
+    assert edges.loc[parallel, "cost_USD_t"] == 1.0
+    assert set(edges["mode"]) == {
+        "road", "rail", "maritime", "road_rail", "maritime_road", "maritime_rail", "imaginary"
+    }
+
+
+def brute_force_neighbours(a: np.ndarray, b: np.ndarray, max_distance: float, k: int | None) -> list[tuple]:
+    """
+    (position in a, position in b) of the `k` nearest (or, if None, all)
+    points in b closer than `max_distance` to each point in a, by distance.
+    """
+    pairs = []
+    for i, point in enumerate(a):
+        distances = np.linalg.norm(b - point, axis=1)
+        order = np.argsort(distances, kind="stable")[:k]
+        pairs.extend((i, j) for j in order if distances[j] < max_distance)
+    return pairs
+
+
+@pytest.mark.parametrize("k", [1, 2, 5, 30])
+def test_find_neighbouring_points_k_nearest(k):
+    rng = np.random.default_rng(0)
+    a = rng.uniform(0, 10, (15, 2))
+    b = rng.uniform(0, 10, (20, 2))
+
+    a_positions, b_positions, distances = find_neighbouring_points(a, b, 3, k=k)
+    # k greater than the number of points in b finds all of those close enough
+    assert list(zip(a_positions, b_positions)) == brute_force_neighbours(a, b, 3, k)
+    np.testing.assert_allclose(distances, np.linalg.norm(a[a_positions] - b[b_positions], axis=1))
+
+
+def test_find_neighbouring_points_within_radius():
+    rng = np.random.default_rng(0)
+    a = rng.uniform(0, 10, (15, 2))
+    b = rng.uniform(0, 10, (20, 2))
+
+    # k is ignored
+    a_positions, b_positions, distances = find_neighbouring_points(a, b, 3, k=1, within_radius=True)
+    assert list(zip(a_positions, b_positions)) == brute_force_neighbours(a, b, 3, None)
+    assert (distances < 3).all()
+    np.testing.assert_allclose(distances, np.linalg.norm(a[a_positions] - b[b_positions], axis=1))
+
+
+@pytest.mark.parametrize(
+    "k, within_radius, max_distance_m, expected",
+    [
+        (1, False, 2_000, [("port_1_land", "road_1")]),
+        (2, False, 2_000, [("port_1_land", "road_1"), ("port_1_land", "road_2")]),
+        # road_0 is amongst the nearest, but out of range
+        (3, False, 1_080, [("port_1_land", "road_1"), ("port_1_land", "road_2")]),
+        # road_0 and road_3 are in range, but not amongst the nearest
+        (2, False, 5_000, [("port_1_land", "road_1"), ("port_1_land", "road_2")]),
+        (1, True, 2_000, [("port_1_land", "road_1"), ("port_1_land", "road_2"), ("port_1_land", "road_0")]),
+        (
+            1,
+            True,
+            5_000,
+            [("port_1_land", "road_1"), ("port_1_land", "road_2"), ("port_1_land", "road_0"), ("port_1_land", "road_3")]
+        ),
+        (1, True, 10, []),
+    ]
+)
+def test_create_edges_to_nearest_nodes(toy_networks, k, within_radius, max_distance_m, expected):
+    ports = toy_networks["maritime_nodes"].iloc[:1]
+    road_nodes = toy_networks["road_nodes"]
+    edges = create_edges_to_nearest_nodes(
+        ports, road_nodes, max_distance_m, road_nodes.estimate_utm_crs(), k=k, within_radius=within_radius
+    )
+    assert list(zip(edges.from_id, edges.to_id)) == expected
+    assert (edges.distance_m < max_distance_m).all()
+    assert (edges.from_iso_a3 == "THA").all()
+
+
+@pytest.mark.parametrize(
+    "port_road_connections, expected",
+    [
+        (1, {"max_distance_m": 2_000, "k": 1, "within_radius": False}),
+        ({"mode": "nearest", "k": 3}, {"max_distance_m": 2_000, "k": 3, "within_radius": False}),
+        ({"mode": "within_radius", "radius_m": 500}, {"max_distance_m": 500, "k": 1, "within_radius": True}),
+    ]
+)
+def test_parse_port_road_connections(port_road_connections, expected):
+    assert parse_port_road_connections(port_road_connections, 2_000) == expected
+
+
+@pytest.mark.parametrize(
+    "port_road_connections, match",
+    [
+        ({"mode": "closest", "k": 1}, "not recognised"),
+        ({"k": 1}, "not recognised"),
+        ({"mode": "nearest"}, "requires an integer k"),
+        ({"mode": "nearest", "k": 0}, "requires an integer k"),
+        (0, "requires an integer k"),
+        ({"mode": "within_radius", "k": 1}, "requires a positive radius_m"),
+        ({"mode": "within_radius", "radius_m": -1}, "requires a positive radius_m"),
+    ]
+)
+def test_parse_port_road_connections_invalid(toy_networks, port_road_connections, match):
+    with pytest.raises(ValueError, match=match):
+        parse_port_road_connections(port_road_connections, 2_000)
+    with pytest.raises(ValueError, match=match):
+        create_multi_modal_network(
+            **toy_networks,
+            study_country=STUDY_COUNTRY,
+            intermodal_cost_USD_t=INTERMODAL_COST_USD_T,
+            port_road_connections=port_road_connections,
+        )
+
+
+def test_create_multi_modal_network_port_road_connections(toy_networks):
+    _, edges, _ = create_multi_modal_network(
+        **toy_networks,
+        study_country=STUDY_COUNTRY,
+        intermodal_cost_USD_t=INTERMODAL_COST_USD_T,
+        port_road_connections={"mode": "within_radius", "radius_m": 1_500},
+    )
+    port_road = edges[(edges["mode"] == "maritime_road") & (edges.from_id == "port_1_land")]
+    # road_3 is out of range
+    assert set(port_road.to_id) == {"road_0", "road_1", "road_2"}
+    # and back again
+    assert len(edges[(edges["mode"] == "maritime_road") & (edges.to_id == "port_1_land")]) == 3
+
+
+def baseline_path_edges(path_node_ids: list[str], edges: pd.DataFrame) -> pd.DataFrame:
+    """
+    Linear scan of `edges` for each hop, as `path_edges_from_ordered_id_list`
+    did before `EdgeIndex`.
+    """
+    route_edges = []
+    for i, from_node_id in enumerate(path_node_ids[:-1]):
+        to_node_id = path_node_ids[i + 1]
+        edge = edges[(edges.from_id == from_node_id) & (edges.to_id == to_node_id)]
+        assert len(edge) == 1
+        route_edges.append(edge)
+    return pd.concat(route_edges)
+
+
+def test_path_edges_match_linear_scan_with_parallel_edges(toy_networks):
+    edges = toy_networks["road_edges"]
+    # the parallel road_0 -> road_1 pair comes before other edges, shifting their positions
+    assert edges.duplicated(subset=["from_id", "to_id"]).sum() == 1
+    edge_index = EdgeIndex.from_edges(edges)
+
+    paths = [
+        ["road_1", "road_2", "road_3"],
+        ["road_3", "road_2", "road_1", "road_0"],
+        ["road_2", "road_1", "road_0"],
+    ]
+    for path in paths:
+        expected = baseline_path_edges(path, edges)
+        pd.testing.assert_frame_equal(path_edges_from_ordered_id_list(path, edges), expected)
+        pd.testing.assert_frame_equal(path_edges_from_ordered_id_list(path, edges, edge_index), expected)
+
+    # many paths in one lookup
+    offsets, positions = edge_index.path_edge_positions(paths)
+    for i, path in enumerate(paths):
+        expected = baseline_path_edges(path, edges)
+        pd.testing.assert_frame_equal(edges.iloc[positions[offsets[i]: offsets[i + 1]]], expected)
+
+    # as the linear scan, a hop joined by more than one edge is refused rather than picking one
+    ambiguous_path = ["road_0", "road_1", "road_2"]
+    with pytest.raises(AssertionError):
+        baseline_path_edges(ambiguous_path, edges)
+    with pytest.raises(AssertionError, match="More than one edge"):
+        path_edges_from_ordered_id_list(ambiguous_path, edges, edge_index)
+    with pytest.raises(AssertionError, match="More than one edge"):
+        edge_index.path_edge_positions([paths[0], ambiguous_path])
+
+    # once deduplicated as by create_multi_modal_network, the first of the pair is used
+    deduplicated = edges.drop_duplicates(subset=["from_id", "to_id"], keep="first")
+    path_edges = path_edges_from_ordered_id_list(ambiguous_path, deduplicated)
+    pd.testing.assert_frame_equal(path_edges, baseline_path_edges(ambiguous_path, deduplicated))
+    assert path_edges.index[0] == 0
+
+
+def test_create_edges_to_destination_countries_missing_country(toy_networks):
+    nodes = toy_networks["road_nodes"]
+    with pytest.raises(KeyError, match="THA"):
+        create_edges_to_destination_countries(nodes, toy_networks["destination_country_nodes"])
+
+
+@pytest.mark.parametrize(
+    "value, expected_km_h",
+    [
+        ("50", 50),
+        ("50.5", 50.5),
+        (" 60 ", 60),
+        ("1_00", 100),
+        (80, 80),
+        ("20", 20),
+        ("140", 140),
+        # out of range
+        ("10", 80),
+        ("200", 80),
+        # not parseable as a number
+        ("50 mph", 80),
+        ("RU:urban", 80),
+        ("50;60", 80),
+        ("none", 80),
+        ("", 80),
+        # missing
+        (np.nan, 80),
+        (None, 80),
+    ]
+)
+def test_clean_maxspeeds(value, expected_km_h):
+    # mix with other values, so parsing of the whole column is exercised
+    values = pd.Series(["50", value, "RU:urban"], dtype=object)
+    np.testing.assert_array_equal(clean_maxspeeds(values, 80), [50, expected_km_h, 80])
+
+
+def test_preprocess_road_network_ids_and_speeds(tmp_path):
+    nodes = gpd.GeoDataFrame(
+        {"id": ["1", "2", "3"]},
+        geometry=shapely.points([(100, 13), (100.01, 13), (100.02, 13)]),
+        crs=4326
+    )
+    edges = gpd.GeoDataFrame(
+        {
+            "id": ["10", "11"],
+            "from_id": ["1", "2"],
+            "to_id": ["2", "3"],
+            "from_iso_a3": ["THA", "THA"],
+            "to_iso_a3": ["THA", "LAO"],
+            "tag_maxspeed": ["50 mph", "90"],
+        },
+        geometry=[LineString([(100, 13), (100.01, 13)]), LineString([(100.01, 13), (100.02, 13)])],
+        crs=4326
+    )
+    nodes.to_parquet(tmp_path / "nodes.gpq")
+    edges.to_parquet(tmp_path / "edges.gpq")
+
+    road_nodes, road_edges = preprocess_road_network(
+        str(tmp_path / "nodes.gpq"), str(tmp_path / "edges.gpq"), {"THA"}, 0.05, 0.48, True, 80
+    )
+    assert list(road_nodes.id) == ["road_1", "road_2", "road_3"]
+    assert list(road_edges.from_id) == ["road_1", "road_2", "road_2", "road_3"]
+    assert list(road_edges.to_id) == ["road_2", "road_3", "road_1", "road_2"]
+    assert list(road_edges.id) == ["road_10", "road_11"] * 2
+    np.testing.assert_array_equal(road_edges.max_speed_km_h, [80, 90] * 2)
+    np.testing.assert_allclose(road_edges.avg_speed_km_h, [80 * 2 / 3, 60] * 2)
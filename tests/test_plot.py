@@ -0,0 +1,97 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import LineString
+from shapely.ops import split
+
+pytest.importorskip("matplotlib")
+
+from trade_flow.plot import chop_at_antimeridian
+
+
+def baseline_chop_at_antimeridian(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Row-wise implementation `chop_at_antimeridian` replaced, to check the
+    vectorised version against.
+    """
+    def split_on_meridian(gdf: gpd.GeoDataFrame, meridian: LineString) -> gpd.GeoDataFrame:
+        return gdf.assign(geometry=gdf.apply(lambda row: split(row.geometry, meridian), axis=1)).explode(index_parts=False)
+
+    xlim = 179.9
+    ylim = 90
+
+    split_e = split_on_meridian(gdf, LineString([(xlim, ylim), (xlim, -ylim)]))
+    split_e_and_w = split_on_meridian(split_e, LineString([(-xlim, ylim), (-xlim, -ylim)]))
+
+    def crosses_antimeridian(row: pd.Series) -> bool:
+        x, _ = row.geometry.coords.xy
+        longitudes_near_antimeridian = np.array(x)[np.argwhere(np.abs(np.abs(x) - 180) < xlim).ravel()]
+        hemispheres = np.unique(np.sign(longitudes_near_antimeridian))
+        return bool((-1 in hemispheres) and (1 in hemispheres))
+
+    return split_e_and_w[~split_e_and_w.apply(crosses_antimeridian, axis=1)]
+
+
+@pytest.fixture
+def lines() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame(
+        {"to_port": ["a", "b", "c", "d", "e", "f", "g", "h"]},
+        geometry=[
+            # clear of the antimeridian
+            LineString([(100, 0), (120, 10)]),
+            # crossing once, between vertices either side of it
+            LineString([(170, 0), (179.95, 1), (-179.95, 2), (-170, 3)]),
+            # crossing three times
+            LineString([(170, 0), (179.95, 1), (-179.95, 2), (179.95, 3), (-179.95, 4), (-170, 5)]),
+            # jumping between hemispheres without reaching the antimeridian, crossing it when wrapped
+            LineString([(175, 0), (-175, 1), (175, 2)]),
+            # lying exactly on 180, and on -180
+            LineString([(180, 0), (180, 10)]),
+            LineString([(-180, 0), (-180, 10)]),
+            # from 180 to -180, along the equator
+            LineString([(180, 0), (-180, 0)]),
+            # approaching 180 and turning back
+            LineString([(170, 5), (180, 5), (170, 6)]),
+        ],
+        index=[5, 3, 9, 4, 1, 7, 2, 8],
+        crs="EPSG:4326",
+    )
+
+
+def test_chop_at_antimeridian_matches_baseline(lines):
+    chopped = chop_at_antimeridian(lines)
+    expected = baseline_chop_at_antimeridian(lines)
+
+    pd.testing.assert_index_equal(chopped.index, expected.index)
+    assert chopped.to_port.tolist() == expected.to_port.tolist()
+    assert shapely.equals_exact(chopped.geometry.to_numpy(), expected.geometry.to_numpy(), tolerance=1E-9).all()
+
+
+def test_chop_at_antimeridian(lines):
+    chopped = chop_at_antimeridian(lines)
+
+    # no fragment spans both sides of the antimeridian
+    for line in chopped.geometry:
+        x = shapely.get_coordinates(line)[:, 0]
+        assert (x >= 0).all() or (x <= 0).all()
+
+    # lines clear of, or lying on, the antimeridian are unchanged
+    for index in [5, 1, 7]:
+        assert shapely.equals_exact(chopped.geometry.loc[[index]].item(), lines.geometry.loc[index])
+
+    # crossing lines keep the fragments either side of each crossing, but not those spanning it
+    np.testing.assert_allclose(
+        shapely.get_coordinates(chopped.geometry.loc[[3]].to_numpy())[:, 0],
+        [170, 179.9, 179.9, 179.95, 179.9, -179.9, -179.95, -179.9, -179.9, -170],
+    )
+    x = shapely.get_coordinates(chopped.geometry.loc[[9]].to_numpy())[:, 0]
+    assert len(chopped.loc[[9]]) == 6
+    assert x[0] == 170 and x[-1] == -170
+    assert 4 not in chopped.index
+    np.testing.assert_allclose(shapely.get_coordinates(chopped.geometry.loc[[2]].to_numpy())[:, 0], [180, 179.9, -179.9, -180])
+
+    # a line touching the antimeridian without crossing it is split near it, but every fragment kept
+    assert len(chopped.loc[[8]]) == 3
+    assert shapely.length(chopped.geometry.loc[[8]].to_numpy()).sum() == pytest.approx(lines.geometry.loc[8].length)
@@ -0,0 +1,246 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trade_flow.route_store import RouteStore
+from trade_flow.routing import (
+    degraded_edge_map, list_shards, lookup_route_costs, masked_edge_map, order_as_od, reroute_disrupted_flows,
+    route_costs, route_from_all_nodes, route_scenarios, routes_using_edges
+)
+
+from conftest import grid_network, grid_od
+
+
+def assert_same_flows(a: RouteStore, b: RouteStore) -> None:
+    np.testing.assert_array_equal(a.source_node, b.source_node)
+    np.testing.assert_array_equal(a.destination_node, b.destination_node)
+    np.testing.assert_array_equal(a.value_kusd, b.value_kusd)
+    np.testing.assert_array_equal(a.volume_tons, b.volume_tons)
+
+
+def assert_same_routes(a: RouteStore, b: RouteStore) -> None:
+    assert_same_flows(a, b)
+    np.testing.assert_array_equal(a.offsets, b.offsets)
+    np.testing.assert_array_equal(a.edge_indices, b.edge_indices)
+
+
+def assert_same_costs(a: RouteStore, b: RouteStore, edges: pd.DataFrame) -> None:
+    destination_links = (edges["mode"] == "imaginary").to_numpy()
+    costs_a = route_costs(a, edges.cost_USD_t.to_numpy(), destination_links)
+    costs_b = route_costs(b, edges.cost_USD_t.to_numpy(), destination_links)
+    np.testing.assert_allclose(costs_a.cost_USD_t, costs_b.cost_USD_t)
+    np.testing.assert_array_equal(costs_a.n_destination_links, costs_b.n_destination_links)
+
+
+def test_destination_root_matches_origin_root(untied_network):
+    edges, od = untied_network
+    origin_routes = route_from_all_nodes(od, edges, 2, root="origin", batch_size=10)
+    destination_routes = route_from_all_nodes(od, edges, 2, root="destination", batch_size=10)
+
+    assert len(origin_routes) == len(od)
+    assert_same_routes(origin_routes, destination_routes)
+
+
+def test_destination_root_matches_origin_root_cost_with_ties(tied_network):
+    edges, od = tied_network
+    origin_routes = route_from_all_nodes(od, edges, 2, root="origin", batch_size=10)
+    destination_routes = route_from_all_nodes(od, edges, 2, root="destination", batch_size=10)
+
+    # where least cost routes tie, each root may pick a different one, of the same cost
+    assert_same_flows(origin_routes, destination_routes)
+    assert_same_costs(origin_routes, destination_routes, edges)
+
+
+def test_lookup_route_costs(untied_network, tmp_path):
+    edges, od = untied_network
+    routes = route_from_all_nodes(od, edges, 2, batch_size=10)
+    routes_path = str(tmp_path / "routes.pq")
+    edges_path = str(tmp_path / "edges.pq")
+    routes.to_parquet(routes_path)
+    edges.to_parquet(edges_path)
+
+    costs = lookup_route_costs(routes_path, edges_path)
+    # flows from nodes on the edge of the grid take a destination link alone, at no cost
+    assert len(costs) < len(od)
+    assert (costs.n_destination_links == 1).all()
+    assert (costs.cost_USD_t > 0).all()
+    assert set(costs.destination_node) == {"AAA", "BBB"}
+
+
+@pytest.fixture
+def parallel_edge_network() -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Grid of tied costs, where some edges have parallel edges (repeating their
+    from_id -> to_id pair) costing less, the same or more, and some edges
+    cost nothing.
+    """
+    n = 5
+    costs = np.ones(4 * n * n)
+    costs[::7] = 0
+    edges = grid_network(n, costs)
+    road = edges[edges["mode"] == "road"]
+    parallel = pd.concat(
+        [
+            road.iloc[1::5].assign(cost_USD_t=road.cost_USD_t.iloc[1::5] * 0.5),
+            road.iloc[2::5],
+            road.iloc[3::5].assign(cost_USD_t=road.cost_USD_t.iloc[3::5] + 1),
+        ]
+    )
+    # interleave parallel edges with the originals
+    edges = pd.concat([edges, parallel]).sort_index(kind="stable").reset_index(drop=True)
+    return edges, grid_od(n)
+
+
+@pytest.mark.parametrize("root", ["origin", "destination"])
+def test_scipy_backend_matches_igraph_with_parallel_edges_and_ties(parallel_edge_network, root):
+    edges, od = parallel_edge_network
+    assert edges.duplicated(subset=["from_id", "to_id"]).any()
+    igraph_routes = route_from_all_nodes(od, edges, 2, root=root, batch_size=10, backend="igraph")
+    scipy_routes = route_from_all_nodes(od, edges, 2, root=root, batch_size=10, backend="scipy")
+
+    assert len(scipy_routes) == len(od)
+    assert_same_flows(igraph_routes, scipy_routes)
+    assert_same_costs(igraph_routes, scipy_routes, edges)
+
+    # every edge path is contiguous, from the origin to the destination
+    from_id = edges.from_id.to_numpy()
+    to_id = edges.to_id.to_numpy()
+    for i in range(len(scipy_routes)):
+        path = scipy_routes.edge_indices[scipy_routes.offsets[i]: scipy_routes.offsets[i + 1]]
+        assert len(path) > 0
+        np.testing.assert_array_equal(to_id[path[:-1]], from_id[path[1:]])
+        assert from_id[path[0]] == f"road_{scipy_routes.source_node[i]}"
+        assert to_id[path[-1]] == scipy_routes.destination_node[i]
+
+
+def test_resume_from_work_dir(untied_network, tmp_path):
+    edges, od = untied_network
+    expected = route_from_all_nodes(od, edges, 2, batch_size=10)
+
+    work_dir = str(tmp_path / "routing_work")
+    routes = route_from_all_nodes(od, edges, 2, batch_size=10, work_dir=work_dir)
+    assert_same_routes(expected, routes)
+
+    # simulate an interrupted run, where only some batches completed
+    shards = list_shards(os.path.join(work_dir, "shards"))
+    assert len(shards) > 2
+    for path in shards[::2]:
+        os.remove(path)
+    kept = {path: os.stat(path).st_mtime_ns for path in shards[1::2]}
+
+    resumed = route_from_all_nodes(od, edges, 2, batch_size=10, work_dir=work_dir)
+    assert_same_routes(expected, resumed)
+    # completed batches were not routed again
+    assert all(os.stat(path).st_mtime_ns == mtime for path, mtime in kept.items())
+
+
+def test_work_dir_of_different_inputs_is_discarded(untied_network, tmp_path):
+    edges, od = untied_network
+    work_dir = str(tmp_path / "routing_work")
+    route_from_all_nodes(od, edges, 2, batch_size=10, work_dir=work_dir)
+
+    # different costs invalidate the shards
+    edges = edges.assign(cost_USD_t=edges.cost_USD_t[::-1].to_numpy())
+    expected = route_from_all_nodes(od, edges, 2, batch_size=10)
+    routes = route_from_all_nodes(od, edges, 2, batch_size=10, work_dir=work_dir)
+    assert_same_routes(expected, routes)
+
+
+def test_reroute_disrupted_flows_matches_full_degraded_run(untied_network):
+    edges, od = untied_network
+    intact_routes = route_from_all_nodes(od, edges, 2, batch_size=10)
+
+    # remove the most used edges, degraded edges keep their intact index
+    removed = np.argsort(-np.bincount(intact_routes.edge_indices, minlength=len(edges)))[:3]
+    degraded_edges = edges.drop(index=removed)
+    edge_map = degraded_edge_map(degraded_edges, len(edges))
+    disrupted = routes_using_edges(intact_routes, edge_map == -1)
+    assert 0 < disrupted.sum() < len(intact_routes)
+
+    expected = route_from_all_nodes(od, degraded_edges, 2, batch_size=10)
+    routes = reroute_disrupted_flows(intact_routes, degraded_edges, edge_map, 2, batch_size=10)
+    assert_same_routes(expected, routes)
+
+
+def most_used_edge_masks(routes: RouteStore, n_edges: int) -> dict[str, np.ndarray]:
+    """
+    Scenarios removing the most used edge, and the three most used edges.
+    """
+    most_used = np.argsort(-np.bincount(routes.edge_indices, minlength=n_edges))
+    masks = {}
+    for name, n_removed in [("one", 1), ("three", 3)]:
+        masks[name] = np.zeros(n_edges, dtype=bool)
+        masks[name][most_used[:n_removed]] = True
+    return masks
+
+
+@pytest.mark.parametrize("backend", ["igraph", "scipy"])
+def test_route_scenarios_matches_full_degraded_runs(untied_network, backend):
+    edges, od = untied_network
+    expected_intact = route_from_all_nodes(od, edges, 2, batch_size=10)
+    edge_masks = most_used_edge_masks(expected_intact, len(edges))
+
+    intact, scenarios = route_scenarios(od, edges, edge_masks, 2, batch_size=10, backend=backend)
+    assert_same_routes(expected_intact, intact)
+    for name, edge_mask in edge_masks.items():
+        expected = route_from_all_nodes(od, edges[~edge_mask], 2, batch_size=10)
+        # scenario edge indices are positions in the intact network
+        expected.edge_indices = np.flatnonzero(~edge_mask)[expected.edge_indices].astype(np.int32)
+        assert_same_routes(expected, scenarios[name])
+
+
+def test_masked_edge_map_remaps_scenario_routes(untied_network):
+    edges, od = untied_network
+    edge_masks = most_used_edge_masks(route_from_all_nodes(od, edges, 2, batch_size=10), len(edges))
+    _, scenarios = route_scenarios(od, edges, edge_masks, 2, batch_size=10)
+
+    for name, edge_mask in edge_masks.items():
+        edge_map = masked_edge_map(edge_mask)
+        np.testing.assert_array_equal(edge_map, degraded_edge_map(edges[~edge_mask], len(edges)))
+
+        # as allocate_scenarios, scenario routes remapped to positions in the degraded edges
+        degraded_edges = edges[~edge_mask].reset_index(drop=True)
+        expected = route_from_all_nodes(od, degraded_edges, 2, batch_size=10)
+        remapped = edge_map[scenarios[name].edge_indices]
+        assert (remapped != -1).all()
+        np.testing.assert_array_equal(remapped, expected.edge_indices)
+
+
+def test_resume_route_scenarios_from_work_dir(untied_network, tmp_path):
+    edges, od = untied_network
+    edge_masks = most_used_edge_masks(route_from_all_nodes(od, edges, 2, batch_size=10), len(edges))
+    expected_intact, expected = route_scenarios(od, edges, edge_masks, 2, batch_size=10)
+
+    work_dir = str(tmp_path / "routing_work")
+    route_scenarios(od, edges, edge_masks, 2, batch_size=10, work_dir=work_dir)
+    for name in ["intact", "three"]:
+        shards = list_shards(os.path.join(work_dir, name, "shards"))
+        assert len(shards) > 0
+        os.remove(shards[0])
+
+    intact, scenarios = route_scenarios(od, edges, edge_masks, 2, batch_size=10, work_dir=work_dir)
+    assert_same_routes(expected_intact, intact)
+    for name in edge_masks:
+        assert_same_routes(expected[name], scenarios[name])
+
+
+def test_order_as_od():
+    routes = RouteStore.from_paths(
+        source_nodes=[1, 0, 1],
+        destination_nodes=[7, 8, 8],
+        value_kusd=[1.0, 2.0, 3.0],
+        volume_tons=[10.0, 20.0, 30.0],
+        edge_paths=[[0], [1, 2], [3]],
+    )
+    od = pd.DataFrame({"origin_vid": [1, 0, 1], "destination_vid": [8, 8, 7]})
+    ordered = order_as_od(routes, od)
+    np.testing.assert_array_equal(ordered.source_node, [1, 1, 0])
+    np.testing.assert_array_equal(ordered.destination_node, [8, 7, 8])
+    np.testing.assert_array_equal(ordered.value_kusd, [3.0, 1.0, 2.0])
+
+    # a flow without a route must not silently take the last route
+    od = pd.DataFrame({"origin_vid": [1, 0, 0], "destination_vid": [8, 8, 7]})
+    with pytest.raises(KeyError, match="No route for 1 flows"):
+        order_as_od(routes, od)
@@ -1,23 +1,34 @@
+import os
+import shutil
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+import pyarrow.parquet as pq
 
-from trade_flow.routing import route_from_all_nodes, RouteResult
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.route_store import RouteStore
+from trade_flow.routing import (
+    accumulate_edge_flows, degraded_edge_map, reroute_disrupted_flows, route_from_all_nodes
+)
 
 
 if __name__ == "__main__":
 
-    print("Reading network...")
-    # read in global multi-modal transport network
-    edges = gpd.read_parquet(snakemake.input.edges)
-    available_destinations = edges[edges["mode"] == "imaginary"].to_id.unique()
-    available_country_destinations = [d.split("_")[-1] for d in available_destinations if d.startswith("GID_")]
+    with stage("allocate.read_inputs"):
+        print("Reading network...")
+        # read in global multi-modal transport network
+        edges = gpd.read_parquet(snakemake.input.edges)
+        available_destinations = edges[edges["mode"] == "imaginary"].to_id.unique()
+        available_country_destinations = [d.split("_")[-1] for d in available_destinations if d.startswith("GID_")]
 
-    print("Reading OD matrix...")
-    # read in trade OD matrix
-    od = pd.read_parquet(snakemake.input.od)
-    print(f"OD has {len(od):,d} flows")
+        # integer vertex ids, shared by intact and degraded networks
+        vertices = pd.read_parquet(snakemake.input.vertices)
+
+        print("Reading OD matrix...")
+        # read in trade OD matrix
+        od = pd.read_parquet(snakemake.input.od)
+        print(f"OD has {len(od):,d} flows")
 
     # 5t threshold drops THL road -> GID_0 OD from ~21M -> ~2M
     minimum_flow_volume_tons = snakemake.config["minimum_flow_volume_t"]
@@ -28,21 +39,64 @@ if __name__ == "__main__":
     od = od[od.partner_GID_0.isin(available_country_destinations)]
     print(f"After dropping unrouteable destination countries, OD has {len(od):,d} flows")
 
-    routes: RouteResult = route_from_all_nodes(od, edges, snakemake.threads)
+    # keep completed routing batches here, so an interrupted job can resume
+    work_dir = os.path.join(os.path.dirname(snakemake.output.routes), "routing_work")
+    routing_kwargs = dict(
+        root=snakemake.config["routing_root"],
+        batch_size=snakemake.config["routing_batch_size"],
+        work_dir=work_dir,
+        backend=snakemake.config["routing_backend"],
+        vertices=vertices,
+    )
+    if "intact_routes" in snakemake.input.keys():
+        # degraded network, reuse intact routes which avoid all removed edges
+        print("Reading intact routes...")
+        with stage("allocate.read_intact_routes"):
+            intact_routes = RouteStore.read_parquet(snakemake.input.intact_routes)
+        edge_map = degraded_edge_map(edges, pq.ParquetFile(snakemake.input.intact_edges).metadata.num_rows)
+        print(f"{(edge_map == -1).sum():,d} edges removed from intact network")
+        # intact routes are from the full OD, restrict to the flows we are allocating
+        intact_keys = pd.MultiIndex.from_arrays([intact_routes.source_node, intact_routes.destination_node])
+        od_keys = pd.MultiIndex.from_arrays([od.id, "GID_0_" + od.partner_GID_0])
+        intact_routes = intact_routes.take(np.flatnonzero(intact_keys.isin(od_keys)))
+        routes: RouteStore = reroute_disrupted_flows(
+            intact_routes,
+            edges,
+            edge_map,
+            snakemake.threads,
+            **routing_kwargs
+        )
+    else:
+        routes: RouteStore = route_from_all_nodes(od, edges, snakemake.threads, **routing_kwargs)
 
     print("Writing routes to disk as parquet...")
-    pd.DataFrame(routes).T.to_parquet(snakemake.output.routes)
+    with stage("allocate.write_routes"):
+        routes.to_parquet(snakemake.output.routes)
 
     print("Assigning route flows to edges...")
-    edges["value_kusd"] = 0
-    edges["volume_tons"] = 0
-    value_col_id = edges.columns.get_loc("value_kusd")
-    volume_col_id = edges.columns.get_loc("volume_tons")
-    for (from_node, destination_country), route_data in tqdm(routes.items()):
-        edges.iloc[route_data["edge_indices"], value_col_id] += route_data["value_kusd"]
-        edges.iloc[route_data["edge_indices"], volume_col_id] += route_data["volume_tons"]
+    with stage("allocate.accumulate_edge_flows"):
+        edges["value_kusd"], edges["volume_tons"] = accumulate_edge_flows(
+            routes.offsets,
+            routes.edge_indices,
+            routes.value_kusd,
+            routes.volume_tons,
+            len(edges)
+        )
 
     print("Writing edge flows to disk as geoparquet...")
-    edges.to_parquet(snakemake.output.edges_with_flows)
+    with stage("allocate.write_edges"):
+        edges.to_parquet(snakemake.output.edges_with_flows)
+
+    print("Removing routing work directory...")
+    shutil.rmtree(work_dir)
+
+    print("Writing metrics...")
+    write_metrics(
+        snakemake.output.metrics,
+        threads=snakemake.threads,
+        n_flows=len(od),
+        n_routes=len(routes),
+        n_edges=len(edges),
+    )
 
     print("Done")
\ No newline at end of file
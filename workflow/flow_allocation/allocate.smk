@@ -2,11 +2,19 @@ rule allocate_intact_network:
     """
     Allocate a trade OD matrix across a multi-modal transport network
 
+    Routed batches are checkpointed to a `routing_work` directory alongside the
+    outputs, so an interrupted job will resume where it left off when re-run.
+
+    With `routing_backend: igraph`, every worker holds a private copy of the
+    graph, so memory grows with the number of cores. Use `scipy` for large
+    networks, its workers share one memory-mapped copy.
+
     Test with:
     snakemake -c1 -- results/flow_allocation/project-thailand/edges.gpq 
     """
     input:
         edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
+        vertices = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/vertices.parquet",
         od = "{OUTPUT_DIR}/input/trade_matrix/{PROJECT}/trade_nodes_total.parquet",
     threads: workflow.cores
     params:
@@ -15,37 +23,140 @@ rule allocate_intact_network:
     output:
         routes = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/routes.pq",
         edges_with_flows = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/edges.gpq",
+        # stage timings, memory use and routing throughput
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/allocate.metrics.json",
     script:
         "./allocate.py"
 
 
+def allocate_degraded_network_input(wildcards) -> dict:
+    """
+    Inputs for degraded network allocation. If `incremental_degraded_allocation`
+    is set, include the intact network routes to reuse.
+    """
+    inputs = {
+        "edges": f"{wildcards.OUTPUT_DIR}/multi-modal_network/{wildcards.PROJECT}/{wildcards.HAZARD}/edges.gpq",
+        # degraded networks share the vertex ids of the intact network
+        "vertices": f"{wildcards.OUTPUT_DIR}/multi-modal_network/{wildcards.PROJECT}/vertices.parquet",
+        "od": f"{wildcards.OUTPUT_DIR}/input/trade_matrix/{wildcards.PROJECT}/trade_nodes_total.parquet",
+    }
+    if config["incremental_degraded_allocation"]:
+        inputs["intact_routes"] = f"{wildcards.OUTPUT_DIR}/flow_allocation/{wildcards.PROJECT}/routes.pq"
+        inputs["intact_edges"] = f"{wildcards.OUTPUT_DIR}/multi-modal_network/{wildcards.PROJECT}/edges.gpq"
+    return inputs
+
+
 rule allocate_degraded_network:
     """
     Allocate a trade OD matrix across a multi-modal transport network which has
     lost edges as a result of intersection with a hazard map.
 
+    If `incremental_degraded_allocation` is set, only flows whose intact route
+    used a removed edge are rerouted, the other intact routes are reused.
+
+    Routed batches are checkpointed to a `routing_work` directory alongside the
+    outputs, so an interrupted job will resume where it left off when re-run.
+
+    With `routing_backend: igraph`, every worker holds a private copy of the
+    graph, so memory grows with the number of cores. Use `scipy` for large
+    networks, its workers share one memory-mapped copy.
+
     Test with:
     snakemake -c1 -- results/flow_allocation/project-thailand/hazard-thai-floods-2011-JBA/edges.gpq 
     """
     input:
-        edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/edges.gpq",
-        od = "{OUTPUT_DIR}/input/trade_matrix/{PROJECT}/trade_nodes_total.parquet",
+        unpack(allocate_degraded_network_input)
     threads: workflow.cores
     params:
-        # if this changes, we want to trigger a re-run
+        # if these change, we want to trigger a re-run
         minimum_flow_volume_t = config["minimum_flow_volume_t"],
+        incremental_degraded_allocation = config["incremental_degraded_allocation"],
     output:
         routes = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/routes.pq",
         edges_with_flows = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/edges.gpq",
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/allocate.metrics.json",
     script:
         "./allocate.py"
 
 
+rule allocate_hazard_scenarios:
+    """
+    Allocate a trade OD matrix across a multi-modal transport network, and
+    across the network as degraded by each of the hazards listed in
+    `hazard_scenarios`, in one job. The graph is built once, and each hazard's
+    removed edges are masked rather than the graph being rebuilt. Edges are
+    removed where their exposure to the hazard exceeds `edge_failure_threshold`,
+    so no degraded network need be written for any hazard.
+
+    Each hazard's routes and edge flows are written to a subdirectory of the
+    output, named for the hazard.
+
+    Routed batches are checkpointed to a `hazard_scenarios_work` directory
+    alongside the output, so an interrupted job will resume where it left off
+    when re-run.
+
+    With `routing_backend: igraph`, every worker holds a private copy of the
+    graph, so memory grows with the number of cores. Use `scipy` for large
+    networks, its workers share one memory-mapped copy.
+
+    Test with:
+    snakemake -c1 -- results/flow_allocation/project-thailand/hazard_scenarios
+    """
+    input:
+        edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
+        vertices = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/vertices.parquet",
+        od = "{OUTPUT_DIR}/input/trade_matrix/{PROJECT}/trade_nodes_total.parquet",
+        exposure = expand(
+            "{{OUTPUT_DIR}}/multi-modal_network/{{PROJECT}}/{hazard}/exposure.pq",
+            hazard=config["hazard_scenarios"]
+        ),
+    threads: workflow.cores
+    params:
+        hazards = config["hazard_scenarios"],
+        # if these change, we want to trigger a re-run
+        minimum_flow_volume_t = config["minimum_flow_volume_t"],
+        edge_failure_threshold = config["edge_failure_threshold"],
+    output:
+        scenarios = directory("{OUTPUT_DIR}/flow_allocation/{PROJECT}/hazard_scenarios"),
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/hazard_scenarios.metrics.json",
+    script:
+        "./allocate_scenarios.py"
+
+
+rule edge_criticality:
+    """
+    Remove each road and rail edge carrying flow from the intact network in
+    turn, reroute the flows which crossed it and rank the edges by the
+    increase in transport cost (cost_USD_t * volume) of losing them.
+
+    Rerouting always uses igraph, every worker holding a private copy of the
+    graph and its weights, so memory grows with the number of cores.
+
+    Test with:
+    snakemake -c1 -- results/flow_allocation/project-thailand/edge_criticality.pq
+    """
+    input:
+        routes = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/routes.pq",
+        edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
+        vertices = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/vertices.parquet",
+    threads: workflow.cores
+    output:
+        criticality = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/edge_criticality.pq",
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/edge_criticality.metrics.json",
+    script:
+        "./edge_criticality.py"
+
+
 rule accumulate_route_costs_intact:
     """
     For each route in the OD (source -> destination pair), lookup the edges of
     the least cost route (the route taken) and sum those costs. Store alongside
     value and volume of route.
+
+    Destination links are identified by their mode ('imaginary'), not their
+    cost, so lookup_route_costs no longer takes a destination_link_cost_USD_t
+    argument. The output has an n_destination_links column (always 1, routes
+    with any other number are dropped) as well as the previous columns.
     
     Test with:
     snakemake -c1 -- results/flow_allocation/project-thailand/routes_with_costs.pq
@@ -55,10 +166,9 @@ rule accumulate_route_costs_intact:
         edges_with_flows = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/edges.gpq",
     output:
         routes_with_costs = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/routes_with_costs.pq",
-    run:
-        from trade_flow.routing import lookup_route_costs
-
-        lookup_route_costs(input.routes, input.edges_with_flows).to_parquet(output.routes_with_costs)
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/routes_with_costs.metrics.json",
+    script:
+        "./route_costs.py"
 
 
 rule accumulate_route_costs_degraded:
@@ -66,6 +176,11 @@ rule accumulate_route_costs_degraded:
     For each route in the OD (source -> destination pair), lookup the edges of
     the least cost route (the route taken) and sum those costs. Store alongside
     value and volume of route.
+
+    Destination links are identified by their mode ('imaginary'), not their
+    cost, so lookup_route_costs no longer takes a destination_link_cost_USD_t
+    argument. The output has an n_destination_links column (always 1, routes
+    with any other number are dropped) as well as the previous columns.
     
     Test with:
     snakemake -c1 -- results/flow_allocation/project-thailand/hazard-thai-floods-2011-JBA/routes_with_costs.pq
@@ -75,7 +190,6 @@ rule accumulate_route_costs_degraded:
         edges_with_flows = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/edges.gpq",
     output:
         routes_with_costs = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/routes_with_costs.pq",
-    run:
-        from trade_flow.routing import lookup_route_costs 
-
-        lookup_route_costs(input.routes, input.edges_with_flows).to_parquet(output.routes_with_costs)
+        metrics = "{OUTPUT_DIR}/flow_allocation/{PROJECT}/{HAZARD}/routes_with_costs.metrics.json",
+    script:
+        "./route_costs.py"
@@ -0,0 +1,96 @@
+import dataclasses
+import os
+import shutil
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from trade_flow.disruption import failed_edge_mask
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.routing import accumulate_edge_flows, masked_edge_map, route_scenarios
+
+
+if __name__ == "__main__":
+
+    with stage("allocate_scenarios.read_inputs"):
+        print("Reading network...")
+        # read in global multi-modal transport network
+        edges = gpd.read_parquet(snakemake.input.edges)
+        available_destinations = edges[edges["mode"] == "imaginary"].to_id.unique()
+        available_country_destinations = [d.split("_")[-1] for d in available_destinations if d.startswith("GID_")]
+
+        # integer vertex ids, shared by intact and degraded networks
+        vertices = pd.read_parquet(snakemake.input.vertices)
+
+        print("Reading OD matrix...")
+        # read in trade OD matrix
+        od = pd.read_parquet(snakemake.input.od)
+        print(f"OD has {len(od):,d} flows")
+
+    minimum_flow_volume_tons = snakemake.config["minimum_flow_volume_t"]
+    od = od[od.volume_tons > minimum_flow_volume_tons]
+    print(f"After dropping flows with volume < {minimum_flow_volume_tons}t, OD has {len(od):,d} flows")
+
+    # drop any flows we can't find a route to
+    od = od[od.partner_GID_0.isin(available_country_destinations)]
+    print(f"After dropping unrouteable destination countries, OD has {len(od):,d} flows")
+
+    print("Reading edge exposure to each hazard...")
+    # as remove_edges_in_excess_of_threshold, but masking edges rather than writing a degraded network
+    failure_threshold = float(snakemake.params.edge_failure_threshold)
+    edge_masks: dict[str, np.ndarray] = {}
+    for hazard, exposure_path in zip(snakemake.params.hazards, snakemake.input.exposure):
+        edge_masks[hazard] = failed_edge_mask(edges, pd.read_parquet(exposure_path), failure_threshold)
+        print(f"{hazard}: {edge_masks[hazard].sum():,d} edges removed")
+
+    # keep completed routing batches here, so an interrupted job can resume
+    work_dir = os.path.join(os.path.dirname(snakemake.output.scenarios), "hazard_scenarios_work")
+    _, scenario_routes = route_scenarios(
+        od,
+        edges,
+        edge_masks,
+        snakemake.threads,
+        root=snakemake.config["routing_root"],
+        batch_size=snakemake.config["routing_batch_size"],
+        work_dir=work_dir,
+        vertices=vertices,
+        backend=snakemake.config["routing_backend"],
+    )
+
+    for hazard, routes in scenario_routes.items():
+        print(f"Writing {hazard} routes and edge flows to disk...")
+        with stage("allocate_scenarios.write_outputs"):
+            hazard_dir = os.path.join(snakemake.output.scenarios, hazard)
+            os.makedirs(hazard_dir, exist_ok=True)
+
+            # as for allocate_degraded_network, edge indices are positions in the degraded edges table
+            degraded_edges = edges[~edge_masks[hazard]].copy()
+            routes = dataclasses.replace(
+                routes,
+                edge_indices=masked_edge_map(edge_masks[hazard])[routes.edge_indices].astype(np.int32)
+            )
+            routes.to_parquet(os.path.join(hazard_dir, "routes.pq"))
+
+            degraded_edges["value_kusd"], degraded_edges["volume_tons"] = accumulate_edge_flows(
+                routes.offsets,
+                routes.edge_indices,
+                routes.value_kusd,
+                routes.volume_tons,
+                len(degraded_edges)
+            )
+            degraded_edges.to_parquet(os.path.join(hazard_dir, "edges.gpq"))
+
+    print("Removing routing work directory...")
+    shutil.rmtree(work_dir)
+
+    print("Writing metrics...")
+    write_metrics(
+        snakemake.output.metrics,
+        threads=snakemake.threads,
+        n_flows=len(od),
+        n_edges=len(edges),
+        hazards=list(edge_masks.keys()),
+    )
+
+    print("Done")
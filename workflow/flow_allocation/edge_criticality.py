@@ -0,0 +1,29 @@
+import geopandas as gpd
+import pandas as pd
+
+from trade_flow.criticality import edge_criticality
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.route_store import RouteStore
+
+
+if __name__ == "__main__":
+
+    with stage("edge_criticality.read_inputs"):
+        edges = gpd.read_parquet(snakemake.input.edges)
+        routes = RouteStore.read_parquet(snakemake.input.routes)
+        vertices = pd.read_parquet(snakemake.input.vertices)
+
+    with stage("edge_criticality"):
+        criticality = edge_criticality(
+            routes,
+            edges,
+            snakemake.threads,
+            root=snakemake.config["routing_root"],
+            vertices=vertices,
+        )
+
+    with stage("edge_criticality.write"):
+        criticality.to_parquet(snakemake.output.criticality)
+
+    print("Writing metrics...")
+    write_metrics(snakemake.output.metrics, threads=snakemake.threads, n_edges=len(edges), n_routes=len(routes))
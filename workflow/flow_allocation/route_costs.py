@@ -0,0 +1,14 @@
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.routing import lookup_route_costs
+
+
+if __name__ == "__main__":
+
+    with stage("lookup_route_costs"):
+        costs = lookup_route_costs(snakemake.input.routes, snakemake.input.edges_with_flows)
+
+    with stage("lookup_route_costs.write"):
+        costs.to_parquet(snakemake.output.routes_with_costs)
+
+    print("Writing metrics...")
+    write_metrics(snakemake.output.metrics, n_routes=len(costs))
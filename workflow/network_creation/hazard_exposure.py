@@ -0,0 +1,26 @@
+import os
+
+import geopandas as gpd
+
+from trade_flow.disruption import tiled_edge_exposure
+from trade_flow.instrument import stage, write_metrics
+
+
+if __name__ == "__main__":
+
+    with stage("hazard_exposure.read_inputs"):
+        edges = gpd.read_parquet(snakemake.input.edges)
+        edges = edges.loc[edges["mode"].isin({"road", "rail"}), :]
+
+    exposure = tiled_edge_exposure(
+        edges,
+        snakemake.input.raster,
+        snakemake.threads,
+        cache_dir=os.path.join(os.path.dirname(snakemake.input.edges), "split_cache"),
+    )
+
+    with stage("hazard_exposure.write"):
+        exposure.to_parquet(snakemake.output.exposure)
+
+    print("Writing metrics...")
+    write_metrics(snakemake.output.metrics, threads=snakemake.threads, n_edges=len(edges))
@@ -0,0 +1,54 @@
+import os
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.maritime import maritime_route_geometries
+from trade_flow.network_creation import preprocess_maritime_network
+
+
+if __name__ == "__main__":
+
+    # possible cargo types = ("container", "dry_bulk", "general_cargo",  "roro", "tanker")
+    # for now, just use 'general_cargo'
+    with stage("maritime.preprocess"):
+        maritime_nodes, maritime_edges_no_geom = preprocess_maritime_network(
+            snakemake.input.nodes,
+            snakemake.input.edges_no_geom
+        )
+
+    if snakemake.config["study_country_iso_a3"] == "THA":
+        # put Bangkok port in the right place...
+        maritime_nodes.loc[maritime_nodes.name == "Bangkok_Thailand", "geometry"] = Point((100.5753, 13.7037))
+
+    # Jasper's maritime edges in 'edges_by_cargo' do not contain geometry
+    # this is because the AIS data that they were derived from only contain origin and destination port, not route
+    # this is a pain for visualisation, so we will create a geometry for each from `maritime_vis_edges`
+
+    # route geometries are cached by the content of the visualisation
+    # network, so re-running this rule for other reasons is fast
+    maritime_edges = maritime_edges_no_geom.copy()
+    change_of_port_mask = maritime_edges_no_geom.from_port != maritime_edges_no_geom.to_port
+    with stage("maritime_route_geometries"):
+        maritime_edges["geometry"] = maritime_route_geometries(
+            maritime_edges_no_geom[change_of_port_mask],
+            snakemake.input.edges_visualisation,
+            snakemake.threads,
+            cache_dir=os.path.join(os.path.dirname(snakemake.output.edges), "route_geometry_cache"),
+        )
+
+    maritime_edges = gpd.GeoDataFrame(maritime_edges).set_crs(epsg=4326)
+
+    with stage("maritime.write"):
+        maritime_nodes.to_parquet(snakemake.output.nodes)
+        maritime_edges.to_parquet(snakemake.output.edges)
+
+    print("Writing metrics...")
+    write_metrics(
+        snakemake.output.metrics,
+        threads=snakemake.threads,
+        n_nodes=len(maritime_nodes),
+        n_edges=len(maritime_edges),
+        n_routed_edges=int(change_of_port_mask.sum()),
+    )
@@ -3,6 +3,9 @@ rule create_multi_modal_network:
     Take previously created road, rail and maritime networks and combine them
     into a single multi-modal network with intermodal connections within
     distance limit of: any road node, any rail station and any maritime port.
+
+    Node ids are also interned as integer vertex ids, written to the vertices
+    table and as from_vid and to_vid columns of the edges.
     """
     input:
         admin_boundaries = "{OUTPUT_DIR}/input/admin-boundaries/admin-level-0.geoparquet",
@@ -12,64 +15,62 @@ rule create_multi_modal_network:
         rail_network_edges = "{OUTPUT_DIR}/input/networks/rail/{PROJECT}/edges.gpq",
         maritime_nodes = "{OUTPUT_DIR}/maritime_network/nodes.gpq",
         maritime_edges = "{OUTPUT_DIR}/maritime_network/edges.gpq",
+    params:
+        # if this changes, we want to trigger a re-run
+        port_road_connections = config["port_road_connections"],
     output:
         border_crossing_plot = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/border_crossings.png",
         nodes = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/nodes.gpq",
         edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
+        vertices = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/vertices.parquet",
+        # stage timings and memory use
+        metrics = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/build.metrics.json",
     script:
         "./multi_modal.py"
 
 
-rule remove_edges_in_excess_of_threshold:
+rule hazard_exposure:
     """
-    Take part of multi-modal network and remove edges that experience hazard
-    values in excess of a given threshold.
+    Summarise the hazard values each road and rail edge of the multi-modal
+    network is exposed to.
+
+    Edges are assigned to square tiles of the raster and tiles are intersected
+    in parallel, skipping those without hazard. Splits of edges by raster grid
+    are cached, keyed by the tile's edges and the grid, so other hazards on the
+    same grid reuse them.
+
+    Pixels equal to the raster's nodata value are treated as missing, not as
+    hazard values, so contribute to neither the maximum, the mean nor the
+    exposed fraction of an edge. Previously nodata values were compared with
+    the failure threshold as any other value.
     """
     input:
         edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
         raster = "{OUTPUT_DIR}/hazard/{HAZARD}.tif",
+    threads: workflow.cores
     output:
-        edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/chunks/{CHUNK}/edges.gpq"
-    run:
-        import geopandas as gpd
-        import numpy as np
-
-        from trade_flow.disruption import filter_edges_by_raster
-
-        i = int(wildcards.CHUNK.split("-")[-1])
-        edges = gpd.read_parquet(input.edges)
-        edges = edges.loc[edges["mode"].isin({"road", "rail"}), :]
-        chunk_size = int(np.ceil(len(edges) / workflow.cores))
-        print(f"Chunk {i}: intersecting edges [{i * chunk_size}: {(i + 1) * chunk_size}]")
-
-        surviving_edges = filter_edges_by_raster(
-            edges.iloc[i * chunk_size: (i + 1) * chunk_size, :],
-            input.raster,
-            float(config["edge_failure_threshold"])
-        )
-
-        surviving_edges.to_parquet(output.edges)
+        exposure = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/exposure.pq",
+        metrics = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/exposure.metrics.json",
+    script:
+        "./hazard_exposure.py"
 
 
-rule join_intersection_results:
+rule remove_edges_in_excess_of_threshold:
     """
-    Pull together chunks of intersection operation to remove edges exceeding threshold value.
+    Remove edges with hazard exposure exceeding threshold value.
+
+    Changing the threshold only re-runs this rule, not the intersection.
+    Edges exposed only to nodata pixels of the hazard raster do not fail,
+    whatever the nodata value, see hazard_exposure.
     """
     input:
         all_edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/edges.gpq",
-        intersected_edges = expand(
-            "{{OUTPUT_DIR}}/multi-modal_network/{{PROJECT}}/{{HAZARD}}/chunks/chunk-{chunk}/edges.gpq",
-            chunk=range(0, workflow.cores)
-        )
+        exposure = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/exposure.pq",
+    params:
+        # if this changes, we want to trigger a re-run
+        edge_failure_threshold = config["edge_failure_threshold"],
     output:
         edges = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/edges.gpq",
-    run:
-        import geopandas as gpd
-        import pandas as pd
-
-        all_edges = gpd.read_parquet(input.all_edges)
-
-        intersected_edges_post_hazard = pd.concat([gpd.read_parquet(path) for path in input.intersected_edges])
-        edges = pd.concat([all_edges.loc[~all_edges["mode"].isin({"road", "rail"}), :], intersected_edges_post_hazard])
-
-        edges.to_parquet(output.edges)
\ No newline at end of file
+        metrics = "{OUTPUT_DIR}/multi-modal_network/{PROJECT}/{HAZARD}/edges.metrics.json",
+    script:
+        "./remove_edges.py"
@@ -0,0 +1,39 @@
+import geopandas as gpd
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.plot import chop_at_antimeridian
+
+matplotlib.use("Agg")
+plt.style.use("bmh")
+
+if __name__ == "__main__":
+
+    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    world.geometry = world.geometry.boundary
+
+    maritime_nodes = gpd.read_parquet(snakemake.input.nodes)
+    maritime_edges = gpd.read_parquet(snakemake.input.edges)
+
+    # whole network
+    with stage("plot_maritime_network"):
+        f, ax = plt.subplots(figsize=(16, 7))
+        chop_at_antimeridian(maritime_edges, drop_null_geometry=True).plot(
+            ax=ax,
+            linewidth=0.5,
+            alpha=0.8
+        )
+        world.plot(ax=ax, lw=0.5, alpha=0.2)
+        ax.set_xticks(np.linspace(-180, 180, 13))
+        ax.set_yticks([-60, -30, 0, 30, 60])
+        ax.set_ylim(-65, 85)
+        ax.set_xlim(-180, 180)
+        ax.grid(alpha=0.3)
+        ax.set_xlabel("Longitude [deg]")
+        ax.set_ylabel("Latitude [deg]")
+        f.savefig(snakemake.output.edges_plot)
+
+    print("Writing metrics...")
+    write_metrics(snakemake.output.metrics, n_edges=len(maritime_edges))
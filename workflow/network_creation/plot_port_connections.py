@@ -0,0 +1,25 @@
+import geopandas as gpd
+
+from trade_flow.instrument import stage, write_metrics
+from trade_flow.plot import plot_port_connections
+
+
+if __name__ == "__main__":
+
+    maritime_nodes = gpd.read_parquet(snakemake.input.nodes)
+    maritime_edges = gpd.read_parquet(snakemake.input.edges)
+
+    # disambiguate the global view and plot the routes from each port, one port at a time
+    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
+    world.geometry = world.geometry.boundary
+
+    with stage("plot_port_connections"):
+        plot_port_connections(maritime_nodes, maritime_edges, world, snakemake.output.port_trade_plots, snakemake.threads)
+
+    print("Writing metrics...")
+    write_metrics(
+        snakemake.output.metrics,
+        threads=snakemake.threads,
+        n_nodes=len(maritime_nodes),
+        n_edges=len(maritime_edges)
+    )
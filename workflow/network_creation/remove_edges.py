@@ -0,0 +1,21 @@
+import geopandas as gpd
+import pandas as pd
+
+from trade_flow.disruption import filter_edges_by_exposure
+from trade_flow.instrument import stage, write_metrics
+
+
+if __name__ == "__main__":
+
+    with stage("remove_edges.read_inputs"):
+        all_edges = gpd.read_parquet(snakemake.input.all_edges)
+        exposure = pd.read_parquet(snakemake.input.exposure)
+
+    with stage("filter_edges_by_exposure"):
+        edges = filter_edges_by_exposure(all_edges, exposure, float(snakemake.params.edge_failure_threshold))
+
+    with stage("remove_edges.write"):
+        edges.to_parquet(snakemake.output.edges)
+
+    print("Writing metrics...")
+    write_metrics(snakemake.output.metrics, n_edges=len(all_edges), n_removed=len(all_edges) - len(edges))